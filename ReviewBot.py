@@ -5,13 +5,17 @@ import os
 import sys
 import re
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Generator, List, Optional, Tuple, Union
 import cmdln
+from collections import defaultdict
 from collections import namedtuple
 from collections import OrderedDict
 from osclib.cache import Cache
 from osclib.core import action_is_patchinfo
 from osclib.core import devel_project_fallback
+from osclib.core import devel_project_get
 from osclib.core import group_members
 from osclib.core import maintainers_get
 from osclib.core import package_role_expand
@@ -60,6 +64,116 @@ class PackageLookup(object):
         return self.platform.get_path('source', prj, '00Meta', 'lookup.yml')
 
 
+class RequestPrefetch(object):
+    """
+    Source info and devel projects of the packages involved in a batch of
+    requests, fetched with as few queries as possible.
+
+    Lookups return None if the answer was not prefetched, in which case the
+    caller has to fall back to its own per package query. The stats count the
+    bulk queries made and the per package queries avoided.
+    """
+
+    CHUNK_SIZE = 50
+
+    def __init__(self, apiurl, logger):
+        self.apiurl = apiurl
+        self.logger = logger
+        self.sourceinfo = {}
+        self.package_meta = {}
+        self.stats = {'queries': 0, 'avoided': 0}
+
+    def load(self, requests):
+        sources = defaultdict(set)
+        targets = defaultdict(set)
+        for req in requests:
+            for action in req.actions:
+                src_project = getattr(action, 'src_project', None)
+                src_package = getattr(action, 'src_package', None)
+                if src_project and src_package:
+                    sources[src_project].add(src_package)
+
+                tgt_project = getattr(action, 'tgt_project', None)
+                tgt_package = getattr(action, 'tgt_package', None)
+                if tgt_project and tgt_package:
+                    sources[tgt_project].add(tgt_package)
+                    targets[tgt_project].add(tgt_package)
+
+        for project, packages in sources.items():
+            for chunk in self._chunks(packages):
+                self._load_sourceinfo(project, chunk)
+        for project, packages in targets.items():
+            for chunk in self._chunks(packages):
+                self._load_package_meta(project, chunk)
+
+        self.logger.debug('prefetched {} source infos and {} package metas in {} queries'.format(
+            len(self.sourceinfo), len(self.package_meta), self.stats['queries']))
+
+    def _chunks(self, packages):
+        packages = sorted(packages)
+        for i in range(0, len(packages), self.CHUNK_SIZE):
+            yield packages[i:i + self.CHUNK_SIZE]
+
+    def _get(self, path, query):
+        self.stats['queries'] += 1
+        url = osc.core.makeurl(self.apiurl, path, query)
+        try:
+            return ET.parse(osc.core.http_GET(url)).getroot()
+        except (HTTPError, URLError) as e:
+            # left for the per package queries to handle
+            self.logger.debug(f'prefetch of {url} failed: {e}')
+            return None
+
+    def _load_sourceinfo(self, project, packages):
+        root = self._get(('source', project), {'view': 'info', 'package': packages})
+        if root is None:
+            return
+        for sourceinfo in root.findall('sourceinfo'):
+            if sourceinfo.find('error') is None:
+                self.sourceinfo[(project, sourceinfo.get('package'))] = sourceinfo
+
+    def _load_package_meta(self, project, packages):
+        names = ' or '.join(f"@name='{package}'" for package in packages)
+        root = self._get(('search', 'package'), {'match': f"@project='{project}' and ({names})"})
+        if root is None:
+            return
+        for meta in root.findall('package'):
+            self.package_meta[(project, meta.get('name'))] = meta
+
+    def get_sourceinfo(self, project, package, rev=None):
+        sourceinfo = self.sourceinfo.get((project, package))
+        if sourceinfo is None:
+            return None
+        # the prefetched info is of the latest revision
+        if rev is not None and rev not in (sourceinfo.get('srcmd5'), sourceinfo.get('rev')):
+            return None
+        self.stats['avoided'] += 1
+        return sourceinfo
+
+    def get_linktarget(self, project, package):
+        sourceinfo = self.sourceinfo.get((project, package))
+        if sourceinfo is None:
+            return None
+        self.stats['avoided'] += 1
+        # the first entry is the package linked directly
+        linked = sourceinfo.find('linked')
+        if linked is None:
+            return (None, None)
+        return (linked.get('project'), linked.get('package'))
+
+    def get_devel_project(self, project, package):
+        meta = self.package_meta.get((project, package))
+        # devel_project_get() also consults the git devel mapping for
+        # packages without a devel project
+        if meta is None or (meta.find('devel') is None and project.endswith('openSUSE:Factory')):
+            return None
+        self.stats['avoided'] += 1
+        devel = meta.find('devel')
+        if devel is None:
+            return (None, None)
+        return (devel.get('project'), devel.get('package'))
+
+
 @unique
 class ReviewChoices(Enum):
     NORMAL = 'normal'
@@ -70,6 +184,37 @@ class ReviewChoices(Enum):
     FALLBACK_ALWAYS = 'fallback-always'
 
 
+class RequestState(object):
+    """
+    Attribute of a ReviewBot holding state of the request being checked.
+
+    When requests are checked by workers each check gets its own copy so that
+    concurrent checks do not see each other's values. Values not yet set for a
+    request, and all values outside of a check, live on the instance as usual.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        state = obj._request_state()
+        if state is not None and self.name in state:
+            return state[self.name]
+        try:
+            return obj.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+
+    def __set__(self, obj, value):
+        state = obj._request_state()
+        if state is not None:
+            state[self.name] = value
+        else:
+            obj.__dict__[self.name] = value
+
+
 class ReviewBot(object):
     """
     A generic obs request reviewer
@@ -77,6 +222,10 @@ class ReviewBot(object):
 
     def check_action_<type>(self, req, action):
         return (None|True|False)
+
+    Implementations which store their own per request attributes must add
+    them to REQUEST_STATE and set SUPPORTS_WORKERS to support checking
+    requests with multiple workers.
     """
 
     DEFAULT_REVIEW_MESSAGES = {'accepted': 'ok', 'declined': 'review failed'}
@@ -85,6 +234,11 @@ class ReviewBot(object):
         ReviewChoices.ACCEPT_ONPASS, ReviewChoices.FALLBACK_ONFAIL, ReviewChoices.FALLBACK_ALWAYS
     )
 
+    # attributes only valid for the request being checked
+    REQUEST_STATE: Tuple[str, ...] = ('request', 'action', 'multiple_actions', 'review_messages', 'comment_handler')
+    # set by implementations whose per request state is all in REQUEST_STATE
+    SUPPORTS_WORKERS = False
+
     COMMENT_MARKER_REGEX = re.compile(r'<!-- (?P<bot>[^ ]+) state=(?P<state>[^ ]+)(?: result=(?P<result>[^ ]+))? -->')
 
     # map of default config entries
@@ -112,6 +266,7 @@ class ReviewBot(object):
         # manually assigning to _apiurl here to workaround the chicken-and-egg
         # problem
         self._apiurl = apiurl
+        self._request_local = threading.local()
 
         self.gitea_url = gitea_url
         self.git_base_url = git_base_url
@@ -134,6 +289,9 @@ class ReviewBot(object):
         self.override_group_key = f'{self.bot_name.lower()}-override-group'
         self.request_age_min_default = 0
         self.request_age_min_key = f'{self.bot_name.lower()}-request-age-min'
+        self.workers = 1
+        self.prefetch = False
+        self.prefetched = None
 
         self._init_scm(scm_type.upper())
         self._init_platform(platform_type.upper())
@@ -144,6 +302,20 @@ class ReviewBot(object):
 
         self.load_config()
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._install_request_state()
+
+    @classmethod
+    def _install_request_state(cls):
+        for name in cls.REQUEST_STATE:
+            if not isinstance(getattr(cls, name, None), RequestState):
+                setattr(cls, name, RequestState(name))
+
+    def _request_state(self):
+        local = self.__dict__.get('_request_local')
+        return getattr(local, 'state', None) if local is not None else None
+
     def _init_scm(self, scm_type):
         if scm_type == "OSC":
             self.scm = scm.OSC(self.apiurl)
@@ -249,44 +421,101 @@ class ReviewBot(object):
         self.prepare_review()
         return_value = 0
 
-        for req in self.requests:
-            self.logger.info(f"checking {req.reqid}")
-            self.request = req
-
-            # XXX: this is a hack. Annotating the request with staging_project.
-            # OBS itself should provide an API for that but that's currently not the case
-            # https://github.com/openSUSE/openSUSE-release-tools/pull/2377
-            if not hasattr(req, 'staging_project'):
-                staging_project = None
-                for r in req.reviews:
-                    if r.state == 'new' and r.by_project and ":Staging:" in r.by_project:
-                        staging_project = r.by_project
-                        break
-                setattr(req, 'staging_project', staging_project)
+        self.prefetched = None
+        if self.prefetch and self.platform.name == 'OBS':
+            self.prefetched = RequestPrefetch(self.apiurl, self.logger)
+            self.prefetched.load(self.requests)
+
+        if self.workers > 1:
+            return_value = self.check_requests_concurrent()
+        else:
+            for req in self.requests:
+                good, failed = self._check_request(req)
+                if failed:
+                    return_value = 1
+                self._apply_review(req, good)
+
+        if self.prefetched:
+            self.logger.info('prefetch: {queries} bulk queries, {avoided} per package queries avoided'.format(
+                **self.prefetched.stats))
+
+        return return_value
+
+    def check_requests_concurrent(self):
+        """
+        Check requests using a pool of self.workers threads.
+
+        Each check runs with its own request state. The reviews are changed by
+        the calling thread in the order of self.requests once the respective
+        check has finished.
+        """
+        return_value = 0
 
+        def work(req):
+            self._request_local.state = state = {}
             try:
-                good = self.check_one_request(req)
-            except Exception:
-                good = None
-
-                import traceback
-                traceback.print_exc()
-                return_value = 1
-
-            if self.review_mode == ReviewChoices.NO:
-                good = None
-            elif self.review_mode == ReviewChoices.ACCEPT:
-                good = True
-
-            if good is None:
-                self.logger.info(f"{req.reqid} ignored")
-            elif good:
-                self._set_review(req, 'accepted')
-            elif self.review_mode != ReviewChoices.ACCEPT_ONPASS:
-                self._set_review(req, 'declined')
+                return self._check_request(req) + (state,)
+            finally:
+                self._request_local.state = None
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(work, req) for req in self.requests]
+            for req, future in zip(self.requests, futures):
+                good, failed, state = future.result()
+                if failed:
+                    return_value = 1
+
+                self._request_local.state = state
+                try:
+                    self._apply_review(req, good)
+                finally:
+                    self._request_local.state = None
 
         return return_value
 
+    def _check_request(self, req):
+        """Run check_one_request() for req and return (good, failed)."""
+        self.logger.info(f"checking {req.reqid}")
+        self.request = req
+        start = time.time()
+
+        # XXX: this is a hack. Annotating the request with staging_project.
+        # OBS itself should provide an API for that but that's currently not the case
+        # https://github.com/openSUSE/openSUSE-release-tools/pull/2377
+        if not hasattr(req, 'staging_project'):
+            staging_project = None
+            for r in req.reviews:
+                if r.state == 'new' and r.by_project and ":Staging:" in r.by_project:
+                    staging_project = r.by_project
+                    break
+            setattr(req, 'staging_project', staging_project)
+
+        failed = False
+        try:
+            good = self.check_one_request(req)
+        except Exception:
+            good = None
+
+            import traceback
+            traceback.print_exc()
+            failed = True
+
+        self.logger.info(f"{req.reqid} checked in {time.time() - start:.2f}s")
+        return good, failed
+
+    def _apply_review(self, req, good):
+        if self.review_mode == ReviewChoices.NO:
+            good = None
+        elif self.review_mode == ReviewChoices.ACCEPT:
+            good = True
+
+        if good is None:
+            self.logger.info(f"{req.reqid} ignored")
+        elif good:
+            self._set_review(req, 'accepted')
+        elif self.review_mode != ReviewChoices.ACCEPT_ONPASS:
+            self._set_review(req, 'declined')
+
     @memoize(session=True)
     def request_override_check_users(self, project: str) -> List[str]:
         """Determine users allowed to override review in a comment command."""
@@ -658,8 +887,16 @@ class ReviewBot(object):
         except (HTTPError, URLError):
             return None
 
+    def _sourceinfo(self, project, package, rev=None):
+        if self.prefetched:
+            root = self.prefetched.get_sourceinfo(project, package, rev)
+            if root is not None:
+                return root
+
+        return ReviewBot._get_sourceinfo(self.apiurl, project, package, rev)
+
     def get_originproject(self, project, package, rev=None):
-        root = ReviewBot._get_sourceinfo(self.apiurl, project, package, rev)
+        root = self._sourceinfo(project, package, rev)
         if root is None:
             return None
 
@@ -670,7 +907,7 @@ class ReviewBot(object):
         return None
 
     def get_sourceinfo(self, project, package, rev=None):
-        root = ReviewBot._get_sourceinfo(self.apiurl, project, package, rev)
+        root = self._sourceinfo(project, package, rev)
         if root is None:
             return None
 
@@ -685,6 +922,10 @@ class ReviewBot(object):
             return pkg
 
     def _get_linktarget(self, src_project, src_package):
+        if self.prefetched:
+            linktarget = self.prefetched.get_linktarget(src_project, src_package)
+            if linktarget is not None:
+                return linktarget
 
         query = {}
         url = osc.core.makeurl(self.apiurl, ('source', src_project, src_package), query=query)
@@ -700,6 +941,15 @@ class ReviewBot(object):
 
         return (None, None)
 
+    def devel_project_get(self, project, package):
+        """devel_project_get() answered from the prefetched package metas when possible."""
+        if self.prefetched:
+            devel = self.prefetched.get_devel_project(project, package)
+            if devel is not None:
+                return devel
+
+        return devel_project_get(self.apiurl, project, package)
+
     def can_accept_review(self, req):
         """return True if there is a new review for the specified reviewer"""
         return self.platform.can_accept_review(req, review_user=self.review_user, review_group=self.review_group)
@@ -902,12 +1152,19 @@ class ReviewBot(object):
         return False
 
 
+ReviewBot._install_request_state()
+
+
 class CommentFromLogHandler(logging.Handler):
     def __init__(self, level=logging.INFO):
         super(CommentFromLogHandler, self).__init__(level)
         self.lines = []
+        # only collect messages about the request checked by this thread
+        self.thread = threading.get_ident()
 
     def emit(self, record):
+        if record.thread != self.thread:
+            return
         self.lines.append(record.getMessage())
 
 
@@ -939,6 +1196,10 @@ class CommandLineInterface(cmdln.Cmdln):
                           default="https://src.opensuse.org",
                           help="Base URL for git checkouts (only relevent when scm is git). The GIT_BASE_URL environment variable"
                           " overrides this option")
+        parser.add_option('--workers', type='int', default=1, metavar='N',
+                          help='check up to N requests concurrently')
+        parser.add_option('--prefetch', action='store_true',
+                          help='fetch source info and devel projects of all requests in bulk before checking them')
 
         return parser
 
@@ -972,6 +1233,11 @@ class CommandLineInterface(cmdln.Cmdln):
         if self.options.fallback_group:
             self.checker.fallback_group = self.options.fallback_group
 
+        if self.options.workers > 1 and not self.checker.SUPPORTS_WORKERS:
+            self.optparser.error(f'{self.checker.__class__.__name__} does not support --workers above 1')
+        self.checker.workers = self.options.workers
+        self.checker.prefetch = self.options.prefetch
+
     def setup_checker(self):
         """ reimplement this """
         user = self.options.user
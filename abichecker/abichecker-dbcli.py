@@ -6,7 +6,7 @@ import logging
 import cmdln
 
 import abichecker_dbmodel as DB
-from abichecker_common import Config, CACHEDIR
+from abichecker_common import Config, DumpCache, CACHEDIR
 from datetime import datetime, timedelta
 
 class BoilderPlate(cmdln.Cmdln):
@@ -67,6 +67,20 @@ class BoilderPlate(cmdln.Cmdln):
             self.session.delete(req)
         self.session.commit()
 
+        DumpCache(self.session).prune(oldest)
+
+    def do_dumps(self, subcmd, opts, *args):
+        """${cmd_name}: show ABI dump cache statistics
+
+        ${cmd_usage}
+        ${cmd_option_list}
+        """
+
+        stats = DumpCache(self.session).stats()
+        lookups = stats.hits + stats.dumps
+        print(f'{stats.dumps} dumps, {stats.hits} hits ({100 * stats.hits / lookups if lookups else 0:.1f}%)')
+        print(f'{stats.seconds:.0f}s spent dumping, {stats.saved:.0f}s saved')
+
     def do_log(self, subcmd, opts, request_id):
         """${cmd_name}: foo bar
 
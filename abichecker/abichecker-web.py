@@ -5,6 +5,7 @@ import sys
 from abichecker_dbmodel import *
 from abichecker_common import CACHEDIR
 from abichecker_common import Config
+from abichecker_common import DumpCache
 
 from flask import Flask, request, session, url_for, redirect, \
 render_template, send_file, abort, g, flash, _app_ctx_stack
@@ -33,6 +34,15 @@ def request(request_id):
     return render_template('request.html', request = request, obsurl = config.get('obs-weburl', "https://build.opensuse.org/"))
 
 
+@app.route('/dumps')
+def dumps():
+    session = db_session()
+    stats = DumpCache(session).stats()
+    dumps = session.query(ABIDump).order_by(ABIDump.hits.desc()).limit(200).all()
+
+    return render_template('dumps.html', stats = stats, dumps = dumps)
+
+
 @app.route('/report/<int:report_id>')
 def report(report_id):
     session = db_session()
@@ -2,8 +2,9 @@
 
 from pprint import pformat
 from stat import S_ISREG, S_ISLNK
-from tempfile import NamedTemporaryFile
+from tempfile import TemporaryFile
 import cmdln
+import hashlib
 import logging
 import os
 import re
@@ -18,7 +19,7 @@ from lxml import etree as ET
 
 import osc.conf
 import osc.core
-from osc.util.cpio import CpioRead
+from osclib.cpio import CpioReader
 
 from urllib.error import HTTPError
 
@@ -27,6 +28,7 @@ from collections import namedtuple
 from osclib.comments import CommentAPI
 
 from abichecker_common import CACHEDIR
+from abichecker_common import DumpCache
 
 import ReviewBot
 
@@ -175,8 +177,12 @@ class ABIChecker(ReviewBot.ReviewBot):
         # or comments
         self.text_summary = ''
 
+        DB.Base.metadata.create_all(DB.db_engine())
         self.session = DB.db_session()
 
+        # dumps of target libraries, reused until the target is rebuilt
+        self.dumpcache = DumpCache(self.session)
+
         self.dblogger = LogToDB(self.session)
 
         self.logger.addFilter(self.dblogger)
@@ -300,7 +306,7 @@ class ABIChecker(ReviewBot.ReviewBot):
 
         for mr in myrepos:
             try:
-                dst_libs, dst_libdebug = self.extract(dst_project, dst_package, dst_srcinfo, mr.dstrepo, mr.arch)
+                dst_libs, dst_libdebug, dst_dumpkeys = self.extract(dst_project, dst_package, dst_srcinfo, mr.dstrepo, mr.arch, self.dumpcache)
                 # nothing to fetch, so no libs
                 if dst_libs is None:
                     continue
@@ -320,7 +326,7 @@ class ABIChecker(ReviewBot.ReviewBot):
                 continue
 
             try:
-                src_libs, src_libdebug = self.extract(src_project, src_package, src_srcinfo, mr.srcrepo, mr.arch)
+                src_libs, src_libdebug, _ = self.extract(src_project, src_package, src_srcinfo, mr.srcrepo, mr.arch)
                 if src_libs is None:
                     if dst_libs:
                         self.text_summary += "*Warning*: the submission does not contain any libs anymore\n\n"
@@ -368,16 +374,13 @@ class ABIChecker(ReviewBot.ReviewBot):
 
             # for each pair dump and compare the abi
             for old, new in pairs:
-                # abi dump of old lib
+                # abi dump of old lib, only unpacked if not cached
                 old_base = os.path.join(UNPACKDIR, dst_project, dst_package, mr.dstrepo, mr.arch)
-                old_dump = os.path.join(CACHEDIR, 'old.dump')
                 # abi dump of new lib
                 new_base = os.path.join(UNPACKDIR, src_project, src_package, mr.srcrepo, mr.arch)
                 new_dump = os.path.join(CACHEDIR, 'new.dump')
 
                 def cleanup():
-                    if os.path.exists(old_dump):
-                        os.unlink(old_dump)
                     if os.path.exists(new_dump):
                         os.unlink(new_dump)
 
@@ -387,9 +390,14 @@ class ABIChecker(ReviewBot.ReviewBot):
                 m = so_re.match(old)
                 htmlreport = f'report-{mr.srcrepo}-{os.path.basename(old)}-{mr.dstrepo}-{os.path.basename(new)}-{mr.arch}-{int(time.time()):08x}.html'
 
+                old_dump = None
+                if m:
+                    old_dump = self.dumpcache.dump(dst_dumpkeys[old],
+                        lambda output: self.run_abi_dumper(output, old_base, old, dst_libdebug[old]),
+                        project = dst_project, package = dst_package, repo = mr.dstrepo, arch = mr.arch, lib = old)
+
                 # run abichecker
-                if m \
-                    and self.run_abi_dumper(old_dump, old_base, old, dst_libdebug[old]) \
+                if old_dump \
                     and self.run_abi_dumper(new_dump, new_base, new, src_libdebug[new]):
                         reportfn = os.path.join(CACHEDIR, htmlreport)
                         r = self.run_abi_checker(m.group(1), old_dump, new_dump, reportfn)
@@ -677,69 +685,75 @@ class ABIChecker(ReviewBot.ReviewBot):
             return False
         return True
 
-    def extract(self, project, package, srcinfo, repo, arch):
+    def extract(self, project, package, srcinfo, repo, arch, dumpcache = None):
+            """ fetch and unpack the libraries of a package. Libraries with
+            a dump in dumpcache are neither fetched nor unpacked.
+            Returns the libraries, their debug files and dump keys
+            """
             # fetch cpio headers
             # check file lists for library packages
-            fetchlist, liblist, debuglist = self.compute_fetchlist(project, package, srcinfo, repo, arch)
+            libpackages, liblist, debuglist, dumpkeys = self.compute_fetchlist(project, package, srcinfo, repo, arch)
 
-            if not fetchlist:
+            if not libpackages:
                 msg = f"no libraries found in {project}/{package} {repo}/{arch}"
                 self.logger.info(msg)
-                return None, None
+                return None, None, None
 
-            # mtimes in cpio are not the original ones, so we need to fetch
-            # that separately :-(
-            mtimes= self._getmtimes(project, package, repo, arch)
+            fetchlist = set()
+            for lib, rpms in libpackages.items():
+                if dumpcache is not None and dumpcache.has(dumpkeys[lib]):
+                    self.logger.debug("using cached dump of %s", lib)
+                    continue
+                fetchlist.update(rpms)
 
             self.logger.debug("fetchlist %s", pformat(fetchlist))
             self.logger.debug("liblist %s", pformat(liblist))
             self.logger.debug("debuglist %s", pformat(debuglist))
 
+            if not fetchlist:
+                return liblist, debuglist, dumpkeys
+
+            # mtimes in cpio are not the original ones, so we need to fetch
+            # that separately :-(
+            mtimes= self._getmtimes(project, package, repo, arch)
+
             debugfiles = debuglist.values()
 
             # fetch binary rpms
             downloaded = self.download_files(project, package, repo, arch, fetchlist, mtimes)
 
             # extract binary rpms
-            tmpfile = os.path.join(CACHEDIR, "cpio")
             for fn in fetchlist:
                 self.logger.debug(f"extract {fn}")
-                with open(tmpfile, 'wb') as tmpfd:
-                    if fn not in downloaded:
-                        raise FetchError(f"{fn} was not downloaded!")
-                    self.logger.debug(downloaded[fn])
-                    r = subprocess.call(['rpm2cpio', downloaded[fn]], stdout=tmpfd, close_fds=True)
-                    if r != 0:
-                        raise FetchError(f"failed to extract {fn}!")
-                    tmpfd.close()
-                    os.unlink(downloaded[fn])
-                    cpio = CpioRead(tmpfile)
-                    cpio.read()
-                    for ch in cpio:
-                        fn = ch.filename.decode('utf-8')
-                        if fn.startswith('./'): # rpm payload is relative
-                            fn = fn[1:]
-                        self.logger.debug("cpio fn %s", fn)
-                        if fn not in liblist and fn not in debugfiles:
-                            continue
-                        dst = os.path.join(UNPACKDIR, project, package, repo, arch)
-                        dst += fn
-                        if not os.path.exists(os.path.dirname(dst)):
-                            os.makedirs(os.path.dirname(dst))
-                        self.logger.debug("dst %s", dst)
-                        # the filehandle in the cpio archive is private so
-                        # open it again
-                        with open(tmpfile, 'rb') as cpiofh:
-                            cpiofh.seek(ch.dataoff, os.SEEK_SET)
+                if fn not in downloaded:
+                    raise FetchError(f"{fn} was not downloaded!")
+                self.logger.debug(downloaded[fn])
+                with subprocess.Popen(['rpm2cpio', downloaded[fn]], stdout=subprocess.PIPE, close_fds=True) as p:
+                    try:
+                        for cpiofn, size, reader in CpioReader(p.stdout):
+                            if cpiofn.startswith('./'): # rpm payload is relative
+                                cpiofn = cpiofn[1:]
+                            self.logger.debug("cpio fn %s", cpiofn)
+                            if cpiofn not in liblist and cpiofn not in debugfiles:
+                                continue
+                            dst = os.path.join(UNPACKDIR, project, package, repo, arch)
+                            dst += cpiofn
+                            if not os.path.exists(os.path.dirname(dst)):
+                                os.makedirs(os.path.dirname(dst))
+                            self.logger.debug("dst %s", dst)
                             with open(dst, 'wb') as fh:
-                                while True:
-                                    buf = cpiofh.read(4096)
-                                    if buf is None or buf == b'':
-                                        break
-                                    fh.write(buf)
-            os.unlink(tmpfile)
-
-            return liblist, debuglist
+                                shutil.copyfileobj(reader, fh)
+                    except BaseException:
+                        # do not leave rpm2cpio behind on a bad archive or a full disk
+                        p.kill()
+                        raise
+                    # drain the trailer padding so rpm2cpio does not fail on a closed pipe
+                    p.communicate()
+                if p.returncode != 0:
+                    raise FetchError(f"failed to extract {fn}!")
+                os.unlink(downloaded[fn])
+
+            return liblist, debuglist, dumpkeys
 
     def download_files(self, project, package, repo, arch, filenames, mtimes):
         downloaded = dict()
@@ -782,28 +796,22 @@ class ABIChecker(ReviewBot.ReviewBot):
             r = osc.core.http_GET(u)
         except HTTPError as e:
             raise FetchError(f'failed to fetch header information: {e}')
-        tmpfile = NamedTemporaryFile(prefix="cpio-", delete=False)
-        for chunk in r:
-            tmpfile.write(chunk)
-        tmpfile.close()
-        cpio = CpioRead(tmpfile.name)
-        cpio.read()
-        rpm_re = re.compile('(.+\.rpm)-[0-9A-Fa-f]{32}$')
-        for ch in cpio:
+        rpm_re = re.compile('(.+\.rpm)-([0-9A-Fa-f]{32})$')
+        for filename, size, reader in CpioReader(r):
             # ignore errors
-            if ch.filename == '.errors':
+            if filename == '.errors':
                 continue
-            # the filehandle in the cpio archive is private so
-            # open it again
-            with open(tmpfile.name, 'rb') as fh:
-                fh.seek(ch.dataoff, os.SEEK_SET)
+            # rpm needs a file descriptor, so spool the header into a
+            # small temporary file instead of the whole download
+            with TemporaryFile(prefix="cpio-") as fh:
+                shutil.copyfileobj(reader, fh)
+                fh.seek(0, os.SEEK_SET)
                 h = self.readRpmHeaderFD(fh)
-                if h is None:
-                    raise FetchError(f"failed to read rpm header for {ch.filename}")
-                m = rpm_re.match(ch.filename.decode('utf-8'))
-                if m:
-                    yield m.group(1), h
-        os.unlink(tmpfile.name)
+            if h is None:
+                raise FetchError(f"failed to read rpm header for {filename}")
+            m = rpm_re.match(filename)
+            if m:
+                yield m.group(1), m.group(2), h
 
     def _getmtimes(self, prj, pkg, repo, arch):
         """ returns a dict of filename: mtime """
@@ -986,18 +994,26 @@ class ABIChecker(ReviewBot.ReviewBot):
             return True
         return False
 
+    def dumpkey(self, disturl, hdrmd5, debug_hdrmd5, lib):
+        """ key of the ABI dump of lib from the binary and debuginfo rpms
+        identified by their header md5s
+        """
+        key = '\0'.join((disturl, hdrmd5, debug_hdrmd5, lib))
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
     def compute_fetchlist(self, prj, pkg, srcinfo, repo, arch):
         """ scan binary rpms of the specified repo for libraries.
-        Returns a set of packages to fetch and the libraries found
+        Returns the packages to fetch for each library, the libraries found,
+        their debug files and the keys of their ABI dumps
         """
         self.logger.debug(f'scanning {prj}/{pkg} {repo}/{arch}')
 
         headers = self._fetchcpioheaders(prj, pkg, repo, arch)
         missing_debuginfo = set()
         lib_packages = dict() # pkgname -> set(lib file names)
-        pkgs = dict() # pkgname -> cpiohdr, rpmhdr
+        pkgs = dict() # pkgname -> rpm filename, rpmhdr, hdrmd5
         lib_aliases = dict()
-        for rpmfn, h in headers:
+        for rpmfn, hdrmd5, h in headers:
             # skip src rpm
             if h['sourcepackage']:
                 continue
@@ -1009,7 +1025,7 @@ class ABIChecker(ReviewBot.ReviewBot):
             self.logger.debug("inspecting %s", pkgname)
             if not self.disturl_matches(h['disturl'].decode('utf-8'), prj, srcinfo):
                 raise DistUrlMismatch(h['disturl'].decode('utf-8'), srcinfo)
-            pkgs[pkgname] = (rpmfn, h)
+            pkgs[pkgname] = (rpmfn, h, hdrmd5)
             if debugpkg_re.match(pkgname):
                 continue
             for fn, mode, lnk in zip(h['filenames'], h['filemodes'], h['filelinktos']):
@@ -1025,9 +1041,10 @@ class ABIChecker(ReviewBot.ReviewBot):
                         self.logger.debug(f'found alias: {alias} -> {libname}')
                         lib_aliases.setdefault(libname, set()).add(alias)
 
-        fetchlist = set()
+        fetchlist = dict() # lib -> rpm filenames
         liblist = dict()
         debuglist = dict()
+        dumpkeys = dict()
         # check whether debug info exists for each lib
         for pkgname in sorted(lib_packages.keys()):
             dpkgname = pkgname+'-debuginfo'
@@ -1036,7 +1053,7 @@ class ABIChecker(ReviewBot.ReviewBot):
                 continue
 
             # check file list of debuginfo package
-            rpmfn, h = pkgs[dpkgname]
+            rpmfn, h, debug_hdrmd5 = pkgs[dpkgname]
             files = set ([f.decode('utf-8') for f in h['filenames']])
             ok = True
             for lib in lib_packages[pkgname]:
@@ -1058,10 +1075,11 @@ class ABIChecker(ReviewBot.ReviewBot):
                         ok = False
 
                 if ok:
-                    fetchlist.add(pkgs[pkgname][0])
-                    fetchlist.add(rpmfn)
+                    librpmfn, libh, hdrmd5 = pkgs[pkgname]
+                    fetchlist.setdefault(lib, set()).update((librpmfn, rpmfn))
                     liblist.setdefault(lib, set())
                     debuglist.setdefault(lib, libdebug)
+                    dumpkeys.setdefault(lib, self.dumpkey(libh['disturl'].decode('utf-8'), hdrmd5, debug_hdrmd5, lib))
                     libname = os.path.basename(lib)
                     if libname in lib_aliases:
                         liblist[lib] |= lib_aliases[libname]
@@ -1070,7 +1088,7 @@ class ABIChecker(ReviewBot.ReviewBot):
             self.logger.error(f'missing debuginfo: {pformat(missing_debuginfo)}')
             raise MissingDebugInfo(missing_debuginfo)
 
-        return fetchlist, liblist, debuglist
+        return fetchlist, liblist, debuglist, dumpkeys
 
 class CommandLineInterface(ReviewBot.CommandLineInterface):
 
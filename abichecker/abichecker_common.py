@@ -1,5 +1,9 @@
 #!/usr/bin/python3
 
+import os
+import time
+from collections import namedtuple
+from datetime import datetime
 from xdg.BaseDirectory import save_cache_path, save_data_path
 
 CACHEDIR = save_cache_path('opensuse.org', 'abi-checker')
@@ -7,6 +11,9 @@ DATADIR = save_data_path('opensuse.org', 'abi-checker')
 
 import abichecker_dbmodel as DB
 import sqlalchemy.orm.exc
+from sqlalchemy import func
+
+DumpStats = namedtuple('DumpStats', ('dumps', 'hits', 'seconds', 'saved'))
 
 class Config(object):
     def __init__(self, session):
@@ -45,3 +52,73 @@ class Config(object):
         for entry in self.session.query(DB.Config).all():
             yield (entry.key, entry.value)
 
+
+class DumpCache(object):
+    """ ABI dumps of target libraries by the binaries they were made from.
+
+    The target of a request only changes when it is rebuilt, so the dump of
+    each of its libraries is kept and reused by every later request against
+    the same binaries.
+    """
+
+    def __init__(self, session, directory = None):
+        self.session = session
+        if self.session is None:
+            self.session = DB.db_session()
+        self.directory = directory
+        if self.directory is None:
+            self.directory = os.path.join(CACHEDIR, 'dumps')
+
+    def path(self, key):
+        return os.path.join(self.directory, f'{key}.dump')
+
+    def entry(self, key):
+        return self.session.query(DB.ABIDump).filter(DB.ABIDump.key == key).first()
+
+    def has(self, key):
+        return self.entry(key) is not None and os.path.exists(self.path(key))
+
+    def dump(self, key, dumper, **info):
+        """ return the path of the dump for key, creating it with
+        dumper(path) if not cached yet, or None if that failed
+        """
+        path = self.path(key)
+        entry = self.entry(key)
+        if entry is not None and os.path.exists(path):
+            entry.hits += 1
+            entry.t_used = datetime.now()
+            self.session.commit()
+            return path
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        start = time.time()
+        if not dumper(path):
+            if os.path.exists(path):
+                os.unlink(path)
+            return None
+
+        if entry is None:
+            entry = DB.ABIDump(key = key, hits = 0, **info)
+        entry.seconds = time.time() - start
+        entry.t_used = datetime.now()
+        self.session.add(entry)
+        self.session.commit()
+        return path
+
+    def prune(self, oldest):
+        """ remove dumps not used since oldest """
+        for entry in self.session.query(DB.ABIDump).filter(DB.ABIDump.t_used < oldest):
+            fn = self.path(entry.key)
+            if os.path.exists(fn):
+                os.unlink(fn)
+            self.session.delete(entry)
+        self.session.commit()
+
+    def stats(self):
+        dumps, hits, seconds, saved = self.session.query(
+            func.count(DB.ABIDump.id),
+            func.coalesce(func.sum(DB.ABIDump.hits), 0),
+            func.coalesce(func.sum(DB.ABIDump.seconds), 0),
+            func.coalesce(func.sum(DB.ABIDump.hits * DB.ABIDump.seconds), 0)).one()
+        return DumpStats(dumps, hits, seconds, saved)
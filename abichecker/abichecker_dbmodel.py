@@ -3,7 +3,7 @@
 import os
 import sys
 from datetime import datetime
-from sqlalchemy import Column, ForeignKey, Integer, String, Boolean, DateTime, Text
+from sqlalchemy import Column, ForeignKey, Integer, String, Boolean, DateTime, Float, Text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.orm import sessionmaker
@@ -64,6 +64,22 @@ class LibReport(Base):
     t_created = Column(DateTime, default=datetime.now)
     t_updated = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
+class ABIDump(Base):
+    __tablename__ = 'abidump'
+    id = Column(Integer, primary_key=True)
+    key = Column(String(64), nullable=False, unique=True)
+
+    project = Column(String(255), nullable=False)
+    package = Column(String(255), nullable=False)
+    repo = Column(String(255), nullable=False)
+    arch = Column(String(255), nullable=False)
+    lib = Column(String(255), nullable=False)
+    seconds = Column(Float(), nullable=False)
+    hits = Column(Integer, nullable=False, default=0)
+
+    t_created = Column(DateTime, default=datetime.now)
+    t_used = Column(DateTime, default=datetime.now)
+
 class Config(Base):
     __tablename__ = 'config'
     id = Column(Integer, primary_key=True)
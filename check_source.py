@@ -8,6 +8,8 @@ import shutil
 import subprocess
 import sys
 import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Set
 from cmdln import CmdlnOptionParser
 
@@ -15,7 +17,7 @@ from lxml import etree as ET
 
 import osc.core
 from urllib3.exceptions import MaxRetryError
-from osclib.core import devel_project_get, factory_git_devel_project_mapping
+from osclib.core import factory_git_devel_project_mapping
 from osclib.core import devel_project_fallback
 from osclib.core import entity_exists
 from osclib.core import group_members
@@ -29,12 +31,25 @@ from osc.core import get_request_list
 from urllib.error import HTTPError
 
 import ReviewBot
+from osclib.cache_manager import CacheManager
 from osclib.conf import str2bool
+from scm.cache import CheckoutCache
+from scm.cache import link_tree
 
 
 class CheckSource(ReviewBot.ReviewBot):
 
     SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
+    SUPPORTS_WORKERS = True
+
+    # settings loaded per request by target_project_config()
+    REQUEST_STATE = ReviewBot.ReviewBot.REQUEST_STATE + (
+        'single_action_require', 'ignore_devel', 'in_air_rename_allow', 'add_review_team', 'review_team',
+        'mail_release_list', 'staging_group', 'required_maintainer', 'devel_whitelist', 'skip_add_reviews',
+        'ensure_source_exist_in_baseproject', 'devel_baseproject', 'allow_source_in_sle', 'sle_project_to_check',
+        'slfo_packagelist_to_check', 'allow_valid_source_origin', 'valid_source_origins',
+        'add_devel_project_review', 'allowed_scm_submission_sources',
+    )
 
     def __init__(self, *args, **kwargs):
         ReviewBot.ReviewBot.__init__(self, *args, **kwargs)
@@ -43,6 +58,8 @@ class CheckSource(ReviewBot.ReviewBot):
         self.request_default_return = True
 
         self.skip_add_reviews = False
+        self.checkout_cache = None
+        self.validator_workers = 4
 
     def target_project_config(self, project: str) -> None:
         # Load project config and allow for remote entries.
@@ -204,7 +221,7 @@ class CheckSource(ReviewBot.ReviewBot):
 
         if not self.ignore_devel:
             self.logger.info('checking if target package exists and has devel project')
-            devel_project, devel_package = devel_project_get(self.apiurl, target_project, target_package)
+            devel_project, devel_package = self.devel_project_get(target_project, target_package)
             if devel_project:
                 if (
                         (source_project != devel_project or source_package != devel_package)
@@ -275,21 +292,24 @@ class CheckSource(ReviewBot.ReviewBot):
             self.logger.warning(f'directory {copath} already exists')
             shutil.rmtree(copath)
         os.makedirs(copath)
-        os.chdir(copath)
+        # Checks may run concurrently, so paths are built from copath rather
+        # than changing the working directory of the process.
+        old = os.path.join(copath, '_old')
+        directory = os.path.join(copath, target_package)
 
         try:
-            CheckSource.checkout_package(self.scm, target_project, target_package, revision=target_rev,
+            CheckSource.checkout_package(self.checkout_cache or self.scm, target_project, target_package, revision=target_rev,
                                          pathname=copath, server_service_files=True, expand_link=True)
-            os.rename(target_package, '_old')
+            os.rename(os.path.join(copath, target_package), old)
         except HTTPError as e:
             if e.code == 404:
                 self.logger.info(f'target package does not exist {target_project}/{target_package}')
             else:
                 raise e
 
-        CheckSource.checkout_package(self.scm, source_project, source_package, revision=source_revision,
+        CheckSource.checkout_package(self.checkout_cache or self.scm, source_project, source_package, revision=source_revision,
                                      pathname=copath, server_service_files=True, expand_link=True)
-        os.rename(source_package, target_package)
+        os.rename(os.path.join(copath, source_package), directory)
 
         new_info = self.package_source_parse(source_project, source_package, source_revision, target_package)
         filename = new_info.get('filename', '')
@@ -304,23 +324,28 @@ class CheckSource(ReviewBot.ReviewBot):
                 f"A package submitted as {target_package} has to build as 'Name: {expected_name}' - found Name '{new_info['name']}'")
             return False
 
-        if not self.check_service_file(target_package):
-            return False
-
-        if not self.check_rpmlint(target_package):
-            return False
-
-        specs = [os.path.basename(x) for x in glob.glob(os.path.join(target_package, "*.spec"))]
-        if specs and not self.check_spec_policy('_old', target_package, specs):
+        # check_service_file() removes the _service file for the validators
+        if not self.check_service_file(directory):
             return False
 
-        if not self.run_source_validator('_old', target_package):
+        if not self.check_rpmlint(directory):
             return False
 
-        if specs and not self.detect_mentioned_patches('_old', target_package, specs):
+        specs = [os.path.basename(x) for x in glob.glob(os.path.join(directory, "*.spec"))]
+        if specs and not self.check_spec_policy(old, directory, specs):
             return False
 
-        if not self.check_urls('_old', target_package, specs):
+        # in order of priority
+        validators = []
+        for script in self.source_validator_scripts():
+            validators.append((f'source_validator {os.path.basename(script)}',
+                               self.run_source_validator_script, (script, old, directory)))
+        if specs:
+            validators.append(('detect_mentioned_patches', self.detect_mentioned_patches, (old, directory, specs)))
+        validators.append(('check_urls', self.check_urls, (old, directory, specs)))
+
+        failed = self.run_validators(validators)
+        if failed == 'check_urls':
             if self.platform_type == "OBS":
                 # Keep review open
                 self.platform.change_review_state(req=self.request, newstate='new',
@@ -329,6 +354,8 @@ class CheckSource(ReviewBot.ReviewBot):
                 return None
             else:
                 return False
+        elif failed:
+            return False
 
         shutil.rmtree(copath)
         self.review_messages['accepted'] = 'Check script succeeded'
@@ -672,26 +699,69 @@ class CheckSource(ReviewBot.ReviewBot):
         self.review_messages['accepted'] = 'unhandled: removing repository'
         return True
 
-    def run_source_validator(self, old, directory):
-        scripts = glob.glob("/usr/lib/obs/service/source_validators/*")
+    def run_validators(self, validators):
+        """
+        Run the (name, function, args) validators concurrently and return the
+        name of the first one in the list which failed or None.
+
+        Each validator writes to its own review messages. Those of the failed
+        validator are taken over so the outcome does not depend on timing.
+        """
+        def run(function, args, state):
+            start = time.time()
+            self._request_local.state = state
+            try:
+                result = function(*args)
+            finally:
+                self._request_local.state = None
+            return result, state['review_messages'], time.time() - start
+
+        # The pool threads have no request state of their own, so each
+        # validator gets a copy of the one checking the request.
+        parent_state = self._request_state()
+        futures = []
+        with ThreadPoolExecutor(max_workers=max(self.validator_workers, 1)) as executor:
+            for name, function, args in validators:
+                state = dict(parent_state or {})
+                state['review_messages'] = self.review_messages.copy()
+                futures.append((name, executor.submit(run, function, args, state)))
+            results = [(name, future.result()) for name, future in futures]
+        # the worker threads are not the one checking the request
+        self._request_local.state = parent_state
+
+        self.logger.debug('validator times: ' + ', '.join(
+            f'{name} {elapsed:.2f}s' for name, (_, _, elapsed) in results))
+
+        for name, (result, review_messages, _) in results:
+            if not result:
+                self.review_messages = review_messages
+                return name
+
+        return None
+
+    def source_validator_scripts(self):
+        scripts = sorted(glob.glob("/usr/lib/obs/service/source_validators/*"))
         if not scripts:
-            raise RuntimeError.new('Missing source validator')
-        for script in scripts:
-            if os.path.isdir(script):
-                continue
-            res = subprocess.run([script, '--batchmode', directory, old], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-            if res.returncode:
-                text = "Source validator failed. Try \"osc service runall source_validator\"\n"
-                text += res.stdout.decode('utf-8')
-                self.review_messages['declined'] = text
-                return False
+            raise RuntimeError('Missing source validator')
+        return [script for script in scripts if not os.path.isdir(script)]
+
+    def run_source_validator_script(self, script, old, directory):
+        # Run next to the checkouts so the output names them as before.
+        cwd = os.path.dirname(directory)
+        res = subprocess.run([script, '--batchmode', os.path.relpath(directory, cwd), os.path.relpath(old, cwd)],
+                             cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        if res.returncode:
+            text = "Source validator failed. Try \"osc service runall source_validator\"\n"
+            text += res.stdout.decode('utf-8')
+            self.review_messages['declined'] = text
+            return False
 
-            for line in res.stdout.decode('utf-8').split("\n"):
-                # pimp up some warnings
-                if re.search(r'Attention.*not mentioned', line):
-                    line = re.sub(r'\(W\) ', '', line)
-                    self.review_messages['declined'] = line
-                    return False
+        for line in res.stdout.decode('utf-8').split("\n"):
+            # pimp up some warnings
+            if re.search(r'Attention.*not mentioned', line):
+                line = re.sub(r'\(W\) ', '', line)
+                self.review_messages['declined'] = line
+                return False
 
         return True
 
@@ -714,12 +784,18 @@ class CheckSource(ReviewBot.ReviewBot):
             os.rename(nspecfn, specfn)
 
     def check_urls(self, old, directory, specs):
-        self._snipe_out_existing_urls(old, directory, specs)
-        oldcwd = os.getcwd()
-        with tempfile.TemporaryDirectory() as tmpdir:
-            os.chdir(directory)
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(directory))) as tmpdir:
+            # Rewrite the specs of a copy since other validators may be
+            # reading the originals.
+            sources = os.path.join(tmpdir, 'sources')
+            link_tree(directory, sources)
+            self._snipe_out_existing_urls(old, sources, specs)
+
+            outdir = os.path.join(tmpdir, 'download')
+            os.mkdir(outdir)
             res = subprocess.run(["/usr/lib/obs/service/download_files", "--enforceupstream",
-                                  "yes", "--enforcelocal", "yes", "--outdir", tmpdir], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                                  "yes", "--enforcelocal", "yes", "--outdir", outdir],
+                                 cwd=sources, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
             if res.returncode:
                 review_message = "Source URLs are not valid. Try `osc service runall download_files`.\n" + \
                     res.stdout.decode('utf-8')
@@ -727,9 +803,7 @@ class CheckSource(ReviewBot.ReviewBot):
                     self.review_messages["new"] = review_message
                 else:
                     self.review_messages["declined"] = review_message
-                os.chdir(oldcwd)
                 return False
-        os.chdir(oldcwd)
         return True
 
     def difflines(self, oldf, newf):
@@ -831,6 +905,10 @@ class CommandLineInterface(ReviewBot.CommandLineInterface):
 
         parser.add_option('--skip-add-reviews', action='store_true', default=False,
                           help='skip adding review after completing checks')
+        parser.add_option('--validator-workers', type='int', default=4, metavar='N',
+                          help='run up to N source validators concurrently')
+        parser.add_option('--checkout-cache-size', type='float', default=10, metavar='GIB',
+                          help='size of the cache of package checkouts in GiB, 0 to disable')
 
         return parser
 
@@ -838,6 +916,13 @@ class CommandLineInterface(ReviewBot.CommandLineInterface):
         bot = ReviewBot.CommandLineInterface.setup_checker(self)
 
         bot.skip_add_reviews = self.options.skip_add_reviews
+        bot.validator_workers = self.options.validator_workers
+
+        if self.options.checkout_cache_size:
+            if bot.scm.name == 'GIT':
+                bot.scm.mirror_directory = CacheManager.directory('check_source', 'mirror')
+            bot.checkout_cache = CheckoutCache(bot.scm, CacheManager.directory('check_source', 'checkout'),
+                                               int(self.options.checkout_cache_size * 1024 ** 3), bot.logger)
 
         return bot
 
@@ -1,10 +1,22 @@
 #!/usr/bin/python3
 
 import argparse
+import bisect
+import hashlib
+import heapq
+import json
+import marshal
+import multiprocessing
 import os
+import random
+import resource
+import sqlite3
+import struct
 import subprocess
 import sys
-from collections import namedtuple
+import tempfile
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 
 import osc.conf
@@ -19,12 +31,14 @@ from osc.core import HTTPError, get_commitlog
 import metrics_release
 import osclib.conf
 from osclib.cache import Cache
+from osclib.cache_manager import CacheManager
 from osclib.conf import Config
-from osclib.core import (get_request_list_with_history,
-                         project_pseudometa_package)
+from osclib.core import project_pseudometa_package
+from osclib.core import source_file_load
 from osclib.stagingapi import StagingAPI
 
 SOURCE_DIR = os.path.dirname(os.path.realpath(__file__))
+SEARCH_PREFETCH = 4
 Point = namedtuple('Point', ['measurement', 'tags', 'fields', 'time', 'delta'])
 
 # Duplicate Leap config to handle 13.2 without issue.
@@ -32,68 +46,136 @@ osclib.conf.DEFAULT[
     r'openSUSE:(?P<project>[\d.]+)$'] = osclib.conf.DEFAULT[
     r'openSUSE:(?P<project>Leap:(?P<version>[\d.]+))$']
 
-# Provide osc.core.get_request_list() that swaps out search() implementation to
-# capture the generated query, paginate over and yield each request to avoid
-# loading all requests at the same time. Additionally, use lxml ET to avoid
-# having to re-parse to perform complex xpaths.
+# Search for requests including their full history and paginate over them,
+# yielding each request to avoid loading all requests at the same time. lxml ET
+# is used to parse the results to be able to perform complex xpaths.
 
 
-def get_request_list(*args, **kwargs):
-    osc.core._search = osc.core.search
-    osc.core.search = search_capture
-    osc.core._ET = osc.core.ET
-    osc.core.ET = ET
-    osc.conf.config['include_request_from_project'] = False
+def request_search(apiurl, project, states, when=None):
+    xpath = ''
+    for state in states:
+        xpath = osc.core.xpath_join(xpath, f"state/@name='{state}'", inner=True)
+    xpath = osc.core.xpath_join(xpath, f"action/target/@project='{project}'", op='and', nexpr_parentheses=True)
+    if when:
+        # Changing the state is the last thing that happens to a request.
+        xpath = osc.core.xpath_join(xpath, f"state/@when>='{when}'", op='and')
 
-    osc.core.get_request_list(*args, **kwargs)
+    queries = {'request': {'withfullhistory': '1'}}
+    return search_paginated_generator(apiurl, queries, request=xpath)
 
-    osc.core.search = osc.core._search
 
-    query = search_capture.query
-    for request in search_paginated_generator(query[0], query[1], **query[2]):
-        # Python 3 yield from.
-        yield request
+def search(apiurl, queries=None, **kwargs):
+    res = {}
+    for kind, xpath in kwargs.items():
+        query = dict(queries.get(kind, {}), match=xpath)
+        url = osc.core.makeurl(apiurl, ['search', kind], query)
+        res[kind] = ET.parse(osc.core.http_GET(url)).getroot()
+    return res
 
-    osc.core.ET = osc.core._ET
+# Paginates a search in sets of 1000 and yields each request. The following
+# pages are fetched concurrently while the current one is processed, but at
+# most prefetch pages ahead to bound the memory held by waiting pages.
 
 
-def search_capture(apiurl, queries=None, **kwargs):
-    search_capture.query = (apiurl, queries, kwargs)
-    return {'request': ET.fromstring('<collection matches="0"></collection>')}
-
-# Provides a osc.core.search() implementation for use with get_request_list()
-# that paginates in sets of 1000 and yields each request.
-
-
-def search_paginated_generator(apiurl, queries=None, **kwargs):
+def search_paginated_generator(apiurl, queries=None, prefetch=SEARCH_PREFETCH, **kwargs):
     if "action/target/@project='openSUSE:Factory'" in kwargs['request']:
         # Idealy this would be 250000, but poo#48437 and lack of OBS sort.
         kwargs['request'] = osc.core.xpath_join(kwargs['request'], '@id>450000', op='and')
 
-    request_count = 0
-    queries['request']['limit'] = 1000
-    queries['request']['offset'] = 0
-    while True:
-        collection = osc.core.search(apiurl, queries, **kwargs)['request']
-        if not request_count:
-            print(f"processing {int(collection.get('matches')):,} requests")
+    limit = 1000
+
+    def page(offset):
+        page_queries = dict(queries, request=dict(queries['request'], limit=limit, offset=offset))
+        return search(apiurl, page_queries, **kwargs)['request']
+
+    collection = page(0)
+    matches = int(collection.get('matches'))
+    print(f'processing {matches:,} requests')
+
+    pending = deque()
+    offset = limit
+    executor = ThreadPoolExecutor(max_workers=prefetch)
+    try:
+        while True:
+            # Stop paging once the expected number of items has been requested.
+            while len(pending) < prefetch and offset < matches:
+                pending.append(executor.submit(page, offset))
+                offset += limit
 
-        for request in collection.findall('request'):
-            yield request
-            request_count += 1
+            yield from collection.findall('request')
 
-        if request_count == int(collection.get('matches')):
-            # Stop paging once the expected number of items has been returned.
-            break
+            # Release memory as otherwise ET seems to hold onto it.
+            collection.clear()
 
-        # Release memory as otherwise ET seems to hold onto it.
-        collection.clear()
-        queries['request']['offset'] += queries['request']['limit']
+            if not pending:
+                break
+            collection = pending.popleft().result()
+            matches = int(collection.get('matches'))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
 
 
+# Points of the request being ingested.
 points = []
 
 
+class PointSpool(object):
+    """
+    Collects points and iterates them ordered by time like a stable sort
+    would, without holding all of them in memory.
+
+    Points are buffered up to run_size, then sorted and spilled to a temporary
+    file as a run of records, each the fixed-width time and payload size
+    followed by the marshalled rest of the point. Iterating merges the runs by
+    time, taking earlier runs first for equal times to keep the order stable.
+    """
+
+    RECORD = struct.Struct('<qI')
+
+    def __init__(self, run_size=250000):
+        self.run_size = run_size
+        self.buffer = []
+        self.runs = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, point):
+        self.buffer.append(point)
+        self.count += 1
+        if len(self.buffer) >= self.run_size:
+            self.spill()
+
+    def extend(self, points):
+        for point in points:
+            self.append(point)
+
+    def spill(self):
+        self.buffer.sort(key=lambda p: p.time)
+        run = tempfile.TemporaryFile()
+        for point in self.buffer:
+            data = marshal.dumps((point.measurement, point.tags, point.fields, point.delta))
+            run.write(self.RECORD.pack(point.time, len(data)))
+            run.write(data)
+        run.seek(0)
+        self.runs.append(run)
+        self.buffer = []
+
+    def run_read(self, run):
+        with run:
+            while header := run.read(self.RECORD.size):
+                time, size = self.RECORD.unpack(header)
+                measurement, tags, fields, delta = marshal.loads(run.read(size))
+                yield Point(measurement, tags, fields, time, delta)
+
+    def __iter__(self):
+        self.buffer.sort(key=lambda p: p.time)
+        runs = [self.run_read(run) for run in self.runs]
+        self.runs = []
+        return heapq.merge(*runs, self.buffer, key=lambda p: p.time)
+
+
 def point(measurement, fields, datetime, tags=None, delta=False):
     if tags is None:
         tags = {}
@@ -104,154 +186,317 @@ def timestamp(datetime):
     return int(datetime.strftime('%s'))
 
 
-def ingest_requests(client, api, project):
-    requests = get_request_list_with_history(
-        api.apiurl, project, req_state=('accepted', 'revoked', 'superseded'))
-    for request in requests:
-        if request.find('action').get('type') not in ('submit', 'delete'):
-            # TODO Handle non-stageable requests via different flow.
-            continue
-
-        created_at = date_parse(request.find('history').get('when'))
-        final_at = date_parse(request.find('state').get('when'))
-        final_at_history = date_parse(request.find('history[last()]').get('when'))
-        if final_at_history > final_at:
-            # Workaround for invalid dates: openSUSE/open-build-service#3858.
-            final_at = final_at_history
-
-        # TODO Track requests in psuedo-ignore state.
-        point('total', {'backlog': 1, 'open': 1}, created_at, {'event': 'create'}, True)
-        point('total', {'backlog': -1, 'open': -1}, final_at, {'event': 'close'}, True)
-
-        request_tags = {}
-        request_fields = {
-            'total': (final_at - created_at).total_seconds(),
-            'staged_count': len(request.findall('review[@by_group="factory-staging"]/history')),
-        }
-        # TODO Total time spent in backlog (ie factory-staging, but excluding when staged).
-
-        staged_first_review = request.xpath(f'review[contains(@by_project, "{project}:Staging:")]')
-        if len(staged_first_review):
-            by_project = staged_first_review[0].get('by_project')
-            request_tags['type'] = 'adi' if api.is_adi_project(by_project) else 'letter'
-
-            # TODO Determine current whitelists state based on dashboard revisions.
-            if project.startswith('openSUSE:Factory'):
-                splitter_whitelist = 'B C D E F G H I J'.split()
-                if splitter_whitelist:
-                    short = api.extract_staging_short(by_project)
-                    request_tags['whitelisted'] = short in splitter_whitelist
-            else:
-                # All letter where whitelisted since no restriction.
-                request_tags['whitelisted'] = request_tags['type'] == 'letter'
-
-        xpath = f'review[contains(@by_project, "{project}:Staging:adi:") and @state="accepted"]/'
-        xpath += 'history[comment[text() = "ready to accept"]]/@when'
-        ready_to_accept = request.xpath(xpath)
-        if len(ready_to_accept):
-            ready_to_accept = date_parse(ready_to_accept[0])
-            request_fields['ready'] = (final_at - ready_to_accept).total_seconds()
-
-            # TODO Points with indentical timestamps are merged so this can be placed in total
-            # measurement, but may make sense to keep this separate and make the others follow.
-            point('ready', {'count': 1}, ready_to_accept, delta=True)
-            point('ready', {'count': -1}, final_at, delta=True)
-
-        staged_first = request.xpath('review[@by_group="factory-staging"]/history/@when')
-        if len(staged_first):
-            staged_first = date_parse(staged_first[0])
-            request_fields['staged_first'] = (staged_first - created_at).total_seconds()
-
-            # TODO Decide if better to break out all measurements by time most relevant to event,
-            # time request was created, or time request was finalized. It may also make sense to
-            # keep separate measurement by different times like this one.
-            point('request_staged_first', {'value': request_fields['staged_first']}, staged_first, request_tags)
-
-        point('request', request_fields, final_at, request_tags)
-
-        # Staging related reviews.
-        for number, review in enumerate(
-                request.xpath(f'review[contains(@by_project, "{project}:Staging:")]'), start=1):
-            staged_at = date_parse(review.get('when'))
-
-            project_type = 'adi' if api.is_adi_project(review.get('by_project')) else 'letter'
-            short = api.extract_staging_short(review.get('by_project'))
-            point('staging', {'count': 1}, staged_at,
-                  {'id': short, 'type': project_type, 'event': 'select'}, True)
-            point('total', {'backlog': -1, 'staged': 1}, staged_at, {'event': 'select'}, True)
-
-            who = who_workaround(request, review)
-            review_tags = {'event': 'select', 'user': who, 'number': number}
-            review_tags.update(request_tags)
-            point('user', {'count': 1}, staged_at, review_tags)
-
-            history = review.find('history')
-            if history is not None:
-                unselected_at = date_parse(history.get('when'))
-            else:
-                unselected_at = final_at
-
-            # If a request is declined and re-opened it must be repaired before being re-staged. At
-            # which point the only possible open review should be the final one.
-            point('staging', {'count': -1}, unselected_at,
-                  {'id': short, 'type': project_type, 'event': 'unselect'}, True)
-            point('total', {'backlog': 1, 'staged': -1}, unselected_at, {'event': 'unselect'}, True)
-
-        # No-staging related reviews.
-        for review in request.xpath(f'review[not(contains(@by_project, "{project}:Staging:"))]'):
-            tags = {
-                # who_added is non-trivial due to openSUSE/open-build-service#3898.
-                'state': review.get('state'),
-            }
-
-            opened_at = date_parse(review.get('when'))
-            history = review.find('history')
-            if history is not None:
-                completed_at = date_parse(history.get('when'))
-                tags['who_completed'] = history.get('who')
-            else:
-                completed_at = final_at
-                # Does not seem to make sense to mirror user responsible for making final state
-                # change as the user who completed the review.
-
-            tags['key'] = []
-            tags['type'] = []
-            for name, value in sorted(review.items(), reverse=True):
-                if name.startswith('by_'):
-                    tags[name] = value
-                    tags['key'].append(value)
-                    tags['type'].append(name[3:])
-            tags['type'] = '_'.join(tags['type'])
-
-            point('review', {'open_for': (completed_at - opened_at).total_seconds()}, completed_at, tags)
-            point('review_count', {'count': 1}, opened_at, tags, True)
-            point('review_count', {'count': -1}, completed_at, tags, True)
-
-        found = []
-        for set_priority in request.xpath('history[description[contains(text(), "Request got a new priority:")]]'):
-            parts = set_priority.find('description').text.rsplit(' ', 3)
-            priority_previous = parts[1]
-            priority = parts[3]
-            if priority == priority_previous:
+class IngestState(object):
+    """
+    Requests ingested into a project bucket and the points they added.
+
+    Delta points change running counters, so a request closed since the last
+    run changes the counters from its earliest point onward. Keeping the delta
+    points of every ingested request allows rewriting the delta measurements
+    from that point without fetching all the requests that did not change.
+
+    The other points of a request are kept as well. Points of a measurement at
+    the same time are merged by InfluxDB, so when a request is ingested again
+    its previous points are deleted and all points at the times it changed are
+    written again in the order a full ingest adds them.
+    """
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS request (id INTEGER PRIMARY KEY, state_when TEXT)',
+        'CREATE TABLE IF NOT EXISTS delta (request INTEGER, seq INTEGER, time INTEGER, measurement TEXT, '
+        'counter TEXT, tags TEXT, fields TEXT)',
+        'CREATE INDEX IF NOT EXISTS delta_request ON delta (request)',
+        'CREATE INDEX IF NOT EXISTS delta_time ON delta (time)',
+        'CREATE TABLE IF NOT EXISTS point (request INTEGER, seq INTEGER, time INTEGER, measurement TEXT, '
+        'tags TEXT, fields TEXT)',
+        'CREATE INDEX IF NOT EXISTS point_request ON point (request)',
+        'CREATE INDEX IF NOT EXISTS point_time ON point (time, measurement)',
+    ]
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        for statement in self.SCHEMA:
+            self.db.execute(statement)
+
+    def clear(self):
+        self.db.execute('DELETE FROM request')
+        self.db.execute('DELETE FROM delta')
+        self.db.execute('DELETE FROM point')
+
+    def commit(self):
+        self.db.commit()
+
+    def watermark(self):
+        """Return the last state change of the ingested requests."""
+        return self.db.execute('SELECT MAX(state_when) FROM request').fetchone()[0]
+
+    def state_when(self, request_id):
+        row = self.db.execute('SELECT state_when FROM request WHERE id = ?', (request_id,)).fetchone()
+        return row[0] if row else None
+
+    def request_add(self, request_id, state_when, points):
+        """
+        Record the points of a request, replacing those of an earlier state of
+        the request, and return the earliest time the delta points changed and
+        the (measurement, time) of the previous and the new other points as
+        well as those of the previous ones.
+        """
+        start = self.db.execute('SELECT MIN(time) FROM delta WHERE request = ?', (request_id,)).fetchone()[0]
+        previous = set(self.db.execute('SELECT measurement, time FROM point WHERE request = ?', (request_id,)))
+        self.db.execute('DELETE FROM delta WHERE request = ?', (request_id,))
+        self.db.execute('DELETE FROM point WHERE request = ?', (request_id,))
+        self.db.execute('INSERT OR REPLACE INTO request VALUES (?, ?)', (request_id, state_when))
+
+        deltas = [(request_id, seq, point.time, point.measurement, counters_key(point),
+                   json.dumps(point.tags), json.dumps(point.fields))
+                  for seq, point in enumerate(points) if point.delta]
+        self.db.executemany('INSERT INTO delta VALUES (?, ?, ?, ?, ?, ?, ?)', deltas)
+        others = [(request_id, seq, point.time, point.measurement, json.dumps(point.tags), json.dumps(point.fields))
+                  for seq, point in enumerate(points) if not point.delta]
+        self.db.executemany('INSERT INTO point VALUES (?, ?, ?, ?, ?, ?)', others)
+
+        times = [delta[2] for delta in deltas]
+        if start is not None:
+            times.append(start)
+        current = {(other[3], other[2]) for other in others}
+        return min(times) if times else None, previous | current, previous
+
+    def measurements(self):
+        return [row[0] for row in self.db.execute('SELECT DISTINCT measurement FROM delta')]
+
+    def counters(self, start):
+        """Return the counters as walk_points() has them just before start."""
+        counters = {}
+        for counter, key, value in self.db.execute(
+                'SELECT counter, field.key, SUM(field.value) FROM delta, json_each(delta.fields) AS field '
+                'WHERE time < ? GROUP BY counter, field.key', (start,)):
+            counters.setdefault(counter, {'last': None, 'values': {}})['values'][key] = value
+        return counters
+
+    def deltas(self, start):
+        """Return the delta points from start in the order a full ingest adds them."""
+        for measurement, tags, fields, time in self.db.execute(
+                'SELECT measurement, tags, fields, time FROM delta WHERE time >= ? ORDER BY time, request, seq',
+                (start,)):
+            yield Point(measurement, json.loads(tags), json.loads(fields), time, True)
+
+    def points(self, measurement, time):
+        """Return the other points of measurement at time in the order a full ingest adds them."""
+        for tags, fields in self.db.execute(
+                'SELECT tags, fields FROM point WHERE time = ? AND measurement = ? ORDER BY request, seq',
+                (time, measurement)):
+            yield Point(measurement, json.loads(tags), json.loads(fields), time, False)
+
+
+def ingest_requests(client, api, project, full=False):
+    state = IngestState(os.path.join(CacheManager.directory('metrics'), f'{project}.sqlite'))
+    when = None if full else state.watermark()
+    if when is None:
+        # Left empty until the points are written so that an interrupted run
+        # is followed by a full one.
+        state.clear()
+        state.commit()
+    else:
+        print(f'ingesting requests changed since {when}')
+
+    # The requests are only committed as ingested once their points are
+    # written, otherwise a failed run would skip them from then on.
+    with state.db:
+        start = None
+        rewrite = set()
+        stale = set()
+        spool = PointSpool()
+        requests = request_search(api.apiurl, project, ('accepted', 'revoked', 'superseded'), when)
+        for request in requests:
+            request_id = int(request.get('id'))
+            state_when = request.find('state').get('when')
+            if state.state_when(request_id) == state_when:
                 continue
 
-            changed_at = date_parse(set_priority.get('when'))
-            if priority_previous != 'moderate':
-                point('priority', {'count': -1}, changed_at, {'level': priority_previous}, True)
-            if priority != 'moderate':
-                point('priority', {'count': 1}, changed_at, {'level': priority}, True)
-                found.append(priority)
+            ingest_request(api, project, request)
+            changed, times, times_previous = state.request_add(request_id, state_when, points)
+            if changed is not None and (start is None or changed < start):
+                start = changed
+            if when is None:
+                spool.extend(points)
+            rewrite.update(times)
+            stale.update(times_previous)
+            points.clear()
+
+        if when is None:
+            print(f'finalizing {len(spool):,} points')
+            return walk_points(client, spool, project)
+
+        # Points of a request ingested again are deleted, as they may have other
+        # tags or times now, and all points at the changed times are written
+        # again since InfluxDB merges those of requests with the same tags.
+        delete_api = client.delete_api()
+        for measurement, time in sorted(stale):
+            delete_api.delete(start=datetime.utcfromtimestamp(time).isoformat() + 'Z',
+                              stop=datetime.utcfromtimestamp(time + 0.999).isoformat() + 'Z',
+                              bucket=project,
+                              predicate=f'_measurement="{measurement}"')
+        for measurement, time in sorted(rewrite):
+            spool.extend(state.points(measurement, time))
+
+        counters = {}
+        if start is not None:
+            # Rewrite the delta measurements from the earliest changed point.
+            for measurement in state.measurements():
+                delete_api.delete(start=datetime.utcfromtimestamp(start).isoformat() + 'Z',
+                                  stop=datetime.utcnow().isoformat() + 'Z',
+                                  bucket=project,
+                                  predicate=f'_measurement="{measurement}"')
+            spool.extend(state.deltas(start))
+            counters = state.counters(start)
+
+        print(f'finalizing {len(spool):,} points')
+        return walk_points(client, spool, project, counters, delete=False)
+
+
+def ingest_request(api, project, request):
+    if request.find('action').get('type') not in ('submit', 'delete'):
+        # TODO Handle non-stageable requests via different flow.
+        return
+
+    created_at = date_parse(request.find('history').get('when'))
+    final_at = date_parse(request.find('state').get('when'))
+    final_at_history = date_parse(request.find('history[last()]').get('when'))
+    if final_at_history > final_at:
+        # Workaround for invalid dates: openSUSE/open-build-service#3858.
+        final_at = final_at_history
+
+    # TODO Track requests in psuedo-ignore state.
+    point('total', {'backlog': 1, 'open': 1}, created_at, {'event': 'create'}, True)
+    point('total', {'backlog': -1, 'open': -1}, final_at, {'event': 'close'}, True)
+
+    request_tags = {}
+    request_fields = {
+        'total': (final_at - created_at).total_seconds(),
+        'staged_count': len(request.findall('review[@by_group="factory-staging"]/history')),
+    }
+    # TODO Total time spent in backlog (ie factory-staging, but excluding when staged).
+
+    staged_first_review = request.xpath(f'review[contains(@by_project, "{project}:Staging:")]')
+    if len(staged_first_review):
+        by_project = staged_first_review[0].get('by_project')
+        request_tags['type'] = 'adi' if api.is_adi_project(by_project) else 'letter'
+
+        # TODO Determine current whitelists state based on dashboard revisions.
+        if project.startswith('openSUSE:Factory'):
+            splitter_whitelist = 'B C D E F G H I J'.split()
+            if splitter_whitelist:
+                short = api.extract_staging_short(by_project)
+                request_tags['whitelisted'] = short in splitter_whitelist
+        else:
+            # All letter where whitelisted since no restriction.
+            request_tags['whitelisted'] = request_tags['type'] == 'letter'
+
+    xpath = f'review[contains(@by_project, "{project}:Staging:adi:") and @state="accepted"]/'
+    xpath += 'history[comment[text() = "ready to accept"]]/@when'
+    ready_to_accept = request.xpath(xpath)
+    if len(ready_to_accept):
+        ready_to_accept = date_parse(ready_to_accept[0])
+        request_fields['ready'] = (final_at - ready_to_accept).total_seconds()
+
+        # TODO Points with indentical timestamps are merged so this can be placed in total
+        # measurement, but may make sense to keep this separate and make the others follow.
+        point('ready', {'count': 1}, ready_to_accept, delta=True)
+        point('ready', {'count': -1}, final_at, delta=True)
+
+    staged_first = request.xpath('review[@by_group="factory-staging"]/history/@when')
+    if len(staged_first):
+        staged_first = date_parse(staged_first[0])
+        request_fields['staged_first'] = (staged_first - created_at).total_seconds()
+
+        # TODO Decide if better to break out all measurements by time most relevant to event,
+        # time request was created, or time request was finalized. It may also make sense to
+        # keep separate measurement by different times like this one.
+        point('request_staged_first', {'value': request_fields['staged_first']}, staged_first, request_tags)
+
+    point('request', request_fields, final_at, request_tags)
+
+    # Staging related reviews.
+    for number, review in enumerate(
+            request.xpath(f'review[contains(@by_project, "{project}:Staging:")]'), start=1):
+        staged_at = date_parse(review.get('when'))
+
+        project_type = 'adi' if api.is_adi_project(review.get('by_project')) else 'letter'
+        short = api.extract_staging_short(review.get('by_project'))
+        point('staging', {'count': 1}, staged_at,
+              {'id': short, 'type': project_type, 'event': 'select'}, True)
+        point('total', {'backlog': -1, 'staged': 1}, staged_at, {'event': 'select'}, True)
+
+        who = who_workaround(request, review)
+        review_tags = {'event': 'select', 'user': who, 'number': number}
+        review_tags.update(request_tags)
+        point('user', {'count': 1}, staged_at, review_tags)
+
+        history = review.find('history')
+        if history is not None:
+            unselected_at = date_parse(history.get('when'))
+        else:
+            unselected_at = final_at
+
+        # If a request is declined and re-opened it must be repaired before being re-staged. At
+        # which point the only possible open review should be the final one.
+        point('staging', {'count': -1}, unselected_at,
+              {'id': short, 'type': project_type, 'event': 'unselect'}, True)
+        point('total', {'backlog': 1, 'staged': -1}, unselected_at, {'event': 'unselect'}, True)
+
+    # No-staging related reviews.
+    for review in request.xpath(f'review[not(contains(@by_project, "{project}:Staging:"))]'):
+        tags = {
+            # who_added is non-trivial due to openSUSE/open-build-service#3898.
+            'state': review.get('state'),
+        }
 
-        # Ensure a final removal entry is created when request is finalized.
-        priority = request.find('priority')
-        if priority is not None and priority.text != 'moderate':
-            if priority.text in found:
-                point('priority', {'count': -1}, final_at, {'level': priority.text}, True)
-            else:
-                print(f"unable to find priority history entry for {request.get('id')} to {priority.text}")
+        opened_at = date_parse(review.get('when'))
+        history = review.find('history')
+        if history is not None:
+            completed_at = date_parse(history.get('when'))
+            tags['who_completed'] = history.get('who')
+        else:
+            completed_at = final_at
+            # Does not seem to make sense to mirror user responsible for making final state
+            # change as the user who completed the review.
+
+        tags['key'] = []
+        tags['type'] = []
+        for name, value in sorted(review.items(), reverse=True):
+            if name.startswith('by_'):
+                tags[name] = value
+                tags['key'].append(value)
+                tags['type'].append(name[3:])
+        tags['type'] = '_'.join(tags['type'])
+
+        point('review', {'open_for': (completed_at - opened_at).total_seconds()}, completed_at, tags)
+        point('review_count', {'count': 1}, opened_at, tags, True)
+        point('review_count', {'count': -1}, completed_at, tags, True)
+
+    found = []
+    for set_priority in request.xpath('history[description[contains(text(), "Request got a new priority:")]]'):
+        parts = set_priority.find('description').text.rsplit(' ', 3)
+        priority_previous = parts[1]
+        priority = parts[3]
+        if priority == priority_previous:
+            continue
 
-    print(f'finalizing {len(points):,} points')
-    return walk_points(client, points, project)
+        changed_at = date_parse(set_priority.get('when'))
+        if priority_previous != 'moderate':
+            point('priority', {'count': -1}, changed_at, {'level': priority_previous}, True)
+        if priority != 'moderate':
+            point('priority', {'count': 1}, changed_at, {'level': priority}, True)
+            found.append(priority)
+
+    # Ensure a final removal entry is created when request is finalized.
+    priority = request.find('priority')
+    if priority is not None and priority.text != 'moderate':
+        if priority.text in found:
+            point('priority', {'count': -1}, final_at, {'level': priority.text}, True)
+        else:
+            print(f"unable to find priority history entry for {request.get('id')} to {priority.text}")
 
 
 def who_workaround(request, review, relax=False):
@@ -279,22 +524,36 @@ def who_workaround(request, review, relax=False):
 
     return who
 
-# Walk data points in order by time, adding up deltas and merging points at
+
+def counters_key(point):
+    # A more generic method like 'key' which ended up being needed is likely better.
+    measurement = counters_tag_key = point.measurement
+    if measurement == 'staging':
+        counters_tag_key += point.tags['id']
+    elif measurement == 'review_count':
+        counters_tag_key += '_'.join(point.tags['key'])
+    elif measurement == 'priority':
+        counters_tag_key += point.tags['level']
+    return counters_tag_key
+
+# Walk data points, ordered by time, adding up deltas and merging points at
 # the same time. Data is converted to dict() and written to influx batches to
 # avoid extra memory usage required for all data in dict() and avoid influxdb
-# allocating memory for entire incoming data set at once.
+# allocating memory for entire incoming data set at once. When continuing from
+# an incremental ingest the counters are passed in and measurements are kept.
 
 
-def walk_points(client, points, target):
+def walk_points(client, points, target, counters=None, delete=True):
     delete_api = client.delete_api()
     write_api = client.write_api(write_options=SYNCHRONOUS)
     measurements = set()
-    counters = {}
+    if counters is None:
+        counters = {}
     final = []
     time_last = None
     wrote = 0
-    for point in sorted(points, key=lambda p: p.time):
-        if point.measurement not in measurements:
+    for point in points:
+        if delete and point.measurement not in measurements:
             # Wait until just before writing to drop measurement.
             delete_api.delete(start="1970-01-01T00:00:00Z",
                               stop=datetime.utcnow().isoformat() + "Z",
@@ -315,15 +574,7 @@ def walk_points(client, points, target):
             final.append(dict(point._asdict()))
             continue
 
-        # A more generic method like 'key' which ended up being needed is likely better.
-        measurement = counters_tag_key = point.measurement
-        if measurement == 'staging':
-            counters_tag_key += point.tags['id']
-        elif measurement == 'review_count':
-            counters_tag_key += '_'.join(point.tags['key'])
-        elif measurement == 'priority':
-            counters_tag_key += point.tags['level']
-        counters_tag = counters.setdefault(counters_tag_key, {'last': None, 'values': {}})
+        counters_tag = counters.setdefault(counters_key(point), {'last': None, 'values': {}})
 
         values = counters_tag['values']
         for key, value in point.fields.items():
@@ -342,6 +593,73 @@ def walk_points(client, points, target):
     return wrote + len(final)
 
 
+class RecordDigest(object):
+    """Stands in for the InfluxDB client and only digests the written records."""
+
+    def __init__(self):
+        self.digest = hashlib.sha1()
+        self.records = 0
+
+    def delete_api(self):
+        return self
+
+    def write_api(self, write_options=None):
+        return self
+
+    def delete(self, **kwargs):
+        pass
+
+    def write(self, bucket, record, write_precision):
+        for entry in record:
+            self.digest.update(json.dumps(entry, sort_keys=True).encode('utf-8'))
+        self.records += len(record)
+
+
+def points_synthetic(count, seed=0):
+    rnd = random.Random(seed)
+    span = 10 * 365 * 24 * 60
+    for _ in range(count):
+        # Minute resolution so that points at the same time are merged.
+        time = rnd.randrange(span) * 60
+        kind = rnd.random()
+        if kind < 0.4:
+            sign = rnd.choice((1, -1))
+            yield Point('total', {'event': 'create' if sign > 0 else 'close'},
+                        {'backlog': sign, 'open': sign}, time, True)
+        elif kind < 0.6:
+            yield Point('staging', {'id': rnd.choice('ABCDEFGHIJ'), 'event': 'select'},
+                        {'count': rnd.choice((1, -1))}, time, True)
+        elif kind < 0.8:
+            user = f'user{rnd.randrange(50)}'
+            yield Point('review_count', {'by_user': user, 'key': [user], 'type': 'user'},
+                        {'count': rnd.choice((1, -1))}, time, True)
+        else:
+            yield Point('request', {'type': 'letter', 'whitelisted': True},
+                        {'total': rnd.random() * 1e6, 'staged_count': rnd.randrange(5)}, time, False)
+
+
+def benchmark_walk_run(count, spool):
+    start = datetime.now()
+    if spool:
+        points = PointSpool()
+        points.extend(points_synthetic(count))
+    else:
+        points = sorted(points_synthetic(count), key=lambda p: p.time)
+    client = RecordDigest()
+    walk_points(client, points, 'benchmark')
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return (datetime.now() - start).total_seconds(), rss, client.records, client.digest.hexdigest()
+
+
+def benchmark_walk(count):
+    for name, spool in (('sorted list', False), ('spool', True)):
+        # Separate processes to measure the peak memory of each.
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('fork')) as executor:
+            seconds, rss, records, digest = executor.submit(benchmark_walk_run, count, spool).result()
+        print(f'{name:<12} {count:,} points: {seconds:.1f}s, peak {rss / 1024:,.0f} MiB, '
+              f'{records:,} records {digest}')
+
+
 def ingest_release_schedule(client, project):
     points = []
     release_schedule = {}
@@ -378,9 +696,86 @@ def ingest_release_schedule(client, project):
     return len(points)
 
 
+class DashboardCache(object):
+    """
+    Files of the dashboard package by revision.
+
+    Revisions never change, so the file listing of each revision and the
+    content of each file by md5 are kept across runs. A revision costs a single
+    listing request the first time it is seen and only content not seen in an
+    earlier revision is fetched.
+    """
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS revision (revision TEXT PRIMARY KEY, files TEXT)',
+        'CREATE TABLE IF NOT EXISTS content (md5 TEXT PRIMARY KEY, content TEXT)',
+    ]
+
+    def __init__(self, path, apiurl, project, package):
+        self.apiurl = apiurl
+        self.project = project
+        self.package = package
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        for statement in self.SCHEMA:
+            self.db.execute(statement)
+
+    def clear(self):
+        self.db.execute('DELETE FROM revision')
+        self.db.execute('DELETE FROM content')
+        self.db.commit()
+
+    def files(self, revision):
+        """Return the md5 of each file in revision."""
+        row = self.db.execute('SELECT files FROM revision WHERE revision = ?', (revision,)).fetchone()
+        if row:
+            return json.loads(row[0])
+
+        url = osc.core.makeurl(self.apiurl, ['source', self.project, self.package],
+                               {'rev': revision, 'expand': 1})
+        try:
+            root = ET.parse(osc.core.http_GET(url)).getroot()
+        except HTTPError:
+            return {}
+
+        files = {entry.get('name'): entry.get('md5') for entry in root.findall('entry')}
+        self.db.execute('INSERT OR REPLACE INTO revision VALUES (?, ?)', (revision, json.dumps(files)))
+        self.db.commit()
+        return files
+
+    def load(self, filename, revision):
+        md5 = self.files(revision).get(filename)
+        if md5 is None:
+            return None
+
+        row = self.db.execute('SELECT content FROM content WHERE md5 = ?', (md5,)).fetchone()
+        if row:
+            return row[0]
+
+        content = source_file_load(self.apiurl, self.project, self.package, filename, revision)
+        if content is None:
+            return None
+
+        content = content.rstrip()
+        self.db.execute('INSERT OR REPLACE INTO content VALUES (?, ?)', (md5, content))
+        self.db.commit()
+        return content
+
+
+def dashboard_cache(api):
+    if not hasattr(dashboard_cache, 'cache'):
+        project, package = project_pseudometa_package(api.apiurl, api.project)
+        path = os.path.join(CacheManager.directory('metrics'), f'{api.project}.dashboard.sqlite')
+        dashboard_cache.cache = DashboardCache(path, api.apiurl, project, package)
+
+    return dashboard_cache.cache
+
+
 def revision_index(api):
+    """Return the (date, revision) of the dashboard package commits, oldest first."""
     if not hasattr(revision_index, 'index'):
-        revision_index.index = {}
+        revision_index.index = []
+        revision_index.dates = []
 
         project, package = project_pseudometa_package(api.apiurl, api.project)
         try:
@@ -389,18 +784,22 @@ def revision_index(api):
         except HTTPError:
             return revision_index.index
 
+        # One revision per date, the oldest since the log is newest first.
+        index = {}
         for logentry in root.findall('logentry'):
-            date = date_parse(logentry.find('date').text)
-            revision_index.index[date] = logentry.get('revision')
+            index[date_parse(logentry.find('date').text)] = logentry.get('revision')
+
+        revision_index.index = sorted(index.items())
+        revision_index.dates = [made for made, _ in revision_index.index]
 
     return revision_index.index
 
 
 def revision_at(api, datetime):
     index = revision_index(api)
-    for made, revision in sorted(index.items(), reverse=True):
-        if made <= datetime:
-            return revision
+    position = bisect.bisect_right(revision_index.dates, datetime)
+    if position:
+        return index[position - 1][1]
 
     return None
 
@@ -411,7 +810,7 @@ def dashboard_at(api, filename, datetime=None, revision=None):
     if not revision:
         return revision
 
-    content = api.pseudometa_file_load(filename, revision)
+    content = dashboard_cache(api).load(filename, revision)
     if filename in ('ignored_requests'):
         if content:
             return yaml.safe_load(content)
@@ -537,7 +936,8 @@ def ingest_dashboard(client, project, api):
 
     count = 0
     points = []
-    for made, revision in sorted(index.items()):
+    write_api = client.write_api(write_options=SYNCHRONOUS)
+    for made, revision in index:
         if not past:
             if revision == revision_last:
                 past = True
@@ -567,12 +967,12 @@ def ingest_dashboard(client, project, api):
         })
 
         if len(points) >= 1000:
-            client.write_points(points, 's')
+            write_api.write(bucket=project, record=points, write_precision='s')
             count += len(points)
             points = []
 
     if len(points):
-        client.write_points(points, 's')
+        write_api.write(bucket=project, record=points, write_precision='s')
         count += len(points)
 
     print(f"last revision processed: {revision if len(index) else 'none'}")
@@ -581,6 +981,9 @@ def ingest_dashboard(client, project, api):
 
 
 def main(args):
+    if args.benchmark_walk:
+        return benchmark_walk(args.benchmark_walk)
+
     with InfluxDBClient(url=f"http://{args.host}:{args.port}",
                         username=args.user,
                         password=args.password,
@@ -605,18 +1008,19 @@ def main(args):
         if args.heavy_cache:
             Cache.PATTERNS[r'/search/request'] = sys.maxsize
             Cache.PATTERNS[r'/source/[^/]+/{}/_history'.format(package)] = sys.maxsize
-        Cache.PATTERNS[r'/source/[^/]+/{}/[^/]+\?rev=.*'.format(package)] = sys.maxsize
         Cache.init('metrics')
 
         Config(apiurl, args.project)
         api = StagingAPI(apiurl, args.project)
+        if args.wipe_cache:
+            dashboard_cache(api).clear()
 
         print(f'dashboard: wrote {ingest_dashboard(client, args.project, api):,} points')
 
         global who_workaround_swap, who_workaround_miss
         who_workaround_swap = who_workaround_miss = 0
 
-        points_requests = ingest_requests(client, api, args.project)
+        points_requests = ingest_requests(client, api, args.project, args.full)
         points_schedule = ingest_release_schedule(client, args.project)
 
     print('who_workaround_swap', who_workaround_swap)
@@ -640,6 +1044,10 @@ if __name__ == '__main__':
     parser.add_argument('--heavy-cache', action='store_true',
                         help='cache ephemeral queries indefinitely (useful for development)')
     parser.add_argument('--release-only', action='store_true', help='ingest release metrics only')
+    parser.add_argument('--benchmark-walk', metavar='POINTS', type=int,
+                        help='compare walking synthetic points from a sorted list and the spool')
+    parser.add_argument('--full', action='store_true',
+                        help='rebuild request metrics from all requests instead of those changed since the last run')
     args = parser.parse_args()
 
     sys.exit(main(args))
@@ -1,4 +1,7 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from datetime import timedelta
+import hashlib
 import json
 import logging
 import os
@@ -24,19 +27,28 @@ from osclib.origin import origin_revision_state
 from osclib.origin import origin_updatable
 from osclib.origin import origin_updatable_initial
 from osclib.origin import origin_update
+from osclib.source_index import project_source_index
 from osclib.util import mail_send
 from shutil import copyfile
+import sqlite3
 import sys
 import time
 import yaml
 
 OSRT_ORIGIN_LOOKUP_TTL = 60 * 60 * 24 * 7
+OSRT_ORIGIN_LOOKUP_JOBS = 8
+OSRT_ORIGIN_LOOKUP_SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS lookup (package TEXT PRIMARY KEY, origin TEXT, revisions TEXT, state TEXT, updated REAL)',
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)',
+]
 
 
 @cmdln.option('--debug', action='store_true', help='output debug information')
 @cmdln.option('--diff', action='store_true', help='diff against previous report')
 @cmdln.option('--dry', action='store_true', help='perform a dry-run where applicable')
 @cmdln.option('--force-refresh', action='store_true', help='force refresh of data')
+@cmdln.option('-j', '--jobs', type=int, default=OSRT_ORIGIN_LOOKUP_JOBS,
+              help='number of packages to look up concurrently when refreshing')
 @cmdln.option('--format', default='plain', help='output format')
 @cmdln.option('--listen', action='store_true', help='listen to events')
 @cmdln.option('--listen-seconds', help='number of seconds to listen to events')
@@ -60,13 +72,13 @@ def do_origin(self, subcmd, opts, *args):
 
     Usage:
         osc origin config [--origins-only]
-        osc origin cron
+        osc origin cron [--jobs N]
         osc origin history [--format json|yaml] PACKAGE
-        osc origin list [--force-refresh] [--format json|yaml]
+        osc origin list [--force-refresh] [--jobs N] [--format json|yaml]
         osc origin package [--debug] PACKAGE
         osc origin potentials [--format json|yaml] PACKAGE
         osc origin projects [--format json|yaml]
-        osc origin report [--diff] [--force-refresh] [--mail]
+        osc origin report [--diff] [--force-refresh] [--jobs N] [--mail]
         osc origin update [--listen] [--listen-seconds] [PACKAGE...]
     """
 
@@ -121,8 +133,9 @@ def osrt_origin_cron(apiurl, opts, *args):
                 print(f'{project}<locked> lookup preserved')
                 continue
 
-        # Force update lookup information.
-        lookup = osrt_origin_lookup(apiurl, project, force_refresh=True, quiet=True)
+        # Update lookup information of changed packages or all if forced.
+        lookup = osrt_origin_lookup(apiurl, project, force_refresh=opts.force_refresh, refresh=True,
+                                    quiet=True, jobs=opts.jobs)
         print(f'{project} lookup updated for {len(lookup)} package(s)')
 
 
@@ -153,7 +166,7 @@ def osrt_origin_history(apiurl, opts, *packages):
 
 
 def osrt_origin_lookup_file(project, previous=False):
-    parts = [project, 'yaml']
+    parts = [project, 'sqlite']
     if previous:
         parts.insert(1, 'previous')
     lookup_name = '.'.join(parts)
@@ -161,48 +174,139 @@ def osrt_origin_lookup_file(project, previous=False):
     return os.path.join(cache_dir, lookup_name)
 
 
-def osrt_origin_lookup(apiurl, project, force_refresh=False, previous=False, quiet=False):
-    locked = project_locked(apiurl, project)
-    if locked:
-        force_refresh = False
+def osrt_origin_lookup_open(lookup_path):
+    db = sqlite3.connect(lookup_path, timeout=60, isolation_level=None)
+    for statement in OSRT_ORIGIN_LOOKUP_SCHEMA:
+        db.execute(statement)
+    return db
 
-    lookup_path = osrt_origin_lookup_file(project, previous)
-    if not force_refresh and os.path.exists(lookup_path):
-        if not locked and not previous:
-            # Force refresh of lookup information if expried.
-            if time.time() - os.stat(lookup_path).st_mtime > OSRT_ORIGIN_LOOKUP_TTL:
-                return osrt_origin_lookup(apiurl, project, True)
-
-        with open(lookup_path, 'r') as lookup_stream:
-            lookup = yaml.safe_load(lookup_stream)
-
-            if not isinstance(next(iter(lookup.values())), dict):
-                # Convert flat format to dictionary.
-                for package, origin in lookup.items():
-                    lookup[package] = {'origin': origin}
-    else:
-        if previous:
-            return None
 
-        packages = package_list_kind_filtered(apiurl, project)
+def osrt_origin_lookup_load(db):
+    lookup = {}
+    for package, origin, revisions in db.execute('SELECT package, origin, revisions FROM lookup ORDER BY package'):
+        lookup[package] = {'origin': origin, 'revisions': json.loads(revisions)}
+    return lookup
+
+
+def osrt_origin_lookup_meta(db, key, value=None):
+    if value is not None:
+        db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, str(value)))
+        return value
+
+    row = db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else None
+
+
+def osrt_origin_lookup_state(apiurl, project, origins, package, origin):
+    """
+    Digest of the sources of package in the project, the origins and their
+    linked projects or None if it cannot be determined.
+
+    Pending and workaround origins depend on requests and reviews rather than
+    sources so they are never considered unchanged.
+    """
+    if origin == 'None' or origin.endswith(('+', '~')):
+        return None
+
+    states = []
+    for project in [project] + origins + [origin]:
+        while project:
+            index = project_source_index(apiurl, project)
+            if index.states is None:
+                return None
+            states.append(f'{project}={index.states.get(package, "")}')
+            project = index.link
 
-        lookup = {}
-        for package in packages:
-            origin_info = origin_find(apiurl, project, package)
-            lookup[str(package)] = {
-                'origin': str(origin_info),
-                'revisions': origin_revision_state(apiurl, project, package, origin_info),
-            }
+    return hashlib.sha1('\n'.join(states).encode('utf-8')).hexdigest()
 
-        if os.path.exists(lookup_path):
-            lookup_path_previous = osrt_origin_lookup_file(project, True)
-            copyfile(lookup_path, lookup_path_previous)
 
-        with open(lookup_path, 'w+') as lookup_stream:
-            yaml.dump(lookup, lookup_stream, default_flow_style=False)
+def osrt_origin_lookup_refresh(apiurl, project, db, jobs=OSRT_ORIGIN_LOOKUP_JOBS, full=False):
+    """
+    Update the lookup of packages whose sources or origin sources changed.
+
+    Every package is recomputed if full or the origin config changed and an
+    entry is recomputed at least every OSRT_ORIGIN_LOOKUP_TTL to pick up
+    changes not reflected in the sources, like a new devel project. Entries
+    are written as they complete so an interrupted refresh keeps its progress.
+    """
+    config = config_load(apiurl, project)
+    config_hash = hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    full = full or osrt_origin_lookup_meta(db, 'config') != config_hash
+    origins = []
+    for origin in config_origin_list(config, skip_workarounds=True):
+        # Devel origins are only known per package and covered by the origin found.
+        if not origin.startswith(('<', '*')) and origin not in origins:
+            origins.append(origin)
+
+    now = time.time()
+    entries = {}
+    for package, origin, state, updated in db.execute('SELECT package, origin, state, updated FROM lookup'):
+        entries[package] = (origin, state, updated)
+
+    def package_refresh(package):
+        entry = entries.get(package)
+        if entry and not full and entry[1] and now - entry[2] < OSRT_ORIGIN_LOOKUP_TTL:
+            if osrt_origin_lookup_state(apiurl, project, origins, package, entry[0]) == entry[1]:
+                return package, None
+
+        origin_info = origin_find(apiurl, project, package)
+        revisions = origin_revision_state(apiurl, project, package, origin_info)
+        state = osrt_origin_lookup_state(apiurl, project, origins, package, str(origin_info))
+        return package, (str(origin_info), json.dumps(revisions), state)
+
+    packages = [str(package) for package in package_list_kind_filtered(apiurl, project)]
+    refreshed = 0
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for package, entry in executor.map(package_refresh, packages):
+            if entry is not None:
+                db.execute('INSERT OR REPLACE INTO lookup VALUES (?, ?, ?, ?, ?)', (package, *entry, now))
+                refreshed += 1
+
+    for package in entries.keys() - set(packages):
+        db.execute('DELETE FROM lookup WHERE package = ?', (package,))
+
+    osrt_origin_lookup_meta(db, 'config', config_hash)
+    osrt_origin_lookup_meta(db, 'refreshed', now)
+    logging.debug(f'{project} lookup refreshed {refreshed} of {len(packages)} package(s)')
+    return refreshed
+
+
+def osrt_origin_lookup(apiurl, project, force_refresh=False, previous=False, quiet=False,
+                       jobs=OSRT_ORIGIN_LOOKUP_JOBS, refresh=False):
+    """
+    Load the lookup of project, refreshing it if expired or refresh is set.
+
+    Only packages whose sources changed are looked up again unless
+    force_refresh is set in which case every package is.
+    """
+    locked = project_locked(apiurl, project)
+    if locked:
+        force_refresh = False
+        refresh = False
+
+    lookup_path = osrt_origin_lookup_file(project, previous)
+    exists = os.path.exists(lookup_path)
+    if previous and not exists:
+        return None
+
+    with closing(osrt_origin_lookup_open(lookup_path)) as db:
+        refreshed = float(osrt_origin_lookup_meta(db, 'refreshed') or 0)
+        if not previous:
+            # Refresh lookup information if expired.
+            if not exists or force_refresh or refresh or (not locked and time.time() - refreshed > OSRT_ORIGIN_LOOKUP_TTL):
+                if exists:
+                    lookup_path_previous = osrt_origin_lookup_file(project, True)
+                    copyfile(lookup_path, lookup_path_previous)
+
+                # A forced refresh recomputes every package regardless of the
+                # stored digests of their sources.
+                osrt_origin_lookup_refresh(apiurl, project, db, jobs, full=force_refresh)
+                refreshed = float(osrt_origin_lookup_meta(db, 'refreshed'))
+
+        lookup = osrt_origin_lookup_load(db)
 
     if not previous and not quiet:
-        dt = timedelta(seconds=time.time() - os.stat(lookup_path).st_mtime)
+        dt = timedelta(seconds=time.time() - refreshed)
         print(f'# generated {dt} ago', file=sys.stderr)
 
     return lookup
@@ -213,7 +317,8 @@ def osrt_origin_max_key(dictionary, minimum):
 
 
 def osrt_origin_list(apiurl, opts, *args):
-    lookup = osrt_origin_lookup(apiurl, opts.project, opts.force_refresh, quiet=opts.format != 'plain')
+    lookup = osrt_origin_lookup(apiurl, opts.project, opts.force_refresh, quiet=opts.format != 'plain',
+                                jobs=opts.jobs)
 
     if opts.format != 'plain':
         # Suppliment data with request information.
@@ -308,7 +413,7 @@ def osrt_origin_report_diff(lookup, lookup_previous):
 
 
 def osrt_origin_report(apiurl, opts, *args):
-    lookup = osrt_origin_lookup(apiurl, opts.project, opts.force_refresh)
+    lookup = osrt_origin_lookup(apiurl, opts.project, opts.force_refresh, jobs=opts.jobs)
     origin_count = osrt_origin_report_count(lookup)
 
     columns = ['origin', 'count', 'percent']
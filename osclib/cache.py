@@ -1,16 +1,19 @@
 import datetime
 import hashlib
+import json
 import os
 import osc.core
 import re
+import sqlite3
 import sys
+import threading
 
+from urllib.error import HTTPError
 from urllib.parse import unquote
 from urllib.parse import urlsplit, SplitResult
 from io import BytesIO
 
 from osc import conf
-from urllib.request import urlopen
 from osclib.cache_manager import CacheManager
 from osclib.conf import str2bool
 from osclib.util import rmtree_nfs_safe
@@ -23,17 +26,34 @@ def http_request(method, url, headers={}, data=None, file=None):
     Wrapper for osc.core.http_request() to provide GET request caching.
     """
 
+    conditional = {}
     if method == 'GET':
         ret = Cache.get(url)
         if ret:
             return ret
+
+        # Ask the server to only send the body if it changed since the expired
+        # entry was stored.
+        conditional = Cache.conditional_headers(url)
     else:
         # Logically, seems to make more sense after real call, but practically
         # it should not matter and makes the apitests happy when dealing with
         # request acceptance which causes a GET to determine target project.
         Cache.delete(url)
 
-    ret = osc.core._http_request(method, url, headers, data, file)
+    if conditional:
+        try:
+            ret = osc.core._http_request(method, url, dict(headers or {}, **conditional), data, file)
+        except HTTPError as e:
+            if e.code != 304:
+                raise
+            ret = Cache.revalidated(url, e.headers)
+            if ret:
+                return ret
+            # entry removed in the meantime so request the full response
+            ret = osc.core._http_request(method, url, headers, data, file)
+    else:
+        ret = osc.core._http_request(method, url, headers, data, file)
 
     if method == 'GET':
         ret = Cache.put(url, ret)
@@ -41,6 +61,228 @@ def http_request(method, url, headers={}, data=None, file=None):
     return ret
 
 
+class DirectoryCacheBackend(object):
+    """
+    Store every response as a file named by the sha1 of the url in a directory
+    per host and project. The validators of a response are kept next to it in
+    a .validators file.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def project_path(self, host, project):
+        parts = [self.directory, host]
+        if project:
+            parts.append(project)
+        return os.path.join(*parts)
+
+    def path(self, url, project):
+        host = urlsplit(url).hostname
+        return os.path.join(self.project_path(host, project), hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    def get(self, url, project):
+        """Return (data, mtime, validators) of the entry or None."""
+        path = self.path(url, project)
+        try:
+            with open(path, 'rb') as f:
+                data, mtime = f.read(), os.fstat(f.fileno()).st_mtime
+        except FileNotFoundError:
+            return None
+        return data, mtime, self.validators(path)
+
+    def validators(self, path):
+        try:
+            with open(path + '.validators', 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def put(self, url, project, data, validators=None):
+        path = self.path(url, project)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        self.put_validators(path, validators)
+
+    def put_validators(self, path, validators):
+        if validators:
+            with open(path + '.validators', 'w') as f:
+                json.dump(validators, f)
+        elif os.path.exists(path + '.validators'):
+            os.remove(path + '.validators')
+
+    def touch(self, url, project, validators):
+        """Mark the entry as fresh after the server confirmed it unchanged."""
+        path = self.path(url, project)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        self.put_validators(path, validators)
+        return True
+
+    def delete(self, url, project):
+        path = self.path(url, project)
+        if not os.path.exists(path):
+            return False
+        os.remove(path)
+        if os.path.exists(path + '.validators'):
+            os.remove(path + '.validators')
+        return True
+
+    def project_mtime(self, host, project):
+        directory = self.project_path(host, project)
+        if os.path.exists(directory):
+            return os.path.getmtime(directory)
+        return None
+
+    def delete_project(self, host, project):
+        path = self.project_path(host, project)
+        if not os.path.exists(path):
+            return False
+        rmtree_nfs_safe(path)
+        return True
+
+    def delete_all(self):
+        if os.path.exists(self.directory):
+            rmtree_nfs_safe(self.directory)
+
+
+class SqliteCacheBackend(object):
+    """
+    Store all responses in a single indexed sqlite database.
+
+    Removing the entries of a project is a single indexed delete. Once the
+    stored responses exceed max_size bytes the least recently used entries are
+    evicted.
+    """
+
+    MAX_SIZE = 2 * 1024 ** 3
+    ATIME_RESOLUTION = 60
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS entry (key TEXT PRIMARY KEY, host TEXT, project TEXT, '
+        'mtime REAL, atime REAL, size INTEGER, data BLOB, etag TEXT, last_modified TEXT)',
+        'CREATE INDEX IF NOT EXISTS entry_project ON entry (host, project, mtime)',
+        'CREATE INDEX IF NOT EXISTS entry_atime ON entry (atime)',
+        'CREATE TABLE IF NOT EXISTS total (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER)',
+        'INSERT OR IGNORE INTO total VALUES (0, 0)',
+        # keep the total size up to date however entries change
+        'CREATE TRIGGER IF NOT EXISTS entry_insert AFTER INSERT ON entry '
+        'BEGIN UPDATE total SET size = size + new.size; END',
+        'CREATE TRIGGER IF NOT EXISTS entry_delete AFTER DELETE ON entry '
+        'BEGIN UPDATE total SET size = size - old.size; END',
+        'CREATE TRIGGER IF NOT EXISTS entry_update AFTER UPDATE OF size ON entry '
+        'BEGIN UPDATE total SET size = size - old.size + new.size; END',
+    ]
+
+    def __init__(self, directory, max_size=MAX_SIZE):
+        self.directory = directory
+        self.path = os.path.join(directory, 'cache.sqlite')
+        self.max_size = max_size
+        # sqlite connections can not be shared between threads
+        self.local = threading.local()
+
+    @property
+    def db(self):
+        db = getattr(self.local, 'db', None)
+        # nor between processes, a forked child opens its own
+        if db is None or self.local.pid != os.getpid():
+            os.makedirs(self.directory, exist_ok=True)
+            # default rollback journal as WAL does not work on NFS
+            db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            # rows replaced by INSERT OR REPLACE only fire the delete trigger
+            # keeping the size with recursive triggers
+            db.execute('PRAGMA recursive_triggers = ON')
+            for statement in self.SCHEMA:
+                db.execute(statement)
+            columns = [row[1] for row in db.execute('PRAGMA table_info(entry)')]
+            for column in ('etag', 'last_modified'):
+                # databases created before validators were stored
+                if column not in columns:
+                    db.execute(f'ALTER TABLE entry ADD COLUMN {column} TEXT')
+            self.local.db = db
+            self.local.pid = os.getpid()
+        return db
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def get(self, url, project):
+        """Return (data, mtime, validators) of the entry or None."""
+        key = self.key(url)
+        row = self.db.execute('SELECT data, mtime, atime, etag, last_modified FROM entry WHERE key = ?',
+                              (key,)).fetchone()
+        if not row:
+            return None
+        data, mtime, atime, etag, last_modified = row
+        # the access time only orders eviction so a coarse one is enough, which
+        # keeps most hits from taking the write lock
+        now = time()
+        if now - atime > self.ATIME_RESOLUTION:
+            self.db.execute('UPDATE entry SET atime = ? WHERE key = ?', (now, key))
+        validators = {'ETag': etag, 'Last-Modified': last_modified}
+        return data, mtime, {k: v for k, v in validators.items() if v}
+
+    def put(self, url, project, data, validators=None):
+        validators = validators or {}
+        now = time()
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO entry (key, host, project, mtime, atime, size, data, etag, last_modified) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            (self.key(url), urlsplit(url).hostname, project or '', now, now, len(data), data,
+                             validators.get('ETag'), validators.get('Last-Modified')))
+        self.evict()
+
+    def touch(self, url, project, validators):
+        """Mark the entry as fresh after the server confirmed it unchanged."""
+        now = time()
+        return self.db.execute('UPDATE entry SET mtime = ?, atime = ?, etag = ?, last_modified = ? WHERE key = ?',
+                               (now, now, validators.get('ETag'), validators.get('Last-Modified'),
+                                self.key(url))).rowcount > 0
+
+    def evict(self):
+        size = self.db.execute('SELECT size FROM total').fetchone()[0]
+        if size <= self.max_size:
+            return
+
+        with self.db:
+            # autocommit connection, so the transaction is begun explicitly to
+            # commit the deletes at once and evict from one process at a time
+            self.db.execute('BEGIN IMMEDIATE')
+            # resum as databases written without recursive triggers counted
+            # replaced rows twice
+            self.db.execute('UPDATE total SET size = (SELECT COALESCE(SUM(size), 0) FROM entry)')
+            size = self.db.execute('SELECT size FROM total').fetchone()[0]
+            # free a bit more than needed to not evict on every put
+            excess = size - self.max_size * 0.9
+            while excess > 0:
+                oldest = self.db.execute('SELECT key, size FROM entry ORDER BY atime LIMIT 1000').fetchall()
+                if not oldest:
+                    break
+                for key, entry_size in oldest:
+                    if excess <= 0:
+                        break
+                    self.db.execute('DELETE FROM entry WHERE key = ?', (key,))
+                    excess -= entry_size
+
+    def delete(self, url, project):
+        return self.db.execute('DELETE FROM entry WHERE key = ?', (self.key(url),)).rowcount > 0
+
+    def project_mtime(self, host, project):
+        return self.db.execute('SELECT MAX(mtime) FROM entry WHERE host = ? AND project = ?',
+                               (host, project or '')).fetchone()[0]
+
+    def delete_project(self, host, project):
+        return self.db.execute('DELETE FROM entry WHERE host = ? AND project = ?',
+                               (host, project or '')).rowcount > 0
+
+    def delete_all(self):
+        with self.db:
+            self.db.execute('DELETE FROM entry')
+
+
 class Cache(object):
     """
     Provide a cache implementation for osc.core.http_request().
@@ -60,9 +302,27 @@ class Cache(object):
 
     Any paths without a project context will be cleared when updated using this
     cache, but obviously not for other contributors.
+
+    The responses are stored by one of the BACKENDS, selected by BACKEND or the
+    $OSRT_CACHE_BACKEND environment variable.
+
+    The ETag and Last-Modified validators of each response are stored with it.
+    Once an entry expires it is revalidated using a conditional request so that
+    an unchanged response only costs a 304 without a body.
     """
 
     CACHE_DIR = None
+    BACKENDS = {
+        'directory': DirectoryCacheBackend,
+        'sqlite': SqliteCacheBackend,
+    }
+    BACKEND = 'sqlite'
+    backend = None
+    stats = {'hits': 0, 'revalidated': 0, 'misses': 0, 'bytes_read': 0, 'bytes_written': 0}
+    VALIDATORS = {
+        'ETag': 'If-None-Match',
+        'Last-Modified': 'If-Modified-Since',
+    }
     TTL_LONG = 12 * 60 * 60
     TTL_MEDIUM = 30 * 60
     TTL_SHORT = 5 * 60
@@ -109,6 +369,8 @@ class Cache(object):
             return
 
         Cache.CACHE_DIR = CacheManager.directory('request', directory)
+        backend = os.environ.get('OSRT_CACHE_BACKEND', Cache.BACKEND)
+        Cache.backend = Cache.BACKENDS[backend](Cache.CACHE_DIR)
 
         Cache.patterns = []
 
@@ -131,7 +393,6 @@ class Cache(object):
         url = unquote(url)
         match, project = Cache.match(url)
         if match:
-            path = Cache.path(url, project, include_file=True)
             ttl = Cache.PATTERNS[match]
 
             if project:
@@ -155,9 +416,9 @@ class Cache(object):
                 # Treat non-existant cache as brand new for the sake of history
                 # span check since it behaves as desired.
                 age = 0
-                directory = Cache.path(url, project)
-                if os.path.exists(directory):
-                    age = time() - os.path.getmtime(directory)
+                mtime = Cache.backend.project_mtime(urlsplit(url).hostname, project)
+                if mtime is not None:
+                    age = time() - mtime
 
                 # If history span is shorter than allowed cache life and the age
                 # of the current cache is older than history span with no
@@ -171,39 +432,92 @@ class Cache(object):
                 if history_span < ttl_delta and age_delta > history_span:
                     Cache.delete_project(apiurl, project)
 
-            if os.path.exists(path) and time() - os.path.getmtime(path) <= ttl:
+            entry = Cache.backend.get(url, project)
+            if entry and time() - entry[1] <= ttl:
                 if conf.config['debug']:
                     print('CACHE_GET', url, file=sys.stderr)
-                return urlopen('file://' + path)
+                Cache.stats['hits'] += 1
+                Cache.stats['bytes_read'] += len(entry[0])
+                return BytesIO(entry[0])
             else:
-                reason = '(' + ('expired' if os.path.exists(path) else 'does not exist') + ')'
+                reason = '(' + ('expired' if entry else 'does not exist') + ')'
                 if conf.config['debug']:
                     print('CACHE_MISS', url, reason, file=sys.stderr)
 
         return None
 
+    @staticmethod
+    def conditional_headers(url):
+        """Return the headers to revalidate an expired entry for url, if any."""
+        url = unquote(url)
+        match, project = Cache.match(url)
+        if not match:
+            return {}
+
+        entry = Cache.backend.get(url, project)
+        if not entry:
+            return {}
+        return {Cache.VALIDATORS[name]: value for name, value in entry[2].items()}
+
+    @staticmethod
+    def revalidated(url, headers):
+        """
+        Return the cached response for url after the server answered a
+        conditional request with 304 Not Modified.
+        """
+        url = unquote(url)
+        match, project = Cache.match(url)
+        if not match:
+            return None
+
+        entry = Cache.backend.get(url, project)
+        if not entry:
+            return None
+
+        # a 304 may carry updated validators
+        validators = dict(entry[2])
+        validators.update(Cache.validators(headers))
+        Cache.backend.touch(url, project, validators)
+
+        if conf.config['debug']:
+            print('CACHE_REVALIDATED', url, file=sys.stderr)
+        Cache.stats['revalidated'] += 1
+        Cache.stats['bytes_read'] += len(entry[0])
+        return BytesIO(entry[0])
+
+    @staticmethod
+    def validators(headers):
+        if headers is None:
+            return {}
+        validators = {}
+        for name in Cache.VALIDATORS:
+            value = headers.get(name)
+            if value:
+                validators[name] = value
+        return validators
+
     @staticmethod
     def put(url, data):
         url = unquote(url)
         match, project = Cache.match(url)
         if match:
-            path = Cache.path(url, project, include_file=True, makedirs=True)
             ttl = Cache.PATTERNS[match]
             if ttl == 0:
                 return data
 
             # Since urlopen does not return a seekable stream it cannot be reset
-            # after writing to cache. As such a wrapper must be used. This could
-            # be replaced with urlopen('file://...') to be consistent, but until
-            # the need arrises BytesIO has less overhead.
+            # after writing to cache. As such a wrapper must be used.
+            validators = Cache.validators(getattr(data, 'headers', None))
             text = data.read()
             data = BytesIO(text)
 
             if conf.config['debug']:
                 print('CACHE_PUT', url, project, file=sys.stderr)
-            f = open(path, 'wb')
-            f.write(text)
-            f.close()
+            Cache.backend.put(url, project, text, validators)
+            # counted here as expired entries revalidated by the server are not
+            # misses
+            Cache.stats['misses'] += 1
+            Cache.stats['bytes_written'] += len(text)
 
         return data
 
@@ -212,21 +526,19 @@ class Cache(object):
         url = unquote(url)
         match, project = Cache.match(url)
         if match:
-            path = Cache.path(url, project, include_file=True)
-
             # Rather then wait for last updated statistics to expire, remove the
             # project cache if applicable.
             if project:
                 apiurl, _ = Cache.spliturl(url)
+                target_project = project
                 if project.isdigit():
                     # Clear target project cache upon request acceptance.
-                    project = osc.core.get_request(apiurl, project).actions[0].tgt_project
-                Cache.delete_project(apiurl, project)
+                    target_project = osc.core.get_request(apiurl, project).actions[0].tgt_project
+                Cache.delete_project(apiurl, target_project)
 
-            if os.path.exists(path):
+            if Cache.backend.delete(url, project):
                 if conf.config['debug']:
                     print('CACHE_DELETE', url, file=sys.stderr)
-                os.remove(path)
 
         # Also delete version without query. This does not handle other
         # variations using different query strings. Handy for PUT with ?force=1.
@@ -237,17 +549,15 @@ class Cache(object):
 
     @staticmethod
     def delete_project(apiurl, project):
-        path = Cache.path(apiurl, project)
-
-        if os.path.exists(path):
+        if Cache.backend.delete_project(urlsplit(apiurl).hostname, project):
             if conf.config['debug']:
                 print('CACHE_DELETE_PROJECT', apiurl, project, file=sys.stderr)
-            rmtree_nfs_safe(path)
 
     @staticmethod
     def delete_all():
-        if os.path.exists(Cache.CACHE_DIR):
-            rmtree_nfs_safe(Cache.CACHE_DIR)
+        if not Cache.backend:
+            raise Exception('Cache.init() must be called first')
+        Cache.backend.delete_all()
 
     @staticmethod
     def match(url):
@@ -266,29 +576,6 @@ class Cache(object):
         path = SplitResult('', '', o.path, o.query, '').geturl()
         return (apiurl, path)
 
-    @staticmethod
-    def path(url, project, include_file=False, makedirs=False):
-        if not Cache.CACHE_DIR:
-            raise Exception('Cache.init() must be called first')
-
-        parts = [Cache.CACHE_DIR]
-
-        o = urlsplit(url)
-        parts.append(o.hostname)
-
-        if project:
-            parts.append(project)
-
-        directory = os.path.join(*parts)
-        if not os.path.exists(directory) and makedirs:
-            os.makedirs(directory)
-
-        if include_file:
-            parts.append(hashlib.sha1(url.encode('utf-8')).hexdigest())
-            return os.path.join(*parts)
-
-        return directory
-
     @staticmethod
     def last_updated_load(apiurl):
         if apiurl in Cache.last_updated:
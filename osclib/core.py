@@ -811,13 +811,15 @@ def package_source_link_copy(apiurl, project, package):
 
 
 @memoize(session=True)
-def package_source_hash(apiurl, project, package, revision=None):
+def package_source_hash(apiurl, project, package, revision=None, expand=None):
     query = {}
     if revision:
         query['rev'] = revision
 
     # Will not catch packages that previous had a link, but no longer do.
-    if package_source_link_copy(apiurl, project, package):
+    if expand is None:
+        expand = package_source_link_copy(apiurl, project, package)
+    if expand:
         query['expand'] = 1
 
     try:
@@ -1,84 +1,183 @@
 #!/usr/bin/python3
 
+import io
+import shutil
 import struct
-
-
-class Cpio(object):
-    def __init__(self, buf):
-        self.buf = buf
-        self.off = 0
+import time
+
+CPIO_MAGIC = b'070701'
+CPIO_TRAILER = 'TRAILER!!!'
+CPIO_HEADER = struct.Struct('6s8s8s8s8s8s8s8s8s8s8s8s8s8s')
+CPIO_FIELDS = ('ino', 'mode', 'uid', 'gid', 'nlink', 'mtime', 'filesize',
+               'devmajor', 'devminor', 'rdevmajor', 'rdevminor', 'namesize', 'check')
+
+
+def _padding(size):
+    # the new-ascii format aligns headers and data to 4 bytes
+    return (4 - (size % 4)) % 4
+
+
+class CpioMember(io.RawIOBase):
+    """Reader for the data of a single archive member.
+
+    Reads directly from the underlying stream and never returns more than
+    the member's size. Only valid until the next member is requested.
+    """
+
+    def __init__(self, archive, size):
+        super().__init__()
+        self._archive = archive
+        self.remaining = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        view = memoryview(b).cast('B')
+        if self.remaining <= 0 or not len(view):
+            return 0
+        n = self._archive._readinto(view[:min(len(view), self.remaining)])
+        if not n:
+            raise EOFError(f'unexpected end of cpio archive at offset {self._archive.offset}')
+        self.remaining -= n
+        return n
+
+
+class CpioReader:
+    """Streaming reader for new-ascii (070701) cpio archives.
+
+    Iterating yields (name, size, reader) tuples in archive order, where
+    reader is a file-like CpioMember for the member's data. Data which is
+    not read before the next iteration is skipped. The stream only needs a
+    read() or readinto() method, so HTTP responses and pipes can be passed
+    without buffering the archive.
+    """
+
+    def __init__(self, stream, bufsize=1024 * 1024):
+        self.stream = stream
+        self.offset = 0
+        self.header = None
+        self._readinto_stream = getattr(stream, 'readinto', None)
+        self._scratch = memoryview(bytearray(bufsize))
+        self._header_buf = memoryview(bytearray(CPIO_HEADER.size))
+
+    def _readinto(self, view):
+        """Read up to len(view) bytes into view, returning the number of bytes read."""
+        if self._readinto_stream is not None:
+            n = self._readinto_stream(view) or 0
+        else:
+            data = self.stream.read(len(view))
+            n = len(data)
+            view[:n] = data
+        self.offset += n
+        return n
+
+    def _readexact(self, view):
+        pos = 0
+        while pos < len(view):
+            n = self._readinto(view[pos:])
+            if not n:
+                raise EOFError(f'unexpected end of cpio archive at offset {self.offset}')
+            pos += n
+
+    def _skip(self, size):
+        while size > 0:
+            chunk = self._scratch[:min(size, len(self._scratch))]
+            self._readexact(chunk)
+            size -= len(chunk)
+
+    def _read_header(self):
+        self._readexact(self._header_buf)
+        fields = CPIO_HEADER.unpack(self._header_buf)
+        if fields[0] != CPIO_MAGIC:
+            raise NotImplementedError(f'CPIO format {fields[0]} not implemented')
+        header = dict(zip(CPIO_FIELDS, (int(f, 16) for f in fields[1:])))
+
+        name = bytearray(header['namesize'])
+        self._readexact(memoryview(name))
+        header['name'] = bytes(name[:-1]).decode('utf-8', errors='surrogateescape')
+        self._skip(_padding(CPIO_HEADER.size + header['namesize']))
+        return header
 
     def __iter__(self):
-        return self
-
-    def next(self):
-        f = CpioFile(self.off, self.buf)
-        if f.fin():
-            raise StopIteration
-        self.off = self.off + f.length()
-        return f
-
-
-class CpioFile(object):
-    def __init__(self, off, buf):
-        self.off = off
-        self.buf = buf
-
-        if (off & 3):
-            raise Exception("invalid offset %d" % off)
-
-        fmt = "6s8s8s8s8s8s8s8s8s8s8s8s8s8s"
-        off = self.off + struct.calcsize(fmt)
-
-        fields = struct.unpack(fmt, buf[self.off:off])
-
-        if fields[0] != "070701":
-            raise Exception(f"invalid cpio header {self.c_magic}")
-
-        names = ("c_ino", "c_mode", "c_uid", "c_gid",
-                 "c_nlink", "c_mtime", "c_filesize",
-                 "c_devmajor", "c_devminor", "c_rdevmajor",
-                 "c_rdevminor", "c_namesize", "c_check")
-        for (n, v) in zip(names, fields[1:]):
-            setattr(self, n, int(v, 16))
-
-        nlen = self.c_namesize - 1
-        self.name = struct.unpack('%ds' % nlen, buf[off:off + nlen])[0]
-        off = off + nlen + 1
-        if (off & 3):
-            off = off + 4 - (off & 3)   # padding
-        self.payloadstart = off
-
-    def fin(self):
-        return self.name == 'TRAILER!!!'
-
-    def __str__(self):
-        return "[%s %d]" % (self.name, self.c_filesize)
-
-    def header(self):
-        return self.buf[self.payloadstart:self.payloadstart + self.c_filesize]
-
-    def length(self):
-        len = self.payloadstart - self.off + self.c_filesize
-        if (self.c_filesize & 3):
-            len = len + 4 - (self.c_filesize & 3)
-        return len
+        while True:
+            self.header = self._read_header()
+            name = self.header['name']
+            if name == CPIO_TRAILER:
+                return
+            size = self.header['filesize']
+            member = CpioMember(self, size)
+            yield name, size, member
+            self._skip(member.remaining)
+            self._skip(_padding(size))
+
+
+class SyntheticCpio(io.RawIOBase):
+    """Generates an archive of count members of size bytes without storing it."""
+
+    def __init__(self, count, size):
+        super().__init__()
+        self._chunks = self._generate(count, size)
+        self._pending = memoryview(b'')
+
+    @staticmethod
+    def _entry(name, size):
+        name = name.encode('ascii') + b'\0'
+        fields = [1, 0o100644, 0, 0, 1, 0, size, 0, 0, 0, 0, len(name), 0]
+        header = CPIO_MAGIC + b''.join(b'%08x' % f for f in fields) + name
+        return header + b'\0' * _padding(len(header))
+
+    def _generate(self, count, size):
+        data = memoryview(bytes(size) + b'\0' * _padding(size))
+        for i in range(count):
+            yield memoryview(self._entry(f'member-{i}', size))
+            yield data
+        yield memoryview(self._entry(CPIO_TRAILER, 0))
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not len(self._pending):
+            self._pending = next(self._chunks, None)
+            if self._pending is None:
+                self._pending = memoryview(b'')
+                return 0
+        n = min(len(b), len(self._pending))
+        b[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+def benchmark(count, size):
+    buf = memoryview(bytearray(1024 * 1024))
+    start = time.time()
+    total = 0
+    for name, member_size, reader in CpioReader(SyntheticCpio(count, size)):
+        while n := reader.readinto(buf):
+            total += n
+    elapsed = time.time() - start
+    print(f'{total / 1024 / 1024:.0f} MiB in {count} members: {elapsed:.2f}s, '
+          f'{total / 1024 / 1024 / elapsed:.0f} MiB/s')
 
 
 if __name__ == '__main__':
     from optparse import OptionParser
 
-    parser = OptionParser()
-    parser.add_option("--debug", action="store_true", help="debug output")
-    parser.add_option("--verbose", action="store_true", help="verbose")
+    parser = OptionParser(usage='%prog [options] ARCHIVE...')
+    parser.add_option("--benchmark", metavar="GIB", type=float,
+                      help="measure the throughput on a synthetic archive of GIB gibibytes")
+    parser.add_option("--member-size", metavar="BYTES", type=int, default=64 * 1024,
+                      help="member size of the synthetic archive")
 
     (options, args) = parser.parse_args()
 
+    if options.benchmark:
+        benchmark(int(options.benchmark * 1024 ** 3 / options.member_size), options.member_size)
+
     for fn in args:
-        fh = open(fn, 'rb')
-        cpio = Cpio(fh.read())
-        for i in cpio:
-            print(i)
-            ofh = open(i.name, 'wb')
-            ofh.write(i.header())
-            ofh.close()
+        with open(fn, 'rb') as fh:
+            for name, size, reader in CpioReader(fh):
+                print(f'[{name} {size}]')
+                with open(name, 'wb') as ofh:
+                    shutil.copyfileobj(reader, ofh)
@@ -5,10 +5,179 @@ import os
 from osclib.cache_manager import CacheManager
 import shelve
 import pickle
+import sqlite3
+import threading
+import time
 
 # Where the cache files are stored
 CACHEDIR = CacheManager.directory('memoize')
 
+# Per function hit / miss counts and the seconds spent on them
+STATS = {}
+
+
+class ShelveMemoizeBackend(object):
+    """
+    Persistent cache stored in a shelve, opened under an exclusive lock for
+    every call.
+    """
+
+    def __init__(self, cache_name, slots, nclean):
+        self.cache_name = cache_name
+        self.slots = slots
+        self.nclean = nclean
+
+    # Implement a POSIX lock / unlock extension for shelves. Inspired
+    # on ActiveState Code recipe #576591
+    def _lock(self):
+        lckfile = open(self.cache_name + '.lck', 'w')
+        fcntl.flock(lckfile.fileno(), fcntl.LOCK_EX)
+        return lckfile
+
+    def _unlock(self, lckfile):
+        fcntl.flock(lckfile.fileno(), fcntl.LOCK_UN)
+        lckfile.close()
+
+    def _open(self):
+        lckfile = self._lock()
+        cache = shelve.open(self.cache_name, protocol=-1)
+        # Store a reference to the lckfile to avoid to be
+        # closed by gc
+        cache.lckfile = lckfile
+        return cache
+
+    def _close(self, cache):
+        cache.close()
+        self._unlock(cache.lckfile)
+
+    def _clean(self, cache):
+        len_cache = len(cache)
+        if len_cache >= self.slots:
+            nclean = self.nclean + len_cache - self.slots
+            keys_to_delete = sorted(cache, key=lambda k: cache[k][0])[:nclean]
+            for key in keys_to_delete:
+                del cache[key]
+
+    def get(self, key):
+        """Return (timestamp, value) for key or None."""
+        cache = self._open()
+        try:
+            return cache.get(str(key))
+        finally:
+            self._close(cache)
+
+    def put(self, key, timestamp, value):
+        cache = self._open()
+        try:
+            cache[str(key)] = (timestamp, value)
+            self._clean(cache)
+        finally:
+            self._close(cache)
+
+    def delete(self, key):
+        cache = self._open()
+        try:
+            if str(key) in cache:
+                del cache[str(key)]
+        finally:
+            self._close(cache)
+
+    def clear(self):
+        cache = self._open()
+        try:
+            cache.clear()
+        finally:
+            self._close(cache)
+
+
+class SqliteMemoizeBackend(object):
+    """
+    Persistent cache stored in a sqlite database which stays open for the
+    lifetime of the process.
+
+    Lookups only take a shared lock so concurrent processes can read at the
+    same time. Entries are evicted least recently used first through an index
+    once the number of entries reaches slots.
+    """
+
+    ATIME_RESOLUTION = 60
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS entry (key BLOB PRIMARY KEY, timestamp REAL, atime REAL, value BLOB)',
+        'CREATE INDEX IF NOT EXISTS entry_atime ON entry (atime)',
+        'CREATE TABLE IF NOT EXISTS total (id INTEGER PRIMARY KEY CHECK (id = 0), count INTEGER)',
+        'INSERT OR IGNORE INTO total VALUES (0, 0)',
+        'CREATE TRIGGER IF NOT EXISTS entry_insert AFTER INSERT ON entry '
+        'BEGIN UPDATE total SET count = count + 1; END',
+        'CREATE TRIGGER IF NOT EXISTS entry_delete AFTER DELETE ON entry '
+        'BEGIN UPDATE total SET count = count - 1; END',
+    ]
+
+    def __init__(self, cache_name, slots, nclean):
+        self.path = cache_name + '.sqlite'
+        self.slots = slots
+        self.nclean = nclean
+        # sqlite connections can not be shared between threads
+        self.local = threading.local()
+
+    @property
+    def db(self):
+        db = getattr(self.local, 'db', None)
+        # nor between processes, a forked child opens its own
+        if db is None or self.local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # default rollback journal as WAL does not work on NFS
+            db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            # rows replaced by INSERT OR REPLACE only fire the delete trigger
+            # keeping the count with recursive triggers
+            db.execute('PRAGMA recursive_triggers = ON')
+            for statement in self.SCHEMA:
+                db.execute(statement)
+            self.local.db = db
+            self.local.pid = os.getpid()
+        return db
+
+    def get(self, key):
+        """Return (timestamp, value) for key or None."""
+        row = self.db.execute('SELECT timestamp, atime, value FROM entry WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        # the access time only orders eviction so a coarse one is enough, which
+        # keeps most lookups from taking the write lock
+        now = time.time()
+        if now - row[1] > self.ATIME_RESOLUTION:
+            self.db.execute('UPDATE entry SET atime = ? WHERE key = ?', (now, key))
+        return datetime.fromtimestamp(row[0]), pickle.loads(row[2])
+
+    def put(self, key, timestamp, value):
+        with self.db:
+            # autocommit connection, so the transaction is begun explicitly
+            # to evict from one process at a time
+            self.db.execute('BEGIN IMMEDIATE')
+            self.db.execute('INSERT OR REPLACE INTO entry VALUES (?, ?, ?, ?)',
+                            (key, timestamp.timestamp(), time.time(), pickle.dumps(value, protocol=-1)))
+            count = self.db.execute('SELECT count FROM total').fetchone()[0]
+            if count >= self.slots:
+                # recount as databases written without recursive triggers
+                # counted replaced rows twice
+                self.db.execute('UPDATE total SET count = (SELECT COUNT(*) FROM entry)')
+                count = self.db.execute('SELECT count FROM total').fetchone()[0]
+            if count >= self.slots:
+                self.db.execute('DELETE FROM entry WHERE key IN (SELECT key FROM entry ORDER BY atime LIMIT ?)',
+                                (self.nclean + count - self.slots,))
+
+    def delete(self, key):
+        self.db.execute('DELETE FROM entry WHERE key = ?', (key,))
+
+    def clear(self):
+        self.db.execute('DELETE FROM entry')
+
+
+BACKENDS = {
+    'shelve': ShelveMemoizeBackend,
+    'sqlite': SqliteMemoizeBackend,
+}
+BACKEND = os.environ.get('OSRT_MEMOIZE_BACKEND', 'sqlite')
+
 
 def memoize(ttl=None, session=False, add_invalidate=False):
     """Decorator function to implement a persistent cache.
@@ -70,46 +239,13 @@ def memoize(ttl=None, session=False, add_invalidate=False):
     SLOTS = 4096            # Number of slots in the cache file
     NCLEAN = 1024           # Number of slots to remove when limit reached
     TIMEOUT = 60 * 60 * 2   # Time to live for every cache slot (seconds)
-    memoize.session_functions = []
 
     def _memoize(fn):
-        # Implement a POSIX lock / unlock extension for shelves. Inspired
-        # on ActiveState Code recipe #576591
-        def _lock(filename):
-            lckfile = open(filename + '.lck', 'w')
-            fcntl.flock(lckfile.fileno(), fcntl.LOCK_EX)
-            return lckfile
-
-        def _unlock(lckfile):
-            fcntl.flock(lckfile.fileno(), fcntl.LOCK_UN)
-            lckfile.close()
-
-        def _open_cache(cache_name):
-            if not session:
-                lckfile = _lock(cache_name)
-                cache = shelve.open(cache_name, protocol=-1)
-                # Store a reference to the lckfile to avoid to be
-                # closed by gc
-                cache.lckfile = lckfile
-            else:
-                if not hasattr(fn, '_memoize_session_cache'):
-                    fn._memoize_session_cache = {}
-                    memoize.session_functions.append(fn)
-                cache = fn._memoize_session_cache
-            return cache
-
-        def _close_cache(cache):
-            if not session:
-                cache.close()
-                _unlock(cache.lckfile)
-
-        def _clean_cache(cache):
-            len_cache = len(cache)
-            if len_cache >= SLOTS:
-                nclean = NCLEAN + len_cache - SLOTS
-                keys_to_delete = sorted(cache, key=lambda k: cache[k][0])[:nclean]
-                for key in keys_to_delete:
-                    del cache[key]
+        def _session_cache():
+            if not hasattr(fn, '_memoize_session_cache'):
+                fn._memoize_session_cache = {}
+                memoize.session_functions.append(fn)
+            return fn._memoize_session_cache
 
         def _key(obj):
             # Pickle doesn't guarantee that there is a single
@@ -117,19 +253,31 @@ def memoize(ttl=None, session=False, add_invalidate=False):
             # picke / depickle twice to have a canonical
             # representation.
             key = pickle.dumps(obj, protocol=-1)
-            key = pickle.dumps(pickle.loads(key), protocol=-1)
-            # shelve only support str keys
-            return key if session else str(key)
+            return pickle.dumps(pickle.loads(key), protocol=-1)
+
+        def _get(key):
+            if session:
+                return _session_cache().get(key)
+            return backend.get(key)
+
+        def _put(key, timestamp, value):
+            if session:
+                _session_cache()[key] = (timestamp, value)
+            else:
+                backend.put(key, timestamp, value)
 
         def _invalidate(*args, **kwargs):
             key = _key((args, kwargs))
-            cache = _open_cache(cache_name)
-            if key in cache:
-                del cache[key]
+            if session:
+                _session_cache().pop(key, None)
+            else:
+                backend.delete(key)
 
         def _invalidate_all():
-            cache = _open_cache(cache_name)
-            cache.clear()
+            if session:
+                _session_cache().clear()
+            else:
+                backend.clear()
 
         def _add_invalidate_method(_self):
             name = f'_invalidate_{fn.__name__}'
@@ -150,26 +298,88 @@ def memoize(ttl=None, session=False, add_invalidate=False):
                 _add_invalidate_method(_self)
             first = str(args[0]) if isinstance(args[0], object) else args[0]
             key = _key((first, args[1:], kwargs))
+            start = time.time()
             updated = False
-            cache = _open_cache(cache_name)
-            if key in cache:
-                timestamp, value = cache[key]
+            entry = _get(key)
+            if entry is not None:
+                timestamp, value = entry
                 updated = True if total_seconds(now - timestamp) < ttl else False
             if not updated:
                 value = fn(*args, **kwargs)
-                cache[key] = (now, value)
-            _clean_cache(cache)
-            _close_cache(cache)
+                _put(key, now, value)
+            stats['hits' if updated else 'misses'] += 1
+            stats['hit_time' if updated else 'miss_time'] += time.time() - start
             return value
 
         cache_name = os.path.join(CACHEDIR, fn.__name__)
+        backend = None if session else BACKENDS[BACKEND](cache_name, SLOTS, NCLEAN)
+        stats = STATS.setdefault(f'{fn.__module__}.{fn.__qualname__}',
+                                 {'hits': 0, 'misses': 0, 'hit_time': 0.0, 'miss_time': 0.0})
         return _fn
 
     ttl = ttl if ttl else TIMEOUT
     return _memoize
 
 
+# Session memoized functions register on first call. Kept outside of memoize()
+# since modules imported later would otherwise drop earlier registrations.
+memoize.session_functions = []
+
+
+def memoize_stats(name=None):
+    """Return the statistics of memoized functions whose name contains name.
+
+    The result maps module.function to its hits, misses and the seconds spent
+    answering each (hit_time, miss_time), misses including the call itself.
+    """
+    return {fn: dict(stats) for fn, stats in STATS.items() if name is None or name in fn}
+
+
 def memoize_session_reset():
     """Reset all session caches."""
     for i, _ in enumerate(memoize.session_functions):
         memoize.session_functions[i]._memoize_session_cache = {}
+
+
+def _benchmark_worker(backend, calls, keys):
+    global BACKEND
+    BACKEND = backend
+
+    @memoize(ttl=3600)
+    def benchmark_function(i):
+        return {'value': i, 'payload': 'x' * 512}
+
+    for i in range(calls):
+        benchmark_function(i % keys)
+
+
+def benchmark(processes, calls, keys):
+    from multiprocessing import Process
+
+    for backend in BACKENDS:
+        cache_name = os.path.join(CACHEDIR, 'benchmark_function')
+        for suffix in ('', '.db', '.dat', '.dir', '.bak', '.sqlite'):
+            if os.path.exists(cache_name + suffix):
+                os.unlink(cache_name + suffix)
+
+        start = time.time()
+        workers = [Process(target=_benchmark_worker, args=(backend, calls, keys)) for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.time() - start
+        print(f'{backend}: {processes} processes x {calls} calls in {elapsed:.2f}s, '
+              f'{processes * calls / elapsed:.0f} calls/s')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compare the persistent memoize backends under contention')
+    parser.add_argument('-p', '--processes', type=int, default=8, help='number of concurrent processes')
+    parser.add_argument('-c', '--calls', type=int, default=500, help='calls per process')
+    parser.add_argument('-k', '--keys', type=int, default=200, help='number of distinct arguments')
+    args = parser.parse_args()
+
+    benchmark(args.processes, args.calls, args.keys)
@@ -15,7 +15,6 @@ from osclib.core import devel_projects
 from osclib.core import entity_exists
 from osclib.core import package_source_age
 from osclib.core import package_source_hash
-from osclib.core import package_source_hash_history
 from osclib.core import package_version
 from osclib.core import project_attributes_list
 from osclib.core import project_remote_apiurl
@@ -31,6 +30,8 @@ from osclib.core import review_find_last
 from osclib.core import reviews_remaining
 from osclib.memoize import memoize
 from osclib.memoize import memoize_session_reset
+from osclib.source_index import project_source_contain as project_source_index_contain
+from osclib.source_index import project_source_hash_history
 from osclib.util import project_list_family
 from osclib.util import project_list_family_prior_pattern
 import re
@@ -325,13 +326,9 @@ def origin_find(apiurl, target_project, package, source_hash=None, current=False
 
 
 def project_source_contain(apiurl, project, package, source_hash):
-    for source_hash_consider in package_source_hash_history(
-            apiurl, project, package, include_project_link=True):
-        project_source_log('contain', project, source_hash_consider, source_hash)
-        if source_hash_consider == source_hash:
-            return True
-
-    return False
+    contain = project_source_index_contain(apiurl, project, package, source_hash)
+    project_source_log('contain', project, source_hash if contain else None, source_hash)
+    return contain
 
 
 def project_source_pending(apiurl, project, package, source_hash) -> Union[PendingRequestInfo, Literal[False]]:
@@ -376,7 +373,7 @@ def origin_find_fallback(apiurl, target_project, package, source_hash, user):
 
     # Attempt to find a revision of target package that matches an origin.
     first = True
-    for source_hash_consider in package_source_hash_history(
+    for source_hash_consider in project_source_hash_history(
             apiurl, target_project, package, include_project_link=True):
         if first:
             first = False
@@ -538,7 +535,7 @@ def policy_input_calculate(apiurl, project, package,
             if workaround_new:
                 source_hashes = []
             else:
-                source_hashes = list(package_source_hash_history(
+                source_hashes = list(project_source_hash_history(
                     apiurl, origin_info_new.project, package, 10, True))
 
             try:
@@ -654,8 +651,8 @@ def origin_revision_state(apiurl, target_project, package, origin_info=False, li
         origin_hashes = []
     else:
         origin_project = origin_info.project.rstrip('~')
-        origin_hashes = list(package_source_hash_history(apiurl, origin_project, package, limit * 2, True))
-    target_hashes = list(package_source_hash_history(apiurl, target_project, package, limit, True))
+        origin_hashes = list(project_source_hash_history(apiurl, origin_project, package, limit * 2, True))
+    target_hashes = list(project_source_hash_history(apiurl, target_project, package, limit, True))
     for source_hash in origin_hashes:
         if source_hash not in target_hashes:
             revisions.append(-1)
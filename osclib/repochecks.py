@@ -1,10 +1,13 @@
+import hashlib
 import logging
 import os
 import re
 import requests
 import solv
+import sqlite3
 import subprocess
 import tempfile
+import time
 import glob
 from fnmatch import fnmatch
 from lxml import etree as ET
@@ -14,12 +17,16 @@ from osc.core import makeurl
 import yaml
 
 from osclib.cache_manager import CacheManager
+from osclib.repomirror import HEADER_STORE
 from osclib.repomirror import RepoMirror
 
 logger = logging.getLogger('InstallChecker')
 
 SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
 CACHEDIR = CacheManager.directory('repository-meta')
+INSTALLCHECK = '/usr/bin/installcheck'
+# 'external' runs INSTALLCHECK, 'solv' checks in-process (see solv_installcheck)
+INSTALLCHECK_ENGINE = os.environ.get('OSRT_INSTALLCHECK_ENGINE', 'external')
 
 
 class CorruptRepos(Exception):
@@ -85,9 +92,14 @@ def _do_packages_conflict(pool, pkgs):
     return True
 
 
-def _fileconflicts(pfile, arch, target_packages, whitelist):
+def _fileconflicts(pfile, arch, target_packages, whitelist, candidates=None):
+    """
+    Report the file conflicts of target_packages in pfile. If given, only the
+    packages in the candidates susetags file are searched for conflicts,
+    see _fileconflict_candidates().
+    """
     script = os.path.join(SCRIPT_PATH, '..', 'findfileconflicts')
-    p = subprocess.run(['perl', script, pfile], stdout=subprocess.PIPE)
+    p = subprocess.run(['perl', script, candidates or pfile], stdout=subprocess.PIPE)
     if p.returncode or len(p.stdout):
         output = ''
         conflicts = yaml.safe_load(p.stdout)
@@ -115,7 +127,9 @@ def _fileconflicts(pfile, arch, target_packages, whitelist):
                 continue
 
             output += f"found conflict of {_format_pkg(sp1)} with {_format_pkg(sp2)}\n"
-            for file in conflict['conflicts'].split('\n'):
+            # sorted since findfileconflicts orders them by its directory
+            # numbering, which depends on the packages searched
+            for file in sorted(conflict['conflicts'].split('\n')):
                 output += f"  {file}\n"
             output += "\n"
 
@@ -123,6 +137,304 @@ def _fileconflicts(pfile, arch, target_packages, whitelist):
             return output
 
 
+def _snippet_files(snippet):
+    """Yield path and whether it is a directory for the file list of a susetags package snippet."""
+    in_files = False
+    for line in snippet.split('\n'):
+        if line == '+Flx:':
+            in_files = True
+        elif line == '-Flx:':
+            return
+        elif in_files:
+            if line.startswith('12'):
+                line = line.rsplit(' -> ', 1)[0]
+            fields = line.split(' ', 3)
+            if len(fields) == 4 and '/' in fields[3]:
+                yield fields[3], int(fields[0], 8) & 0o170000 == 0o040000
+
+
+def _usrmerge_variants(path):
+    """The path and how it is named on the other side of a usr merge."""
+    match = re.match(r'^(/usr)?(/(?:s?bin|lib(?:64)?)(?:/.*)?)$', path)
+    if not match:
+        return [path]
+    return [path, match.group(2) if match.group(1) else '/usr' + match.group(2)]
+
+
+class FileConflictIndex(object):
+    """
+    Index of the file paths in the packages of a mirrored header directory.
+
+    It is built from the susetags snippets CreatePackageDescr.pm keeps in the
+    .cache directory of the headers, so write_repo_susetags_file.pl has to
+    have been run for the directory before. It is stored next to them, named
+    after the digest of the header file names like the solv files of
+    _add_headers(), so it is built only once per repository state.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        headers, digest = _headers(directory)
+        self.path = os.path.join(directory, '.cache', f'fileconflicts-{digest}.sqlite')
+        if not os.path.exists(self.path):
+            self._build(headers)
+        self.db = sqlite3.connect(self.path)
+
+    def _build(self, headers):
+        start = time.time()
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        db = sqlite3.connect(tmp)
+        db.execute('CREATE TABLE packages (id INTEGER PRIMARY KEY, name TEXT, snippet TEXT)')
+        db.execute('CREATE TABLE files (path TEXT, package INTEGER, directory INTEGER)')
+        for package, header in enumerate(headers):
+            snippet = os.path.join(self.directory, '.cache', '2-' + header)
+            with open(snippet) as fh:
+                files = set(_snippet_files(fh.read()))
+            db.execute('INSERT INTO packages VALUES (?, ?, ?)', (package, _header_name(header), snippet))
+            db.executemany('INSERT INTO files VALUES (?, ?, ?)',
+                           ((path, package, directory) for path, directory in files))
+        db.execute('CREATE INDEX files_path ON files (path)')
+        db.commit()
+        db.close()
+
+        for old in glob.glob(os.path.join(glob.escape(os.path.dirname(self.path)), 'fileconflicts-*.sqlite')):
+            os.unlink(old)
+        os.rename(tmp, self.path)
+        logger.debug('indexed the files of %d packages in %s in %.2fs', len(headers), self.directory, time.time() - start)
+
+    def packages(self):
+        """Return the ids, names and snippets of all packages, in the order of the headers."""
+        return self.db.execute('SELECT id, name, snippet FROM packages ORDER BY id').fetchall()
+
+    def owners(self, path, directory=None):
+        """Return the packages containing path, optionally only those with or without it as directory."""
+        if directory is None:
+            rows = self.db.execute('SELECT package FROM files WHERE path = ?', (path,))
+        else:
+            rows = self.db.execute('SELECT package FROM files WHERE path = ? AND directory = ?', (path, directory))
+        return set(row[0] for row in rows)
+
+    def below(self, path):
+        """Return the packages containing files below the path."""
+        # '0' follows '/', so the range covers all paths starting with path/
+        rows = self.db.execute('SELECT DISTINCT package FROM files WHERE path > ? AND path < ?',
+                               (path + '/', path + '0'))
+        return set(row[0] for row in rows)
+
+
+def _fileconflict_candidates(directories, candidates):
+    """
+    Write the packages of directories which may have a file conflict with
+    those of the first one to the susetags file candidates, and return it.
+
+    These are all packages of the first directory and those of the others
+    sharing a path with them, or having a file where they have a directory
+    or the other way round. Together with the filesystem package, which
+    decides about usr merged paths, findfileconflicts reports the same
+    conflicts for the first directory on them as on all packages. Only the
+    order of the conflicting files may differ, which _fileconflicts()
+    normalizes.
+
+    Returns None if not all directories are mirrored headers or their
+    snippets are missing.
+    """
+    if not all(os.path.isdir(directory) for directory in directories):
+        return None
+
+    # the packages of the first directory, as written by write_repo_susetags_file.pl
+    snippets = []
+    names = set()
+    headers, _ = _headers(directories[0])
+    for header in headers:
+        name = _header_name(header)
+        if name in names:
+            continue
+        names.add(name)
+        snippet = os.path.join(directories[0], '.cache', '2-' + header)
+        if not os.path.exists(snippet):
+            return None
+        snippets.append(snippet)
+
+    paths = set()
+    files = set()
+    parents = set()
+    for snippet in snippets:
+        with open(snippet) as fh:
+            for path, directory in _snippet_files(fh.read()):
+                for variant in _usrmerge_variants(path):
+                    paths.add(variant)
+                    if not directory:
+                        files.add(variant)
+                    while True:
+                        variant = os.path.dirname(variant)
+                        if variant in ('/', ''):
+                            break
+                        parents.add(variant)
+
+    # paths which are files somewhere and directories elsewhere
+    indexes = [FileConflictIndex(directory) for directory in directories[1:]]
+    files |= set(parent for parent in parents
+                 if parent in files or any(index.owners(parent, directory=False) for index in indexes))
+
+    for index in indexes:
+        selected = set()
+        for path in paths:
+            selected |= index.owners(path)
+        for path in files:
+            selected |= index.owners(path) | index.below(path)
+
+        for package, name, snippet in index.packages():
+            if name in names:
+                continue
+            names.add(name)
+            if package in selected or name == 'filesystem':
+                if not os.path.exists(snippet):
+                    return None
+                snippets.append(snippet)
+
+    with open(candidates, 'w') as out:
+        out.write('=Ver: 2.0\n')
+        for snippet in snippets:
+            with open(snippet) as fh:
+                out.write(fh.read())
+    logger.debug('searching file conflicts in %d packages', len(snippets))
+    return candidates
+
+
+def _followup_collapse_quadratic(outputs):
+    """Reference implementation of followup_collapse()."""
+    outputs = dict(outputs)
+    for package1 in outputs:
+        output = outputs[package1]
+        for package2 in outputs:
+            if package1 == package2:
+                continue
+            output = output.replace(outputs[package2], 'FOLLOWUP(' + package2 + ')')
+        outputs[package1] = output
+    return outputs
+
+
+FOLLOWUP_RE = re.compile(r'FOLLOWUP\([^()]*\)')
+
+
+class _FollowupIndex(object):
+    """
+    Index of problem outputs by a fragment which a text must contain for the
+    output to be a substring of it:
+
+    - outputs of three or more lines: the second line, which has to be a line
+      of the text as well
+    - outputs of two lines: the start of the last line, which has to start a
+      line of the text
+    - single lines: a substring of ANCHOR characters, chosen to be rare
+    - outputs containing a FOLLOWUP: their first FOLLOWUP
+
+    Outputs too short for any of these are candidates for every text.
+    """
+
+    ANCHOR = 24
+
+    def __init__(self):
+        self.lines = {}
+        self.prefixes = {}
+        self.substrings = {}
+        self.followups = {}
+        self.always = set()
+        # candidates of single line outputs per line of text
+        self.substring_cache = {}
+
+    @staticmethod
+    def _add(index, key, value):
+        index.setdefault(key, set()).add(value)
+
+    def add(self, key, output, substring_counts=None):
+        followup = FOLLOWUP_RE.search(output)
+        lines = output.split('\n')
+        if followup:
+            self._add(self.followups, followup.group(0), key)
+        elif len(lines) >= 3:
+            self._add(self.lines, lines[1], key)
+        elif len(lines) == 2 and len(lines[1]) >= self.ANCHOR:
+            self._add(self.prefixes, lines[1][:self.ANCHOR], key)
+        elif len(lines) == 1 and len(output) >= self.ANCHOR:
+            substrings = [output[i:i + self.ANCHOR] for i in range(len(output) - self.ANCHOR + 1)]
+            if substring_counts:
+                substrings.sort(key=lambda substring: substring_counts.get(substring, 0))
+            self._add(self.substrings, substrings[0], key)
+        else:
+            self.always.add(key)
+
+    def _line_substrings(self, line):
+        candidates = self.substring_cache.get(line)
+        if candidates is None:
+            candidates = set()
+            for i in range(len(line) - self.ANCHOR + 1):
+                candidates.update(self.substrings.get(line[i:i + self.ANCHOR], ()))
+            self.substring_cache[line] = candidates
+        return candidates
+
+    def candidates(self, text):
+        candidates = set(self.always)
+        for line in set(text.split('\n')):
+            candidates.update(self.lines.get(line, ()))
+            candidates.update(self.prefixes.get(line[:self.ANCHOR], ()))
+            candidates.update(self._line_substrings(line))
+        for followup in set(FOLLOWUP_RE.findall(text)):
+            candidates.update(self.followups.get(followup, ()))
+        return candidates
+
+
+def followup_collapse(outputs):
+    """
+    Replace the problem output of other packages contained in the output of
+    each package by FOLLOWUP(package).
+
+    Takes and returns a dict of package to output. Outputs are processed in
+    order, each replacing the outputs of the other packages in order, where
+    those already processed are replaced in their collapsed form. Instead of
+    trying every pair, only outputs found in an index of required fragments
+    are tried, which yields the same result as doing so.
+    """
+    packages = list(outputs)
+    original = [outputs[package] for package in packages]
+    collapsed = list(original)
+
+    substring_counts = {}
+    anchor = _FollowupIndex.ANCHOR
+    for output in original:
+        if '\n' not in output:
+            for substring in set(output[i:i + anchor] for i in range(len(output) - anchor + 1)):
+                substring_counts[substring] = substring_counts.get(substring, 0) + 1
+
+    # outputs as they were given and those changed by collapsing
+    index = _FollowupIndex()
+    for i, output in enumerate(original):
+        index.add(i, output, substring_counts)
+    changed_index = _FollowupIndex()
+
+    for i in range(len(packages)):
+        text = original[i]
+        position = -1
+        while True:
+            candidates = [j for j in index.candidates(text)
+                          if j > position and j != i and (j > i or collapsed[j] == original[j])]
+            candidates += [j for j in changed_index.candidates(text) if j > position]
+            for j in sorted(candidates):
+                pattern = collapsed[j] if j < i else original[j]
+                if pattern in text:
+                    text = text.replace(pattern, 'FOLLOWUP(' + packages[j] + ')')
+                    position = j
+                    break
+            else:
+                break
+
+        collapsed[i] = text
+        if text != original[i]:
+            changed_index.add(i, text)
+
+    return dict(zip(packages, collapsed))
+
+
 def filter_release(line):
     line = re.sub(r'(package [^ ]*\-[^-]*)\-[^-]*(\.\w+) ', r'\1\2 ', line)
     line = re.sub(r'(needed by [^ ]*\-[^-]*)\-[^-]*(\.\w+)$', r'\1\2', line)
@@ -130,23 +442,30 @@ def filter_release(line):
     return line
 
 
+def maparch2installarch(arch):
+    _mapping = {'armv6l': 'armv6hl',
+                'armv7l': 'armv7hl'}
+    if arch in _mapping:
+        return _mapping[arch]
+    return arch
+
+
 def parsed_installcheck(repos, arch, target_packages, whitelist):
+    if INSTALLCHECK_ENGINE == 'solv':
+        return solv_installcheck(repos, arch, target_packages, whitelist)
+    return external_installcheck(repos, arch, target_packages, whitelist)
+
+
+def external_installcheck(repos, arch, target_packages, whitelist):
     reported_problems = dict()
 
     if not len(target_packages):
         return reported_problems
 
-    def maparch2installarch(arch):
-        _mapping = {'armv6l': 'armv6hl',
-                    'armv7l': 'armv7hl'}
-        if arch in _mapping:
-            return _mapping[arch]
-        return arch
-
     if not isinstance(repos, list):
         repos = [repos]
 
-    p = subprocess.run(['/usr/bin/installcheck', maparch2installarch(arch)] + repos,
+    p = subprocess.run([INSTALLCHECK, maparch2installarch(arch)] + repos,
                        stdout=subprocess.PIPE, errors='backslashreplace',
                        universal_newlines=True)
     if p.returncode:
@@ -175,6 +494,211 @@ def parsed_installcheck(repos, arch, target_packages, whitelist):
     return reported_problems
 
 
+def _header_name(filename):
+    """Package name of a mirrored header, as used by write_repo_susetags_file.pl."""
+    match = re.match(r'^[a-z0-9]{32}-(.*)\.rpm$', filename)
+    if match:
+        return match.group(1)
+    return re.sub(r'^(.*)-[^-]+-[^-]+.rpm$', r'\1', filename)
+
+
+def _headers(directory):
+    """
+    Return the sorted header file names of a mirrored directory and a digest
+    of them. The names start with the hdrmd5, so the digest changes with every
+    changed header.
+    """
+    headers = sorted(f for f in os.listdir(directory) if f.endswith('.rpm'))
+    return headers, hashlib.sha1('\n'.join(headers).encode('utf-8')).hexdigest()
+
+
+def _add_headers(pool, directory):
+    """
+    Add the RPM headers mirrored to directory as a repository to pool.
+
+    The headers are converted once and kept as solv file in the .cache
+    directory, named after the digest of the header file names.
+    """
+    headers, digest = _headers(directory)
+    cachedir = os.path.join(directory, '.cache')
+    solv_file = os.path.join(cachedir, f'repo-{digest}.solv')
+
+    repo = pool.add_repo(directory)
+    if os.path.exists(solv_file) and repo.add_solv(solv_file):
+        return repo
+
+    for header in headers:
+        if not repo.add_rpm(os.path.join(directory, header), solv.Repo.REPO_REUSE_REPODATA | solv.Repo.REPO_NO_INTERNALIZE):
+            raise CorruptRepos(f'failed to add {header}: {pool.errstr}')
+    repo.internalize()
+
+    os.makedirs(cachedir, exist_ok=True)
+    for old in glob.glob(os.path.join(glob.escape(cachedir), 'repo-*.solv')):
+        os.unlink(old)
+    tmp = f'{solv_file}.{os.getpid()}.tmp'
+    fh = solv.xfopen(tmp, 'w')
+    repo.write(fh)
+    fh.close()
+    os.rename(tmp, solv_file)
+    return repo
+
+
+def _add_repository(pool, path):
+    """Add a repository in any of the formats installcheck accepts as argument."""
+    if os.path.isdir(path):
+        return _add_headers(pool, path)
+
+    repo = pool.add_repo(path)
+    if path.endswith(('packages', 'packages.gz')):
+        added = repo.add_susetags(solv.xfopen(path), pool.lookup_id(solv.SOLVID_META, solv.SUSETAGS_DEFAULTVENDOR), 'en')
+    elif path.endswith(('primary.xml', 'primary.xml.gz', 'primary.xml.zst')):
+        added = repo.add_rpmmd(solv.xfopen(path), None, 0)
+    else:
+        added = repo.add_solv(path)
+    if not added:
+        raise CorruptRepos(f'failed to add {path}: {pool.errstr}')
+    return repo
+
+
+def _pool_arch(arch):
+    # write_repo_susetags_file.pl turns i686 packages into i586 ones
+    if arch == 'i586':
+        return 'i686'
+    return maparch2installarch(arch)
+
+
+def installcheck_pool(repos, arch):
+    """
+    Return a pool of repos, set up like installcheck does for its arguments.
+
+    repos are directories of mirrored RPM headers, susetags or rpmmd files,
+    or solv files. A package of a header directory shadows the packages of
+    the same name in the header directories following it, as if they were
+    all written to one susetags file by write_repo_susetags_file.pl.
+    """
+    pool = solv.Pool()
+    pool.setarch(_pool_arch(arch))
+
+    considered = []
+    names = set()
+    for path in repos:
+        repo = _add_repository(pool, path)
+        added = set()
+        for solvable in repo.solvables_iter():
+            if os.path.isdir(path):
+                if solvable.name in names:
+                    continue
+                added.add(solvable.name)
+            considered.append(solvable.id)
+        names.update(added)
+
+    # packages not considered are left out of the providers as well
+    pool.set_considered_list(considered)
+    pool.addfileprovides()
+    pool.createwhatprovides()
+    return pool
+
+
+def _problem_lines(pool, problem):
+    """The lines installcheck prints for problem."""
+    lines = []
+    for rule in problem.findallproblemrules():
+        for info in rule.allinfos():
+            source, target, dep = info.solvable, info.othersolvable, info.dep
+            if info.type == solv.Solver.SOLVER_RULE_INFARCH:
+                lines.append(f'{source} has inferior architecture')
+            elif info.type == solv.Solver.SOLVER_RULE_PKG:
+                lines.append('some dependency problem')
+            elif info.type == solv.Solver.SOLVER_RULE_PKG_NOT_INSTALLABLE:
+                lines.append(f'package {source} is not installable')
+            elif info.type == solv.Solver.SOLVER_RULE_PKG_NOTHING_PROVIDES_DEP:
+                lines.append(f'nothing provides {dep} needed by {source}')
+                # versioned dependencies list the versions there are
+                match = re.match(r'^([^ ()]+) [<=>]+ ', str(dep))
+                if match:
+                    name = pool.str2id(match.group(1), False)
+                    if name:
+                        lines += [f'  (we have {provider})' for provider in pool.whatprovides(name)]
+            elif info.type == solv.Solver.SOLVER_RULE_PKG_SAME_NAME:
+                lines.append(f'cannot install both {source} and {target}')
+            elif info.type == solv.Solver.SOLVER_RULE_PKG_CONFLICTS:
+                lines.append(f'package {source} conflicts with {dep} provided by {target}')
+            elif info.type == solv.Solver.SOLVER_RULE_PKG_OBSOLETES:
+                lines.append(f'package {source} obsoletes {dep} provided by {target}')
+            elif info.type == solv.Solver.SOLVER_RULE_PKG_IMPLICIT_OBSOLETES:
+                lines.append(f'package {source} implicitly obsoletes {dep} provided by {target}')
+            elif info.type == solv.Solver.SOLVER_RULE_PKG_REQUIRES:
+                lines.append(f'package {source} requires {dep}, but none of the providers can be installed')
+            elif info.type == solv.Solver.SOLVER_RULE_PKG_SELF_CONFLICT:
+                lines.append(f'package {source} conflicts with {dep} provided by itself')
+    return lines
+
+
+def solv_installcheck(repos, arch, target_packages, whitelist):
+    """
+    In-process variant of external_installcheck() returning the same problems.
+
+    Instead of checking every package of the repositories and dropping the
+    ones not in target_packages, only the target packages are checked: first
+    all of them at once as weak jobs, then only those the solver could not
+    install one by one to describe their problems.
+    """
+    reported_problems = dict()
+
+    if not len(target_packages):
+        return reported_problems
+
+    if not isinstance(repos, list):
+        repos = [repos]
+
+    start = time.time()
+    pool = installcheck_pool(repos, arch)
+    solver = pool.Solver()
+
+    # same candidates as installcheck, in the same order
+    pool_arch = _pool_arch(arch)
+    candidates = []
+    for sid in pool.get_considered_list():
+        solvable = pool.solvables[sid]
+        if solvable.name not in target_packages or not solvable.installable():
+            continue
+        if solvable.arch not in (pool_arch, 'noarch'):
+            # skipped in favor of a package of the same name and the pool arch
+            if any(other.name == solvable.name and other.arch == pool_arch
+                   for other in pool.whatprovides(solvable.nameid)):
+                continue
+        candidates.append(solvable)
+
+    remaining = candidates
+    while remaining:
+        jobs = [pool.Job(solv.Job.SOLVER_INSTALL | solv.Job.SOLVER_SOLVABLE | solv.Job.SOLVER_WEAK, s.id)
+                for s in remaining]
+        solver.solve(jobs)
+        installed = set(solver.raw_decisions(1))
+        uninstallable = [s for s in remaining if s.id not in installed]
+        if len(uninstallable) == len(remaining):
+            break
+        remaining = uninstallable
+
+    for solvable in remaining:
+        problems = solver.solve([pool.Job(solv.Job.SOLVER_INSTALL | solv.Job.SOLVER_SOLVABLE, solvable.id)])
+        if not problems:
+            continue
+        package = solvable.name
+        if package in whitelist:
+            logger.debug(f"{package} fails installcheck but is white listed")
+            continue
+        output = []
+        for problem in problems:
+            output += [filter_release(line) for line in _problem_lines(pool, problem)]
+        reported_problems[package] = {'problem': str(solvable), 'output': output,
+                                      'source': target_packages[package]}
+
+    logger.debug('checked %d packages, %d of them one by one, in %.2fs',
+                 len(candidates), len(remaining), time.time() - start)
+    return reported_problems
+
+
 def installcheck(directories, arch, whitelist, ignore_conflicts):
 
     with tempfile.TemporaryDirectory(prefix='repochecker') as dir:
@@ -195,11 +719,17 @@ def installcheck(directories, arch, whitelist, ignore_conflicts):
             target_packages = catalog.get(directories[0], [])
 
         parts = []
-        output = _fileconflicts(pfile, arch, target_packages, ignore_conflicts)
+        candidates = _fileconflict_candidates(directories, os.path.join(dir, 'candidates'))
+        output = _fileconflicts(pfile, arch, target_packages, ignore_conflicts, candidates)
         if output:
             parts.append(output)
 
-        parsed = parsed_installcheck(pfile, arch, target_packages, whitelist)
+        if INSTALLCHECK_ENGINE == 'solv':
+            # the susetags file only contains the header directories
+            repos = [directory for directory in directories if os.path.isdir(directory)]
+        else:
+            repos = pfile
+        parsed = parsed_installcheck(repos, arch, target_packages, whitelist)
         if len(parsed):
             output = ''
             for package in sorted(parsed):
@@ -254,7 +784,60 @@ def mirror(apiurl, project, repository, arch):
             raise Exception(f'repotype {repotype} not supported')
         return mirrorRepomd(directory, download[0].get('url'))
 
-    rm = RepoMirror(apiurl)
+    rm = RepoMirror(apiurl, store=os.path.join(CACHEDIR, HEADER_STORE))
     rm.mirror(directory, project, repository, arch)
 
     return directory
+
+
+def compare_engines(repos, arch):
+    """
+    Check all packages of the first of repos with both installcheck engines.
+
+    Header directories are written to a susetags file for the external tool
+    like installcheck() does. Prints the time taken by each engine and the
+    problems they do not agree on, returns whether they agree.
+    """
+    pool = installcheck_pool(repos[:1], arch)
+    target_packages = {s.name: s.lookup_str(solv.SOLVABLE_SOURCENAME) or s.name for s in pool.solvables_iter()}
+
+    with tempfile.TemporaryDirectory(prefix='repochecker') as dir:
+        directories = [repo for repo in repos if os.path.isdir(repo)]
+        external_repos = [repo for repo in repos if not os.path.isdir(repo)]
+        if directories:
+            script = os.path.join(SCRIPT_PATH, '..', 'write_repo_susetags_file.pl')
+            if subprocess.run(['perl', script, dir] + directories).returncode:
+                raise CorruptRepos
+            external_repos.insert(0, os.path.join(dir, 'packages'))
+
+        results = {}
+        for engine, function, engine_repos in (('external', external_installcheck, external_repos),
+                                               ('solv', solv_installcheck, repos)):
+            start = time.time()
+            results[engine] = function(engine_repos, arch, target_packages, [])
+            print(f'{engine}: {len(results[engine])} problems in {time.time() - start:.2f}s')
+
+    for package in sorted(set(results['external']) | set(results['solv'])):
+        external = results['external'].get(package)
+        internal = results['solv'].get(package)
+        if external != internal:
+            print(f'{package} differs:\n  external: {external}\n  solv: {internal}')
+    return results['external'] == results['solv']
+
+
+if __name__ == '__main__':
+    import sys
+    from optparse import OptionParser
+
+    parser = OptionParser(usage='%prog [options] ARCH REPO...')
+    parser.add_option('--installcheck', default=INSTALLCHECK,
+                      help='installcheck binary to compare with')
+    parser.add_option('--debug', action='store_true', help='show debug output')
+
+    (options, args) = parser.parse_args()
+    if len(args) < 2:
+        parser.error('ARCH and at least one REPO are required')
+
+    logging.basicConfig(level=logging.DEBUG if options.debug else logging.INFO)
+    INSTALLCHECK = options.installcheck
+    sys.exit(0 if compare_engines(args[1:], args[0]) else 1)
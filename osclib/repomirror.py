@@ -1,72 +1,165 @@
+import errno
 import fcntl
-import itertools
 import logging
+import math
 import os
 import osc.conf
 import re
-import struct
+import shutil
 import sys
 import tempfile
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextlib import nullcontext
 from lxml import etree as ET
+from typing import Optional
 from osc.core import makeurl, http_GET
-from osc.util.cpio import CpioHdr
+from osclib.cpio import CpioReader
 from urllib.parse import quote_plus
 
 logger = logging.getLogger('RepoMirror')
 
+# Name of the content-addressed header store within a mirror cache directory
+HEADER_STORE = '.headers'
+
 
 class RepoMirror:
-    cpio_struct = struct.Struct('6s8s8s8s8s8s8s8s8s8s8s8s8s8s')
     cpio_name_re = re.compile('^([^/]+)-([0-9a-f]{32})$')
 
-    def __init__(self, apiurl: str, nameignore: str = '-debug(info|source|info-32bit).rpm$'):
+    def __init__(self, apiurl: str, nameignore: str = '-debug(info|source|info-32bit).rpm$',
+                 batch_size: int = 50, workers: int = 4, retries: int = 3, store: Optional[str] = None):
         """
         Class to mirror RPM headers of all binaries in a repo on OBS (full tree).
         Debug packages are ignored by default, see the nameignore parameter.
+        Headers are downloaded in batches of batch_size binaries by up to workers
+        concurrent requests, a failed batch is tried again up to retries times.
+
+        If store is given, headers are kept in that content-addressed directory
+        and the mirrored directories only contain hardlinks into it. A header
+        already fetched for one repository is linked instead of downloaded for
+        every other one. The link count of a stored header is its reference
+        count, headers no longer linked anywhere are removed. Mirrored
+        directories on another filesystem than the store get copies of stored
+        headers and do not add to the store.
         """
         self.apiurl = apiurl
         self.nameignorere = re.compile(nameignore)
+        self.batch_size = batch_size
+        self.workers = workers
+        self.retries = retries
+        self.store = store
+
+    def _store_path(self, filename: str) -> str:
+        # filename starts with the hdrmd5, spread over subdirectories
+        return os.path.join(self.store, filename[:2], filename)
+
+    @contextmanager
+    def _store_lock(self, operation: int):
+        """
+        Hold the lock of the store, shared (fcntl.LOCK_SH) to link headers or
+        exclusive (fcntl.LOCK_EX) to release them, so no header is linked
+        between checking its link count and removing it.
+        """
+        os.makedirs(self.store, exist_ok=True)
+        with open(os.path.join(self.store, '.lock'), 'w') as lockfile:
+            fcntl.flock(lockfile, operation)
+            yield
+
+    def _store_add(self, path: str) -> None:
+        storepath = self._store_path(os.path.basename(path))
+        os.makedirs(os.path.dirname(storepath), exist_ok=True)
+        with self._store_lock(fcntl.LOCK_SH):
+            try:
+                os.link(path, storepath)
+            except FileExistsError:
+                pass
+            except OSError as e:
+                # a copy in the store would not count the references
+                if e.errno != errno.EXDEV:
+                    raise
+
+    def _store_release(self, filename: str) -> int:
+        """
+        Remove the stored header if nothing links to it anymore, returns the
+        bytes freed. The caller holds the exclusive store lock.
+        """
+        storepath = self._store_path(filename)
+        try:
+            stat = os.stat(storepath)
+        except FileNotFoundError:
+            return 0
+        if stat.st_nlink > 1:
+            return 0
+        os.unlink(storepath)
+        return stat.st_size
+
+    def _link_from_store(self, destdir: str, remotebins: dict[str, str]) -> tuple[int, int]:
+        """Link stored headers into destdir and drop them from remotebins."""
+        linked = 0
+        linked_bytes = 0
+        with self._store_lock(fcntl.LOCK_SH):
+            for filename in list(remotebins):
+                storepath = self._store_path(filename)
+                try:
+                    os.link(storepath, os.path.join(destdir, filename))
+                except FileNotFoundError:
+                    continue
+                except FileExistsError:
+                    pass
+                except OSError as e:
+                    # destdir is on another filesystem than the store
+                    if e.errno != errno.EXDEV:
+                        raise
+                    shutil.copyfile(storepath, os.path.join(destdir, filename))
+                linked += 1
+                linked_bytes += os.stat(storepath).st_size
+                del remotebins[filename]
+        return linked, linked_bytes
+
+    def collect_garbage(self) -> tuple[int, int]:
+        """Remove all stored headers not linked into any mirrored directory."""
+        files = 0
+        freed = 0
+        with self._store_lock(fcntl.LOCK_EX):
+            for directory, subdirectories, filenames in os.walk(self.store):
+                for filename in filenames:
+                    size = self._store_release(filename)
+                    if size:
+                        files += 1
+                        freed += size
+        logger.info(f'Removed {files} unreferenced headers ({freed} bytes) from {self.store}')
+        return files, freed
 
     def extract_cpio_stream(self, destdir: str, stream):
-        while True:
-            hdrtuples = self.cpio_struct.unpack(stream.read(self.cpio_struct.size))
-            # Read and parse the CPIO header
-            if hdrtuples[0] != b'070701':
-                raise NotImplementedError(f'CPIO format {hdrtuples[0]} not implemented')
-
-            # The new-ascii format has padding for 4 byte alignment
-            def align():
-                stream.read((4 - (stream.tell() % 4)) % 4)
-
-            hdr = CpioHdr(*hdrtuples)
-            hdr.filename = stream.read(hdr.namesize - 1).decode('ascii')
-            stream.read(1)  # Skip terminator
-            align()
-
-            binarymatch = self.cpio_name_re.match(hdr.filename)
-            if hdr.filename == '.errors':
-                content = stream.read(hdr.filesize)
+        for filename, size, reader in CpioReader(stream):
+            binarymatch = self.cpio_name_re.match(filename)
+            if filename == '.errors':
+                content = reader.read()
                 raise RuntimeError('Download has errors: ' + content.decode('ascii'))
             elif binarymatch:
                 name = binarymatch.group(1)
                 md5 = binarymatch.group(2)
                 destpath = os.path.join(destdir, f'{md5}-{name}.rpm')
                 with tempfile.NamedTemporaryFile(mode='wb', dir=destdir) as tmpfile:
-                    # Probably not big enough to need chunking
-                    tmpfile.write(stream.read(hdr.filesize))
-                    os.link(tmpfile.name, destpath)
+                    shutil.copyfileobj(reader, tmpfile)
+                    tmpfile.flush()
+                    try:
+                        os.link(tmpfile.name, destpath)
+                    except FileExistsError:
+                        # Written by an earlier attempt of a retried batch, the
+                        # content is the same as the name contains the hdrmd5.
+                        pass
+                    if self.store:
+                        self._store_add(destpath)
                     # Would be nice to use O_TMPFILE + link here, but python passes
                     # O_EXCL which breaks that.
                     # os.link(f'/proc/self/fd/{tmpfile.fileno()}', destpath)
-
-                align()
-            elif hdr.filename == 'TRAILER!!!':
-                if stream.read(1):
-                    raise RuntimeError('Expected end of CPIO')
-                break
             else:
-                raise NotImplementedError(f'Unhandled file {hdr.filename} in archive')
+                raise NotImplementedError(f'Unhandled file {filename} in archive')
+
+        if stream.read(1):
+            raise RuntimeError('Expected end of CPIO')
 
     def _mirror(self, destdir: str, prj: str, repo: str, arch: str) -> None:
         "Using the _repositories endpoint, download all RPM headers into destdir."
@@ -88,27 +181,61 @@ class RepoMirror:
 
             if filename in remotebins:
                 del remotebins[filename]  # Already downloaded
+                path = os.path.join(destdir, filename)
+                if self.store and os.stat(path).st_nlink == 1:
+                    # Mirrored before the store was used
+                    self._store_add(path)
             else:
                 to_delete.append(os.path.join(destdir, filename))
 
         if to_delete:
             logger.info(f'Deleting {len(to_delete)} old packages')
-            for path in to_delete:
-                os.unlink(path)
+            freed = 0
+            with self._store_lock(fcntl.LOCK_EX) if self.store else nullcontext():
+                for path in to_delete:
+                    os.unlink(path)
+                    if self.store:
+                        freed += self._store_release(os.path.basename(path))
+            if freed:
+                logger.info(f'Released {freed} bytes from the header store')
+
+        if remotebins and self.store:
+            missing = len(remotebins)
+            linked, linked_bytes = self._link_from_store(destdir, remotebins)
+            if linked:
+                requests_saved = math.ceil(missing / self.batch_size) - math.ceil(len(remotebins) / self.batch_size)
+                logger.info(f'Linked {linked} packages ({linked_bytes} bytes) from the header store, '
+                            f'saving {requests_saved} requests')
 
         if remotebins:
             logger.info(f'Downloading {len(remotebins)} new packages')
-            binaries = remotebins.values()
+            binaries = list(remotebins.values())
+            batches = [binaries[chunk:chunk + self.batch_size]
+                       for chunk in range(0, len(binaries), self.batch_size)]
 
-            # Download in batches of 50
-            for chunk in range(0, len(binaries), 50):
-                query = 'view=cpioheaders'
-                for binary in itertools.islice(binaries, chunk, chunk + 50):
-                    query += '&binary=' + quote_plus(binary)
+            # Each worker extracts its own stream, so extraction of one batch
+            # overlaps with the download of the others.
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                # Consume the results to raise the first failure
+                list(executor.map(lambda batch: self._download_batch(destdir, prj, repo, arch, batch), batches))
 
+    def _download_batch(self, destdir: str, prj: str, repo: str, arch: str, binaries: list[str]) -> None:
+        query = 'view=cpioheaders'
+        for binary in binaries:
+            query += '&binary=' + quote_plus(binary)
+
+        for attempt in range(1, self.retries + 1):
+            try:
                 req = http_GET(makeurl(self.apiurl, ['build', prj, repo, arch, '_repository'],
                                        query=query))
                 self.extract_cpio_stream(destdir, req)
+                return
+            except NotImplementedError:
+                raise
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning(f'Downloading {len(binaries)} packages failed ({e}), retrying')
 
     def mirror(self, destdir: str, prj: str, repo: str, arch: str) -> None:
         "Creates destdir and locks destdir/.lock before mirroring."
@@ -126,8 +253,12 @@ class RepoMirror:
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 6:
+    if len(sys.argv) == 3 and sys.argv[1] == '--gc':
+        logging.basicConfig(level=logging.INFO)
+        RepoMirror(None, store=sys.argv[2]).collect_garbage()
+    elif len(sys.argv) != 6:
         print("Usage: repomirror.py apiurl destdir prj repo arch")
+        print("       repomirror.py --gc storedir")
     else:
         osc.conf.get_config()
         rm = RepoMirror(sys.argv[1])
@@ -0,0 +1,359 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from io import BytesIO
+from urllib.error import HTTPError
+
+from lxml import etree as ET
+from osc.connection import http_GET
+from osc.core import get_commitlog
+from osc.core import makeurl
+from osclib.cache_manager import CacheManager
+from osclib.core import entity_source_link
+from osclib.core import package_source_hash
+from osclib.core import package_source_link_copy
+from osclib.memoize import memoize
+
+
+class SourceHashIndex(object):
+    """
+    Persistent index of the source hashes of the package revisions of a project.
+
+    package_source_hash_history() costs a commit log request plus a link and a
+    source request per revision, which adds up when every origin is searched for
+    every package of a project. The index keeps the source hash of every
+    revision it has seen by srcmd5 and the state of the package it was built
+    from. The project source listing is requested once per index and unchanged
+    packages are then answered without any request. For changed packages only
+    the commit log is requested and only revisions not seen before are hashed.
+    """
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS package (name TEXT PRIMARY KEY, state TEXT, expand INTEGER)',
+        'CREATE TABLE IF NOT EXISTS revision (package TEXT, position INTEGER, srcmd5 TEXT, source_hash TEXT, '
+        'PRIMARY KEY (package, position))',
+        'CREATE INDEX IF NOT EXISTS revision_source_hash ON revision (source_hash)',
+    ]
+
+    def __init__(self, apiurl, project, path):
+        self.apiurl = apiurl
+        self.project = project
+        self.path = path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self._states = None
+        self._link = False
+        # package -> [srcmd5, source_hash] list of the revisions, newest first
+        self.histories = {}
+
+    @property
+    def db(self):
+        db = getattr(self.local, 'db', None)
+        if db is None or self.local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            for statement in self.SCHEMA:
+                db.execute(statement)
+            self.local.db = db
+            self.local.pid = os.getpid()
+        return db
+
+    @property
+    def states(self):
+        """State of every package in the project or None if not available."""
+        with self.lock:
+            if self._states is None:
+                self._states = self.states_load()
+        return None if self._states is False else self._states
+
+    def states_load(self):
+        query = {'view': 'info', 'nofilename': '1'}
+        url = makeurl(self.apiurl, ['source', self.project], query)
+        try:
+            root = ET.parse(http_GET(url)).getroot()
+        except HTTPError as e:
+            if e.code == 404:
+                return {}
+            # Remote projects may not provide the listing in which case every
+            # package is validated against its commit log once per index.
+            logging.debug(f'source_index: no source listing for {self.project}: {e}')
+            return False
+
+        states = {}
+        for sourceinfo in root.findall('sourceinfo'):
+            # The srcmd5 of links covers the expanded sources so a change of the
+            # link target changes the state as well.
+            states[sourceinfo.get('package')] = '{}/{}'.format(
+                sourceinfo.get('lsrcmd5', ''), sourceinfo.get('srcmd5'))
+        return states
+
+    @property
+    def link(self):
+        """Project linked by the project or None."""
+        with self.lock:
+            if self._link is False:
+                link = entity_source_link(self.apiurl, self.project)
+                self._link = link.get('project') if link is not None else None
+        return self._link
+
+    def load(self, package):
+        row = self.db.execute('SELECT state FROM package WHERE name = ?', (package,)).fetchone()
+        if row is None:
+            return None, []
+        revisions = self.db.execute('SELECT srcmd5, source_hash FROM revision WHERE package = ? ORDER BY position',
+                                    (package,)).fetchall()
+        return row[0], [list(revision) for revision in revisions]
+
+    def refresh(self, package):
+        """
+        Return the revisions of package, updating the index if it changed, or
+        None if the package does not exist.
+
+        Packages missing from the listing of a project that links another
+        project are looked up like without a listing since the package may be
+        provided through the link.
+        """
+        state_stored, revisions = self.load(package)
+
+        states = self.states
+        state = None
+        if states is not None:
+            state = states.get(package)
+            if state is None and self.link is None:
+                return None
+            if state is not None and state == state_stored:
+                return revisions
+
+        try:
+            # get_commitlog() reverses the order so newest revisions are first.
+            root = ET.fromstringlist(get_commitlog(self.apiurl, self.project, package, None, format='xml'))
+        except HTTPError as e:
+            if e.code == 404:
+                return None
+            raise e
+        source_md5s = root.xpath('logentry/@srcmd5')
+        if state is None:
+            state = source_md5s[0] if source_md5s else ''
+            if state == state_stored:
+                return revisions
+
+        # Will not catch packages that previous had a link, but no longer do.
+        expand = package_source_link_copy(self.apiurl, self.project, package)
+        known = {}
+        if not expand:
+            # The sources of a revision never change unless they are expanded
+            # against a link target.
+            known = {srcmd5: source_hash for srcmd5, source_hash in revisions}
+        revisions = [[source_md5, known.get(source_md5)] for source_md5 in source_md5s]
+
+        with self.db:
+            self.db.execute('BEGIN')
+            self.db.execute('INSERT OR REPLACE INTO package VALUES (?, ?, ?)', (package, state, int(expand)))
+            self.db.execute('DELETE FROM revision WHERE package = ?', (package,))
+            self.db.executemany('INSERT INTO revision VALUES (?, ?, ?, ?)',
+                                [(package, position, srcmd5, source_hash)
+                                 for position, (srcmd5, source_hash) in enumerate(revisions)])
+
+        return revisions
+
+    def revisions(self, package):
+        """Return the [srcmd5, source_hash] revisions of package, newest first, or None."""
+        # Concurrent callers for the same package may both refresh it, which
+        # only costs the requests twice.
+        if package not in self.histories:
+            self.histories[package] = self.refresh(package)
+        return self.histories[package]
+
+    def source_hash(self, package, position):
+        """Return the source hash of a revision, hashing it if not yet indexed."""
+        revision = self.histories[package][position]
+        if revision[1] is None:
+            expand = self.db.execute('SELECT expand FROM package WHERE name = ?', (package,)).fetchone()[0]
+            source_hash = package_source_hash(self.apiurl, self.project, package, revision[0], bool(expand))
+            # Revisions which no longer exist are stored as an empty hash.
+            revision[1] = source_hash or ''
+            self.db.execute('UPDATE revision SET source_hash = ? WHERE package = ? AND position = ?',
+                            (revision[1], package, position))
+        return revision[1] or None
+
+    def source_hashes(self, package, limit):
+        """
+        Yield the source hashes of the newest limit revisions.
+
+        Revisions are hashed as they are consumed so callers that stop early do
+        not pay for the remaining revisions.
+        """
+        for position in range(len(self.histories[package][:limit])):
+            yield self.source_hash(package, position)
+
+    def find(self, source_hash):
+        """Return (package, srcmd5) of the indexed revisions with source_hash."""
+        return self.db.execute('SELECT package, srcmd5 FROM revision WHERE source_hash = ? ORDER BY package, position',
+                               (source_hash,)).fetchall()
+
+
+@memoize(session=True)
+def project_source_index(apiurl, project, directory=None):
+    host = hashlib.sha1(apiurl.encode('utf-8')).hexdigest()[:8]
+    if directory is None:
+        directory = CacheManager.directory('source-index')
+    path = os.path.join(directory, host, f'{project}.sqlite')
+    return SourceHashIndex(apiurl, project, path)
+
+
+def project_source_hash_history(apiurl, project, package, limit=5, include_project_link=False, directory=None):
+    """
+    Same as package_source_hash_history(), but answered from the source index
+    of each project.
+    """
+    index = project_source_index(apiurl, project, directory)
+    revisions = index.revisions(package)
+    if revisions is None:
+        return
+
+    source_hashes = []
+    for source_hash in index.source_hashes(package, limit):
+        yield source_hash
+        source_hashes.append(source_hash)
+
+    if include_project_link and (not limit or len(revisions) < limit):
+        project = index.link
+        if project is None:
+            return
+
+        if limit:
+            limit_remaining = limit - len(revisions)
+
+        # Allow small margin for duplicates, the linked history is only hashed
+        # as far as it is consumed.
+        for source_hash in project_source_hash_history(apiurl, project, package, None, True, directory):
+            if source_hash in source_hashes:
+                continue
+
+            yield source_hash
+
+            if limit:
+                limit_remaining += -1
+                if limit_remaining == 0:
+                    break
+
+
+def project_source_contain(apiurl, project, package, source_hash, directory=None):
+    """
+    Return True if any revision of package in project or the projects it links
+    has source_hash.
+
+    Revisions already hashed are looked up through the index and only the
+    remaining revisions are hashed until a match is found.
+    """
+    index = project_source_index(apiurl, project, directory)
+    revisions = index.revisions(package)
+    if revisions is None:
+        return False
+
+    if any(found == package for found, srcmd5 in index.find(source_hash)):
+        return True
+
+    for position, revision in enumerate(revisions):
+        if revision[1] is None and index.source_hash(package, position) == source_hash:
+            return True
+
+    if index.link is None:
+        return False
+    return project_source_contain(apiurl, index.link, package, source_hash, directory)
+
+
+class RecordedOBS(object):
+    """
+    Serve GET requests from responses recorded in a directory and count them.
+
+    When recording, requests without a response are passed on to the API and
+    their response is stored, otherwise they fail.
+    """
+
+    def __init__(self, directory, record=False):
+        self.directory = directory
+        self.record = record
+        self.requests = 0
+
+    def path(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    def http_request(self, method, url, headers=None, data=None, file=None):
+        assert method == 'GET', f'{method} {url} can not be recorded'
+        self.requests += 1
+        path = self.path(url)
+        if self.record and not os.path.exists(path):
+            try:
+                data = self._http_request(method, url, headers, data, file).read()
+                code = 200
+            except HTTPError as e:
+                data, code = b'', e.code
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(b'%d\n' % code + data)
+
+        try:
+            with open(path, 'rb') as f:
+                code, data = f.read().split(b'\n', 1)
+        except FileNotFoundError:
+            raise LookupError(f'{url} not recorded in {self.directory}')
+
+        if int(code) != 200:
+            raise HTTPError(url, int(code), 'recorded', {}, None)
+        return BytesIO(data)
+
+    @contextmanager
+    def patch(self):
+        import osc.connection
+        self._http_request = osc.connection.http_request
+        osc.connection.http_request = self.http_request
+        try:
+            yield self
+        finally:
+            osc.connection.http_request = self._http_request
+
+
+def benchmark(apiurl, fixture, record, project, packages):
+    from osclib.core import package_source_hash_history
+    from osclib.memoize import memoize_session_reset
+
+    obs = RecordedOBS(fixture, record)
+    with obs.patch(), tempfile.TemporaryDirectory() as directory:
+        runs = [('history', lambda package: package_source_hash_history(apiurl, project, package, 5, True))]
+        for name in ('index (cold)', 'index (warm)'):
+            runs.append((name, lambda package: project_source_hash_history(
+                apiurl, project, package, 5, True, directory)))
+
+        results = None
+        for name, history in runs:
+            memoize_session_reset()
+            obs.requests = 0
+            start = time.monotonic()
+            result = [list(history(package)) for package in packages]
+            print(f'{name:<14} {obs.requests:>6} requests {time.monotonic() - start:>8.3f}s')
+            if results is not None and result != results:
+                print(f'{name} differs from package_source_hash_history()')
+            results = result
+
+
+if __name__ == '__main__':
+    import argparse
+    from osc import conf
+
+    parser = argparse.ArgumentParser(
+        description='Compare requests of package_source_hash_history() and the source index')
+    parser.add_argument('-A', '--apiurl', metavar='URL', help='API URL')
+    parser.add_argument('--fixture', required=True, help='directory of the recorded responses')
+    parser.add_argument('--record', action='store_true', help='record missing responses from the API')
+    parser.add_argument('project')
+    parser.add_argument('packages', nargs='+')
+    args = parser.parse_args()
+
+    conf.get_config(override_apiurl=args.apiurl)
+    benchmark(conf.config['apiurl'], args.fixture, args.record, args.project, args.packages)
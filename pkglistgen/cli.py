@@ -55,6 +55,7 @@ class CommandLineInterface(ToolBase.CommandLineInterface):
     @cmdln.option('--only-release-packages', action='store_true', help='Generate 000release-packages only')
     @cmdln.option('--only-update-weakremovers', action='store_true', help='Update weakremovers.inc file only')
     @cmdln.option('--custom-cache-tag', help='add custom tag to cache dir to avoid issues when running in parallel')
+    @cmdln.option('-j', '--jobs', type=int, default=1, help='number of processes solving architectures in parallel')
     def do_update_and_solve(self, subcmd, opts):
         """${cmd_name}: update and solve for given scope
 
@@ -105,6 +106,7 @@ class CommandLineInterface(ToolBase.CommandLineInterface):
             try:
                 self.tool.reset()
                 self.tool.dry_run = self.options.dry
+                self.tool.jobs = opts.jobs
                 return self.tool.update_and_solve_target(api, target_project, target_config, main_repo,
                                                          git_url=opts.git_url, project=project, scope=scope,
                                                          engine=Engine[opts.engine],
@@ -118,125 +118,156 @@ class Group(object):
             self.ignore(g)
         self.ignored.add(without)
 
-    def solve(self, use_recommends=False):
-        """ base: list of base groups or None """
-
-        solved = dict()
-        for arch in self.pkglist.filtered_architectures:
-            solved[arch] = dict()
+    def __getstate__(self):
+        # the pkglist holds the solv pools, which can't be pickled. Worker
+        # processes attach their own copy after unpickling.
+        state = self.__dict__.copy()
+        del state['pkglist']
+        return state
+
+    def _lock_jobs(self, pool, locked):
+        jobs = []
+        for lock in locked:
+            sel = pool.select(str(lock), solv.Selection.SELECTION_NAME)
+            # if we can't find it, it probably is not as important
+            if not sel.isempty():
+                jobs += sel.jobs(solv.Job.SOLVER_LOCK)
+        return jobs
+
+    def solve_arch(self, arch, use_recommends):
+        """Solve the group for a single architecture.
+
+        The group itself is not modified, the results are returned as a dict
+        to be merged by solve() - possibly from a worker process.
+        """
+        result = {
+            'solved': dict(),
+            'recommends': dict(),
+            'suggested': dict(),
+            'srcpkgs': dict(),
+            'not_found': [],
+            'unresolvable': dict(),
+        }
+        solved = result['solved']
+
+        pool, solver = self.pkglist.prepare_solver(arch, False, use_recommends)
+
+        # pool.set_debuglevel(10)
+        suggested = result['suggested']
+
+        # packages resulting from explicit recommended expansion
+        extra = []
+
+        # the locks and silent packages are the same for every package,
+        # so only select them once per architecture
+        locked = self.locked | self.pkglist.unwanted
+        common_jobs = self._lock_jobs(pool, locked)
+        for s in self.silents:
+            sel = pool.select(str(s), solv.Selection.SELECTION_NAME | solv.Selection.SELECTION_FLAT)
+            if sel.isempty():
+                self.logger.warning(f'{self.name}.{arch}: silent package {s} not found')
+            else:
+                common_jobs += sel.jobs(solv.Job.SOLVER_INSTALL)
+
+        def solve_one_package(n, group):
+            jobs = list(self.pkglist.lockjobs[arch])
+            sel = pool.select(str(n), solv.Selection.SELECTION_NAME)
+            if sel.isempty():
+                self.logger.debug(f'{self.name}.{arch}: package {n} not found')
+                result['not_found'].append(n)
+                return
+            else:
+                if n in self.expand_recommended:
+                    for s in sel.solvables():
+                        for dep in s.lookup_deparray(solv.SOLVABLE_RECOMMENDS):
+                            # only add recommends that exist as packages
+                            rec = pool.select(dep.str(), solv.Selection.SELECTION_NAME)
+                            if not rec.isempty():
+                                extra.append([dep.str(), f"{group}:recommended:{n}"])
 
-        self.srcpkgs = dict()
-        self.recommends = dict()
-        self.suggested = dict()
-        for arch in self.pkglist.filtered_architectures:
-            pool = self.pkglist.prepare_pool(arch, False)
-            solver = pool.Solver()
-            solver.set_flag(solver.SOLVER_FLAG_IGNORE_RECOMMENDED, not use_recommends)
-            solver.set_flag(solver.SOLVER_FLAG_ADD_ALREADY_RECOMMENDED, use_recommends)
-
-            # pool.set_debuglevel(10)
-            suggested = dict()
-
-            # packages resulting from explicit recommended expansion
-            extra = []
-
-            def solve_one_package(n, group):
-                jobs = list(self.pkglist.lockjobs[arch])
-                sel = pool.select(str(n), solv.Selection.SELECTION_NAME)
-                if sel.isempty():
-                    self.logger.debug(f'{self.name}.{arch}: package {n} not found')
-                    self.not_found.setdefault(n, set()).add(arch)
-                    return
-                else:
-                    if n in self.expand_recommended:
-                        for s in sel.solvables():
-                            for dep in s.lookup_deparray(solv.SOLVABLE_RECOMMENDS):
-                                # only add recommends that exist as packages
-                                rec = pool.select(dep.str(), solv.Selection.SELECTION_NAME)
-                                if not rec.isempty():
-                                    extra.append([dep.str(), f"{group}:recommended:{n}"])
-
-                    jobs += sel.jobs(solv.Job.SOLVER_INSTALL)
-
-                locked = self.locked | self.pkglist.unwanted
-                for lock in locked:
-                    sel = pool.select(str(lock), solv.Selection.SELECTION_NAME)
-                    # if we can't find it, it probably is not as important
-                    if not sel.isempty():
-                        jobs += sel.jobs(solv.Job.SOLVER_LOCK)
-
-                for s in self.silents:
-                    sel = pool.select(str(s), solv.Selection.SELECTION_NAME | solv.Selection.SELECTION_FLAT)
-                    if sel.isempty():
-                        self.logger.warning(f'{self.name}.{arch}: silent package {s} not found')
-                    else:
-                        jobs += sel.jobs(solv.Job.SOLVER_INSTALL)
-
-                problems = solver.solve(jobs)
-                if problems:
-                    for problem in problems:
-                        msg = f'unresolvable: {self.name}:{n}.{arch}: {problem}'
-                        self.logger.debug(msg)
-                        self.unresolvable[arch][n] = str(problem)
-                    return
-
-                for s in solver.get_recommended():
-                    if s.name in locked:
-                        continue
-                    self.recommends.setdefault(s.name, f"{group}:{n}")
-                if n in self.expand_suggested:
-                    for s in solver.get_suggested():
-                        suggested[s.name] = f"{group}:suggested:{n}"
-                        self.suggested.setdefault(s.name, suggested[s.name])
-
-                trans = solver.transaction()
-                if trans.isempty():
-                    self.logger.error('%s.%s: nothing to do', self.name, arch)
-                    return
-
-                for s in trans.newsolvables():
-                    solved[arch].setdefault(s.name, f"{group}:{n}")
-                    if None:
-                        reason, rule = solver.describe_decision(s)
-                        print(self.name, s.name, reason, rule.info().problemstr())
-                    # don't ask me why, but that's how it seems to work
-                    if s.lookup_void(solv.SOLVABLE_SOURCENAME):
-                        src = s.name
-                    else:
-                        src = s.lookup_str(solv.SOLVABLE_SOURCENAME)
-                    self.srcpkgs[src] = f"{group}:{s.name}"
+                jobs += sel.jobs(solv.Job.SOLVER_INSTALL)
 
-            start = time.time()
-            for n, group in self.packages[arch]:
-                solve_one_package(n, group)
+            jobs += common_jobs
 
-            # resetup the pool with ignored conflicts to get supplements from the list
-            pool = self.pkglist.prepare_pool(arch, True)
-            solver = pool.Solver()
-            solver.set_flag(solver.SOLVER_FLAG_IGNORE_RECOMMENDED, not use_recommends)
-            solver.set_flag(solver.SOLVER_FLAG_ADD_ALREADY_RECOMMENDED, use_recommends)
+            problems = solver.solve(jobs)
+            if problems:
+                for problem in problems:
+                    msg = f'unresolvable: {self.name}:{n}.{arch}: {problem}'
+                    self.logger.debug(msg)
+                    result['unresolvable'][n] = str(problem)
+                return
 
-            jobs = list(self.pkglist.lockjobs[arch])
-            locked = self.locked | self.pkglist.unwanted
-            for lock in locked:
-                sel = pool.select(str(lock), solv.Selection.SELECTION_NAME)
-                # if we can't find it, it probably is not as important
-                if not sel.isempty():
-                    jobs += sel.jobs(solv.Job.SOLVER_LOCK)
-
-            for n in list(solved[arch]) + list(suggested):
-                if n in locked:
+            for s in solver.get_recommended():
+                if s.name in locked:
                     continue
-                sel = pool.select(str(n), solv.Selection.SELECTION_NAME)
-                jobs += sel.jobs(solv.Job.SOLVER_INSTALL)
+                result['recommends'].setdefault(s.name, f"{group}:{n}")
+            if n in self.expand_suggested:
+                for s in solver.get_suggested():
+                    suggested.setdefault(s.name, f"{group}:suggested:{n}")
 
-            solver.solve(jobs)
             trans = solver.transaction()
+            if trans.isempty():
+                self.logger.error('%s.%s: nothing to do', self.name, arch)
+                return
+
             for s in trans.newsolvables():
-                solved[arch].setdefault(s.name, f"{group}:expansion")
+                solved.setdefault(s.name, f"{group}:{n}")
+                if None:
+                    reason, rule = solver.describe_decision(s)
+                    print(self.name, s.name, reason, rule.info().problemstr())
+                # don't ask me why, but that's how it seems to work
+                if s.lookup_void(solv.SOLVABLE_SOURCENAME):
+                    src = s.name
+                else:
+                    src = s.lookup_str(solv.SOLVABLE_SOURCENAME)
+                result['srcpkgs'][src] = f"{group}:{s.name}"
+
+        start = time.time()
+        for n, group in self.packages[arch]:
+            solve_one_package(n, group)
+
+        # resetup the pool with ignored conflicts to get supplements from the list
+        pool, solver = self.pkglist.prepare_solver(arch, True, use_recommends)
+
+        jobs = list(self.pkglist.lockjobs[arch])
+        jobs += self._lock_jobs(pool, locked)
+
+        for n in list(solved) + list(suggested):
+            if n in locked:
+                continue
+            sel = pool.select(str(n), solv.Selection.SELECTION_NAME)
+            jobs += sel.jobs(solv.Job.SOLVER_INSTALL)
+
+        solver.solve(jobs)
+        trans = solver.transaction()
+        for s in trans.newsolvables():
+            solved.setdefault(s.name, f"{group}:expansion")
 
-            end = time.time()
-            self.logger.info('%s - solving took %f', self.name, end - start)
+        end = time.time()
+        self.logger.info('%s - solving took %f', self.name, end - start)
+
+        return result
+
+    def solve(self, use_recommends=False):
+        """ base: list of base groups or None """
+
+        solved = dict()
+        self.srcpkgs = dict()
+        self.recommends = dict()
+        self.suggested = dict()
+        # merge in architecture order, so the result does not depend on
+        # whether the architectures were solved in parallel
+        results = self.pkglist.solve_architectures(self, use_recommends)
+        for arch, result in zip(self.pkglist.filtered_architectures, results):
+            solved[arch] = result['solved']
+            for n, reason in result['recommends'].items():
+                self.recommends.setdefault(n, reason)
+            for n, reason in result['suggested'].items():
+                self.suggested.setdefault(n, reason)
+            self.srcpkgs.update(result['srcpkgs'])
+            for n in result['not_found']:
+                self.not_found.setdefault(n, set()).add(arch)
+            self.unresolvable[arch].update(result['unresolvable'])
 
         common = None
         # compute common packages across all architectures
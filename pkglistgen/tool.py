@@ -1,19 +1,26 @@
 import ToolBase
 import glob
+import hashlib
 import logging
+import multiprocessing
 import os
 import re
 import solv
 import shutil
 import subprocess
+import threading
+import time
 import yaml
 
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
 from typing import Any, Mapping, Optional
 
 from lxml import etree as ET
 
+import osc.connection
 from osc.core import checkout_package
 
 from osc.core import http_GET
@@ -27,6 +34,7 @@ from osclib.core import repository_path_expand
 from osclib.core import repository_arch_state
 from osclib.cache_manager import CacheManager
 from osclib.pkglistgen_comments import PkglistComments
+from osclib.repomirror import HEADER_STORE
 from osclib.repomirror import RepoMirror
 
 from urllib.parse import urlparse
@@ -42,12 +50,37 @@ PRODUCT_COMPOSE_SEPERATOR_LINE = '# The following is generated by openSUSE-relea
 
 # share header cache with repochecker
 CACHEDIR = CacheManager.directory('repository-meta')
+# solv files of chunks of headers and the chunks each header is part of
+SOLV_FRAGMENT_DIR = os.path.join(CACHEDIR, '.solv')
+# headers converted by a single rpms2solv call
+SOLV_CHUNK_SIZE = 256
+# chunks remembered per header, headers shared by repositories may be part of several
+SOLV_CHUNK_POINTERS = 4
 
 
 class MismatchedRepoException(Exception):
     """raised on repos that restarted building"""
 
 
+# the PkgListGen instance of a solver worker process
+_worker_pkglist = None
+
+
+def _init_solve_worker(pkglist):
+    global _worker_pkglist
+    _worker_pkglist = pkglist
+    # connections inherited from the parent must not be used by several processes
+    osc.connection.CONNECTION_POOLS.clear()
+
+
+def _solve_arch_worker(group, arch, use_recommends):
+    """Return the solve result and the pool_stats changes of the worker."""
+    group.pkglist = _worker_pkglist
+    stats = dict(_worker_pkglist.pool_stats)
+    result = group.solve_arch(arch, use_recommends)
+    return result, {key: value - stats[key] for key, value in _worker_pkglist.pool_stats.items()}
+
+
 class PkgListGen(ToolBase.ToolBase):
 
     def __init__(self):
@@ -64,6 +97,13 @@ class PkgListGen(ToolBase.ToolBase):
         self.input_dir = '.'
         self.output_dir = '.'
         self.lockjobs = dict()
+        # (arch, ignore_conflicts, repo states) -> (pool, lockjobs)
+        self.pools = dict()
+        self.solvers = dict()
+        self.pool_stats = {'built': 0, 'reused': 0}
+        # number of worker processes solving architectures in parallel
+        self.jobs = 1
+        self.solve_executors = []
         self.ignore_broken = False
         self.unwanted = set()
         self.output = None
@@ -231,6 +271,40 @@ class PkgListGen(ToolBase.ToolBase):
                     if package[0] not in g.solved_packages['*']:
                         self.logger.error(f'Missing {package[0]} in {groupname} for {arch}')
 
+    def start_solve_workers(self):
+        jobs = min(self.jobs, len(self.filtered_architectures))
+        if jobs < 2:
+            return
+        # fork, so the workers inherit the repos and pool cache instead of pickling them
+        context = multiprocessing.get_context('fork')
+        # every worker serves fixed architectures, so it only builds pools for those
+        self.solve_executors = [ProcessPoolExecutor(1, mp_context=context, initializer=_init_solve_worker,
+                                                    initargs=(self,)) for _ in range(jobs)]
+
+    def stop_solve_workers(self):
+        for executor in self.solve_executors:
+            executor.shutdown()
+        self.solve_executors = []
+
+    def solve_architectures(self, group, use_recommends):
+        """Return the solve results of group in filtered_architectures order."""
+        if not self.solve_executors:
+            return [group.solve_arch(arch, use_recommends) for arch in self.filtered_architectures]
+
+        futures = []
+        for i, arch in enumerate(self.filtered_architectures):
+            executor = self.solve_executors[i % len(self.solve_executors)]
+            futures.append(executor.submit(_solve_arch_worker, group, arch, use_recommends))
+
+        results = []
+        for future in futures:
+            result, stats = future.result()
+            # the pools are built and reused in the workers
+            for key, value in stats.items():
+                self.pool_stats[key] += value
+            results.append(result)
+        return results
+
     def expand_repos(self, project: str, repo='standard'):
         return repository_path_expand(self.apiurl, project, repo)
 
@@ -267,7 +341,12 @@ class PkgListGen(ToolBase.ToolBase):
         for p in tocheck_locales - all_grouped:
             self.logger.warning('package %s provides supported locale but is not grouped', p)
 
-    def prepare_pool(self, arch, ignore_conflicts):
+    def _repo_states(self, arch):
+        # check back the repo state to avoid suprises
+        return tuple(repository_arch_state(self.apiurl, project, reponame, arch)
+                     for project, reponame in self.repos)
+
+    def _build_pool(self, arch, ignore_conflicts, states):
         pool = solv.Pool()
         # the i586 DVD is really a i686 one
         if arch == 'i586':
@@ -275,13 +354,11 @@ class PkgListGen(ToolBase.ToolBase):
         else:
             pool.setarch(arch)
 
-        self.lockjobs[arch] = []
+        lockjobs = []
         solvables = set()
 
-        for project, reponame in self.repos:
+        for (project, reponame), state in zip(self.repos, states):
             repo = pool.add_repo(project)
-            # check back the repo state to avoid suprises
-            state = repository_arch_state(self.apiurl, project, reponame, arch)
             if state is None:
                 continue
             s = f'repo-{project}-{reponame}-{arch}-{state}.solv'
@@ -293,7 +370,7 @@ class PkgListGen(ToolBase.ToolBase):
                     solvable.unset(solv.SOLVABLE_OBSOLETES)
                 # only take the first solvable in the repo chain
                 if not self.use_newest_version and solvable.name in solvables:
-                    self.lockjobs[arch].append(pool.Job(solv.Job.SOLVER_SOLVABLE | solv.Job.SOLVER_LOCK, solvable.id))
+                    lockjobs.append(pool.Job(solv.Job.SOLVER_SOLVABLE | solv.Job.SOLVER_LOCK, solvable.id))
                 solvables.add(solvable.name)
 
         pool.addfileprovides()
@@ -302,7 +379,43 @@ class PkgListGen(ToolBase.ToolBase):
         for locale in self.locales:
             pool.set_namespaceproviders(solv.NAMESPACE_LANGUAGE, pool.Dep(locale), True)
 
-        return pool
+        return pool, lockjobs
+
+    def _cached_pool(self, arch, ignore_conflicts):
+        key = (arch, ignore_conflicts, self._repo_states(arch))
+        if key in self.pools:
+            self.pool_stats['reused'] += 1
+        else:
+            # drop pools of outdated repo states
+            for stale in [k for k in self.pools if k[:2] == key[:2]]:
+                del self.pools[stale]
+                for solver_key in [k for k in self.solvers if k[0] == stale]:
+                    del self.solvers[solver_key]
+            self.pools[key] = self._build_pool(*key)
+            self.pool_stats['built'] += 1
+            self.logger.debug('built pool for %s (ignore conflicts: %s)', arch, ignore_conflicts)
+
+        pool, self.lockjobs[arch] = self.pools[key]
+        return key, pool
+
+    def prepare_pool(self, arch, ignore_conflicts):
+        """Return the pool for arch, building it only if the repo states changed.
+
+        The returned pool is shared between callers and must not be modified.
+        self.lockjobs[arch] is set to the lock jobs belonging to that pool.
+        """
+        return self._cached_pool(arch, ignore_conflicts)[1]
+
+    def prepare_solver(self, arch, ignore_conflicts, use_recommends):
+        """Return (pool, solver) for arch, reusing the solver of a cached pool."""
+        key, pool = self._cached_pool(arch, ignore_conflicts)
+        solver = self.solvers.get((key, use_recommends))
+        if solver is None:
+            solver = pool.Solver()
+            solver.set_flag(solver.SOLVER_FLAG_IGNORE_RECOMMENDED, not use_recommends)
+            solver.set_flag(solver.SOLVER_FLAG_ADD_ALREADY_RECOMMENDED, use_recommends)
+            self.solvers[(key, use_recommends)] = solver
+        return pool, solver
 
     # parse file and merge all groups
     def _parse_unneeded(self, filename):
@@ -408,24 +521,112 @@ class PkgListGen(ToolBase.ToolBase):
 
         self.logger.debug('updating %s', d)
 
-        rm = RepoMirror(self.apiurl)
+        rm = RepoMirror(self.apiurl, store=os.path.join(CACHEDIR, HEADER_STORE))
         rm.mirror(d, project, repo, arch)
 
         files = [os.path.join(d, f)
                  for f in os.listdir(d) if f.endswith('.rpm')]
-        suffix = f'.{os.getpid()}.tmp'
-        fh = open(solv_file + suffix, 'w')
-        p = subprocess.Popen(
-            ['rpms2solv', '-m', '-', '-0'], stdin=subprocess.PIPE, stdout=fh)
-        p.communicate(bytes('\0'.join(files), 'utf-8'))
-        fh.close()
-        if p.wait() != 0:
-            raise Exception("rpm2solv failed")
-        os.rename(solv_file + suffix, solv_file)
+        self.write_repo_solv(files, solv_file)
 
         # Create hash file now that solv creation is complete.
         open(solv_file_hash, 'a').close()
 
+    def _solv_chunk_path(self, chunk):
+        return os.path.join(SOLV_FRAGMENT_DIR, 'chunks', chunk[:2], chunk)
+
+    def _solv_chunk_members(self, chunk):
+        """Return the headers converted in chunk or None if it is not cached."""
+        path = self._solv_chunk_path(chunk)
+        try:
+            with open(f'{path}.list') as fh:
+                members = fh.read().split()
+        except FileNotFoundError:
+            return None
+        return members if os.path.exists(f'{path}.solv') else None
+
+    def _solv_chunk(self, rpm_files):
+        """Convert headers by a single rpms2solv call into a chunk and return its solv file.
+
+        Every header keeps the names of the last SOLV_CHUNK_POINTERS chunks it
+        was converted in, the header file name starts with its hdrmd5.
+        """
+        rpm_files = sorted(rpm_files, key=os.path.basename)
+        names = [os.path.basename(rpm_file)[:-4] for rpm_file in rpm_files]
+        chunk = hashlib.sha1('\n'.join(names).encode('utf-8')).hexdigest()
+        path = self._solv_chunk_path(chunk)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        suffix = f'.{os.getpid()}.{threading.get_ident()}.tmp'
+
+        if self._solv_chunk_members(chunk) != names:
+            with open(path + '.solv' + suffix, 'wb') as fh:
+                if subprocess.run(['rpms2solv', '-m', '-'], input=''.join(f'{f}\n' for f in rpm_files),
+                                  stdout=fh, text=True).returncode != 0:
+                    os.unlink(path + '.solv' + suffix)
+                    raise Exception("rpm2solv failed")
+            with open(path + '.list' + suffix, 'w') as fh:
+                fh.write(''.join(f'{name}\n' for name in names))
+            os.rename(path + '.list' + suffix, f'{path}.list')
+            os.rename(path + '.solv' + suffix, f'{path}.solv')
+
+        for name in names:
+            pointer = os.path.join(SOLV_FRAGMENT_DIR, name[:2], name)
+            chunks = [c for c in self._solv_chunk_pointers(name) if c != chunk] + [chunk]
+            os.makedirs(os.path.dirname(pointer), exist_ok=True)
+            with open(pointer + suffix, 'w') as fh:
+                fh.write(''.join(f'{c}\n' for c in chunks[-SOLV_CHUNK_POINTERS:]))
+            os.rename(pointer + suffix, pointer)
+
+        return f'{path}.solv'
+
+    def _solv_chunk_pointers(self, name):
+        try:
+            with open(os.path.join(SOLV_FRAGMENT_DIR, name[:2], name)) as fh:
+                return fh.read().split()
+        except FileNotFoundError:
+            return []
+
+    def write_repo_solv(self, files, solv_file):
+        """Combine the solv chunks of all headers into solv_file.
+
+        Headers are converted by rpms2solv in chunks of SOLV_CHUNK_SIZE which
+        are kept in SOLV_FRAGMENT_DIR. A chunk is reused as long as all of its
+        headers are still in the repository. Only headers not covered by such a
+        chunk are converted again, which makes regenerating a repository with a
+        handful of changed binaries cheap.
+        """
+        start = time.time()
+        headers = {os.path.basename(rpm_file)[:-4]: rpm_file for rpm_file in files}
+        candidates = set()
+        for name in headers:
+            candidates.update(self._solv_chunk_pointers(name))
+
+        fragments = []
+        covered = set()
+        for chunk in sorted(candidates):
+            members = self._solv_chunk_members(chunk)
+            if members and covered.isdisjoint(members) and all(name in headers for name in members):
+                fragments.append(f'{self._solv_chunk_path(chunk)}.solv')
+                covered.update(members)
+
+        uncached = [headers[name] for name in sorted(headers) if name not in covered]
+        batches = [uncached[i:i + SOLV_CHUNK_SIZE] for i in range(0, len(uncached), SOLV_CHUNK_SIZE)]
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            fragments.extend(executor.map(self._solv_chunk, batches))
+
+        pool = solv.Pool()
+        repo = pool.add_repo(os.path.basename(solv_file))
+        for fragment in fragments:
+            if not repo.add_solv(fragment):
+                raise Exception(f'failed to add {fragment}')
+
+        suffix = f'.{os.getpid()}.tmp'
+        fh = solv.xfopen(solv_file + suffix, 'w')
+        repo.write(fh)
+        fh.close()
+        os.rename(solv_file + suffix, solv_file)
+        self.logger.info('%s: converted %d of %d headers in %d chunks in %.1fs', os.path.basename(solv_file),
+                         len(uncached), len(files), len(batches), time.time() - start)
+
     def update_repos(self, architectures):
         for project, repo in self.repos:
             for arch in architectures:
@@ -574,6 +775,17 @@ class PkgListGen(ToolBase.ToolBase):
                 root = ET.parse(fh).getroot()
                 self.locales |= set([lang.text for lang in root.findall('.//linguas/language')])
 
+        self.start_solve_workers()
+        try:
+            modules = self._solve_modules(global_use_recommends)
+        finally:
+            self.stop_solve_workers()
+
+        self._collect_unsorted_packages(modules, self.groups.get('unsorted'))
+        self.logger.info('solv pools: %d built, %d reused',
+                         self.pool_stats['built'], self.pool_stats['reused'])
+
+    def _solve_modules(self, global_use_recommends):
         modules = []
         # the yml parser makes an array out of everything, so
         # we loop a bit more than what we support
@@ -615,7 +827,7 @@ class PkgListGen(ToolBase.ToolBase):
                     for p in overlapped:
                         module.solved_packages[arch].pop(p, None)
 
-        self._collect_unsorted_packages(modules, self.groups.get('unsorted'))
+        return modules
 
     def strip_medium_from_staging(self, path):
         # staging projects don't need source and debug medium - and the glibc source
@@ -23,7 +23,7 @@ from osclib.conf import Config
 from osclib.core import (http_DELETE, http_GET, makeurl,
                          repository_path_expand, repository_path_search,
                          target_archs, source_file_load, source_file_ensure)
-from osclib.repochecks import mirror, parsed_installcheck, CorruptRepos
+from osclib.repochecks import mirror, followup_collapse, parsed_installcheck, CorruptRepos
 from osclib.comments import CommentAPI
 
 
@@ -212,17 +212,9 @@ class RepoChecker():
 
             parsed = parsed_installcheck([pfile] + primaryxmls, arch, target_packages, [])
 
+        outputs = followup_collapse({package: "\n".join(problem['output']) for package, problem in parsed.items()})
         for package in parsed:
-            parsed[package]['output'] = "\n".join(parsed[package]['output'])
-
-        # let's risk a N*N algorithm in the hope that we have a limited N
-        for package1 in parsed:
-            output = parsed[package1]['output']
-            for package2 in parsed:
-                if package1 == package2:
-                    continue
-                output = output.replace(parsed[package2]['output'], 'FOLLOWUP(' + package2 + ')')
-            parsed[package1]['output'] = output
+            parsed[package]['output'] = outputs[package]
 
         for package in parsed:
             parsed[package]['output'] = self._split_and_filter(parsed[package]['output'])
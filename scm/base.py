@@ -14,3 +14,15 @@ class SCMBase(metaclass=abc.ABCMeta):
     ):
         """Checkout a package"""
         pass
+
+    def checkout_key(
+            self,
+            target_project: str,
+            target_package: str,
+            **kwargs
+    ):
+        """
+        Return a key identifying the content checkout_package() would produce
+        or None if it can not be determined.
+        """
+        return None
@@ -0,0 +1,155 @@
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+
+
+def link_tree(source, destination, hardlink=True):
+    """Copy the tree at source to destination using hardlinks if hardlink and possible."""
+    def link(src, dst):
+        try:
+            os.link(src, dst)
+        except OSError:
+            # the destination may live on a different filesystem
+            shutil.copy2(src, dst)
+
+    shutil.copytree(source, destination, symlinks=True, copy_function=link if hardlink else shutil.copy2)
+
+
+class CheckoutCache(object):
+    """
+    Cache of package checkouts keyed by content (expanded srcmd5 or git commit).
+
+    A cached tree is hardlinked into the requested location, so its files are
+    made read-only to keep checks from modifying them in place. Root ignores
+    the file modes, so when running as root the tree is copied instead. Trees
+    not used recently are evicted once all of them exceed max_size bytes.
+    """
+
+    def __init__(self, scm, directory, max_size, logger=None):
+        self.scm = scm
+        self.directory = directory
+        self.max_size = max_size
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.hardlink = os.geteuid() != 0
+        self.stats = {'hits': 0, 'misses': 0, 'bytes_linked': 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode('utf-8')).hexdigest())
+
+    def checkout_package(self, target_project, target_package, pathname, **kwargs):
+        key = self.scm.checkout_key(target_project, target_package, **kwargs)
+        if key is None:
+            return self.scm.checkout_package(target_project, target_package, pathname, **kwargs)
+
+        entry = self.entry_path(key)
+        destination = os.path.join(pathname, target_package)
+        size = self._entry_size(entry)
+        if size is None:
+            self.stats['misses'] += 1
+            size = self._add(key, entry, target_project, target_package, **kwargs)
+            if size is None:
+                # changed during the checkout so not cached
+                return self.scm.checkout_package(target_project, target_package, pathname, **kwargs)
+        else:
+            self.stats['hits'] += 1
+            if self.logger:
+                self.logger.debug(f'using cached checkout of {target_project}/{target_package} {key}')
+
+        try:
+            # mark as recently used
+            os.utime(entry)
+            link_tree(os.path.join(entry, 'tree'), destination, self.hardlink)
+        except OSError:
+            # evicted by another checker in the meantime
+            shutil.rmtree(destination, ignore_errors=True)
+            return self.scm.checkout_package(target_project, target_package, pathname, **kwargs)
+        self.stats['bytes_linked'] += size
+
+    def _entry_size(self, entry):
+        """Return the size of a complete entry or None."""
+        try:
+            with open(os.path.join(entry, 'size')) as f:
+                size, files = (int(x) for x in f.read().split())
+        except (FileNotFoundError, ValueError):
+            return None
+
+        # files unused for long may have been removed by CacheManager pruning
+        if self._count(os.path.join(entry, 'tree'))[1] != files:
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+        return size
+
+    @staticmethod
+    def _count(tree):
+        size = files = 0
+        for directory, _, filenames in os.walk(tree):
+            for filename in filenames:
+                size += os.lstat(os.path.join(directory, filename)).st_size
+                files += 1
+        return size, files
+
+    def _add(self, key, entry, target_project, target_package, **kwargs):
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix='.tmp-')
+        try:
+            self.scm.checkout_package(target_project, target_package, tmp, **kwargs)
+            if key != self.scm.checkout_key(target_project, target_package, **kwargs):
+                # a checkout of the latest revision raced with a commit
+                shutil.rmtree(tmp)
+                return None
+            tree = os.path.join(tmp, 'tree')
+            os.rename(os.path.join(tmp, target_package), tree)
+            for directory, _, filenames in os.walk(tree):
+                for filename in filenames:
+                    path = os.path.join(directory, filename)
+                    if not os.path.islink(path):
+                        os.chmod(path, os.stat(path).st_mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+            size, files = self._count(tree)
+            with open(os.path.join(tmp, 'size'), 'w') as f:
+                f.write(f'{size} {files}\n')
+
+            try:
+                os.rename(tmp, entry)
+            except OSError:
+                # added concurrently or left incomplete, replace it
+                shutil.rmtree(entry, ignore_errors=True)
+                os.rename(tmp, entry)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+        self.evict(keep=entry)
+        return size
+
+    def evict(self, keep=None):
+        with self.lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.directory):
+                entry = os.path.join(self.directory, name)
+                if name.startswith('.tmp-'):
+                    # left behind by an interrupted checkout
+                    if time.time() - os.stat(entry).st_mtime > 24 * 60 * 60:
+                        shutil.rmtree(entry, ignore_errors=True)
+                    continue
+                try:
+                    with open(os.path.join(entry, 'size')) as f:
+                        size = int(f.read().split()[0])
+                    mtime = os.stat(entry).st_mtime
+                except (OSError, ValueError, IndexError):
+                    continue
+                entries.append((mtime, size, entry))
+                total += size
+
+            for mtime, size, entry in sorted(entries):
+                if total <= self.max_size:
+                    break
+                if entry == keep:
+                    continue
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
@@ -1,18 +1,25 @@
 import scm.base
 
 import git
+import hashlib
 import os
+import re
 import shutil
+import threading
 from pathlib import Path
 
 
 class Git(scm.base.SCMBase):
     """SCM interface implementation for Git"""
 
-    def __init__(self, logger, base_url):
+    def __init__(self, logger, base_url, mirror_directory=None):
         self.logger = logger
         self.base_url = base_url
-        pass
+        # when set repositories are cloned from local mirrors which are only
+        # fetched incrementally
+        self.mirror_directory = mirror_directory
+        self.mirror_locks = {}
+        self.mirror_locks_lock = threading.Lock()
 
     @property
     def name(self) -> str:
@@ -98,8 +105,31 @@ class Git(scm.base.SCMBase):
     def package_url(self, target_project: str, target_package: str) -> str:
         return f"{self.base_url}/{target_project}/{target_package}.git"
 
+    def mirror(self, url: str) -> str:
+        """Create or update a local mirror of url and return its path."""
+        path = os.path.join(self.mirror_directory, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.git')
+        with self.mirror_locks_lock:
+            lock = self.mirror_locks.setdefault(path, threading.Lock())
+
+        with lock:
+            if os.path.isdir(path):
+                try:
+                    git.Repo(path).remote('origin').fetch(prune=True)
+                    return path
+                except (git.exc.GitCommandError, git.exc.InvalidGitRepositoryError, ValueError) as e:
+                    self.logger.warning(f'recreating broken mirror of {url}: {e}')
+                    shutil.rmtree(path)
+
+            self.logger.debug(f'mirroring {url}')
+            git.Repo.clone_from(url, path, mirror=True)
+        return path
+
     def clone_repository(self, url: str, dstpath: str, **kwargs):
-        repo = git.Repo.clone_from(url, dstpath)
+        if self.mirror_directory:
+            # The clone shares the objects of the mirror and fetches from it.
+            repo = git.Repo.clone_from(self.mirror(url), dstpath, shared=True)
+        else:
+            repo = git.Repo.clone_from(url, dstpath)
 
         revision = kwargs.get("revision")
         revision_name = kwargs.get("revision_name")
@@ -108,6 +138,18 @@ class Git(scm.base.SCMBase):
 
         return repo
 
+    def checkout_key(
+            self,
+            target_project: str,
+            target_package: str,
+            **kwargs
+    ):
+        # only a full commit hash identifies the content
+        revision = kwargs.get('revision')
+        if revision and re.fullmatch(r'[0-9a-f]{40}|[0-9a-f]{64}', revision):
+            return ('git', revision)
+        return None
+
     def checkout_package(
             self,
             target_project: str,
@@ -1,9 +1,11 @@
 import scm.base
 
 import os
+import re
 import sys
 import shutil
 import osc.core
+from urllib.error import HTTPError
 
 
 class OSC(scm.base.SCMBase):
@@ -37,3 +39,30 @@ class OSC(scm.base.SCMBase):
                 shutil.rmtree(os.path.join(pathname, target_package, '.osc'))
             finally:
                 sys.stdout = _stdout
+
+    def checkout_key(
+            self,
+            target_project: str,
+            target_package: str,
+            **kwargs
+    ):
+        # The srcmd5 of the expanded sources identifies the content, which is
+        # not the case for the requested revision of a link. Requests pin their
+        # sources to the srcmd5 of the expanded sources, so such a revision is
+        # used as is instead of asking for it again.
+        revision = kwargs.get('revision')
+        if revision and re.fullmatch(r'[0-9a-f]{32}', revision):
+            return ('osc', revision, bool(kwargs.get('server_service_files')))
+
+        try:
+            srcmd5 = osc.core.show_upstream_srcmd5(
+                self.apiurl, target_project, target_package,
+                expand=kwargs.get('expand_link', False),
+                revision=kwargs.get('revision'),
+                include_service_files=kwargs.get('server_service_files', False))
+        except HTTPError:
+            # leave the error to the checkout
+            return None
+        if srcmd5 is None:
+            return None
+        return ('osc', srcmd5, bool(kwargs.get('server_service_files')))
@@ -134,6 +134,8 @@ if __name__ == '__main__':
                         help='repository to check, if not specified, use the staging configuration')
     parser.add_argument('-p', '--project', type=str, default='openSUSE:Factory',
                         help='project to check (ex. openSUSE:Factory, openSUSE:Leap:15.1)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes checking architectures in parallel')
     parser.add_argument('-d', '--debug', action='store_true', default=False,
                         help='enable debug information')
     parser.add_argument('-A', '--apiurl', metavar='URL', help='API URL')
@@ -149,6 +151,7 @@ if __name__ == '__main__':
     if not args.repository:
         args.repository = api.cmain_repo
     staging_report = OBSInstallChecker(api, config)
+    staging_report.jobs = args.jobs
 
     if args.debug:
         logging.basicConfig(level=logging.DEBUG)
@@ -1,8 +1,11 @@
 import logging
+import multiprocessing
 import os
 import re
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
+import osc.connection
 import osc.core
 import yaml
 from lxml import etree as ET
@@ -19,6 +22,20 @@ from osclib.memoize import memoize
 SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
 CheckResult = namedtuple('CheckResult', ('success', 'comment'))
 
+# the InstallChecker instance of an architecture worker process
+_worker_checker = None
+
+
+def _init_arch_worker(checker):
+    global _worker_checker
+    _worker_checker = checker
+    # connections inherited from the parent must not be used by several processes
+    osc.connection.CONNECTION_POOLS.clear()
+
+
+def _arch_check_worker(*args):
+    return _worker_checker.arch_check(*args)
+
 
 class InstallChecker(object):
     def __init__(self, api, config):
@@ -38,6 +55,8 @@ class InstallChecker(object):
         self.ignore_duplicated = set(config.get('installcheck-ignore-duplicated-binaries', '').split(' '))
         self.ignore_conflicts = set(config.get('installcheck-ignore-conflicts', '').split(' '))
         self.ignore_deletes = str2bool(config.get('installcheck-ignore-deletes', 'False'))
+        # number of architectures checked in parallel processes
+        self.jobs = 1
 
     def check_required_by(self, fileinfo, provides, requiredby, built_binaries, comments):
         if requiredby.get('name') in built_binaries:
@@ -190,39 +209,20 @@ class InstallChecker(object):
                 if req.get('type') == 'delete':
                     result = self.check_delete_request(req, to_ignore, to_delete, result_comment) and result
 
-        for arch in architectures:
-            # hit the first repository in the target project (if existant)
-            target_pair = None
-            directories = []
-            for pair_project, pair_repository in repository_pairs:
-                # ignore repositories only inherited for config
-                if repository_arch_state(self.api.apiurl, pair_project, pair_repository, arch):
-                    if not target_pair and pair_project == api.project:
-                        target_pair = [pair_project, pair_repository]
-
-                    directories.append(mirror(self.api.apiurl, pair_project, pair_repository, arch))
-
-            if not api.is_adi_project(project):
-                # For "leaky" ring packages in letter stagings, where the
-                # repository setup does not include the target project, that are
-                # not intended to to have all run-time dependencies satisfied.
-                whitelist = self.ring_whitelist
-            else:
-                whitelist = set()
-
-            whitelist |= to_ignore
-            ignore_conflicts = self.ignore_conflicts | to_ignore
-
-            check = self.cycle_check(project, repository, arch)
-            if not check.success:
-                self.logger.warning('Cycle check failed')
-                result_comment.append(check.comment)
-                result = False
+        if not api.is_adi_project(project):
+            # For "leaky" ring packages in letter stagings, where the
+            # repository setup does not include the target project, that are
+            # not intended to to have all run-time dependencies satisfied.
+            whitelist = set(self.ring_whitelist)
+        else:
+            whitelist = set()
 
-            check = self.install_check(directories, arch, whitelist, ignore_conflicts)
+        whitelist |= to_ignore
+        ignore_conflicts = self.ignore_conflicts | to_ignore
+
+        for check in self.arch_checks(project, repository, architectures, repository_pairs, whitelist, ignore_conflicts):
             if not check.success:
-                self.logger.warning('Install check failed')
-                result_comment.append(check.comment)
+                result_comment += check.comment
                 result = False
 
         duplicates = duplicated_binaries_in_repo(self.api.apiurl, project, repository)
@@ -243,6 +243,50 @@ class InstallChecker(object):
 
         return CheckResult(result, result_comment)
 
+    def arch_checks(self, project, repository, architectures, repository_pairs, whitelist, ignore_conflicts):
+        """
+        Return the arch_check() results of architectures in their order.
+
+        With more than one job, the architectures are checked in forked worker
+        processes. Mirroring a directory is still serialized by the lock of
+        RepoMirror.
+        """
+        args = (project, repository, repository_pairs, whitelist, ignore_conflicts)
+        jobs = min(self.jobs, len(architectures))
+        if jobs < 2:
+            return [self.arch_check(arch, *args) for arch in architectures]
+
+        # fork, so the workers inherit the api and configuration instead of pickling them
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(jobs, mp_context=context, initializer=_init_arch_worker,
+                                 initargs=(self,)) as executor:
+            futures = [executor.submit(_arch_check_worker, arch, *args) for arch in architectures]
+            return [future.result() for future in futures]
+
+    def arch_check(self, arch, project, repository, repository_pairs, whitelist, ignore_conflicts):
+        """Mirror the repositories of arch and run the cycle and install check on them."""
+        directories = []
+        for pair_project, pair_repository in repository_pairs:
+            # ignore repositories only inherited for config
+            if repository_arch_state(self.api.apiurl, pair_project, pair_repository, arch):
+                directories.append(mirror(self.api.apiurl, pair_project, pair_repository, arch))
+
+        result = True
+        comments = []
+        check = self.cycle_check(project, repository, arch)
+        if not check.success:
+            self.logger.warning('Cycle check failed')
+            comments.append(check.comment)
+            result = False
+
+        check = self.install_check(directories, arch, whitelist, ignore_conflicts)
+        if not check.success:
+            self.logger.warning('Install check failed')
+            comments.append(check.comment)
+            result = False
+
+        return CheckResult(result, comments)
+
     def buildid(self, project, repository, architecture):
         url = self.api.makeurl(['build', project, repository, architecture], {'view': 'status'})
         root = ET.parse(osc.core.http_GET(url)).getroot()
@@ -0,0 +1,46 @@
+import shutil
+import tempfile
+import unittest
+
+from osclib.cache import SqliteCacheBackend
+
+
+class TestSqliteCacheBackend(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.backend = SqliteCacheBackend(self.directory, max_size=1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def size(self):
+        total = self.backend.db.execute('SELECT size FROM total').fetchone()[0]
+        self.assertEqual(total, self.backend.db.execute('SELECT COALESCE(SUM(size), 0) FROM entry').fetchone()[0])
+        return total
+
+    def test_replace(self):
+        for i in range(20):
+            self.backend.put('https://api.example.com/source/project', 'project', b'x' * (100 + i))
+        self.assertEqual(self.size(), 119)
+
+        self.backend.put('https://api.example.com/source/other', 'other', b'y' * 100)
+        self.assertEqual(self.backend.get('https://api.example.com/source/project', 'project')[0], b'x' * 119)
+        self.assertEqual(self.size(), 219)
+
+    def test_evict(self):
+        for i in range(30):
+            self.backend.put(f'https://api.example.com/source/{i}', None, b'x' * 100)
+        self.assertLessEqual(self.size(), 1000)
+        self.assertIsNotNone(self.backend.get('https://api.example.com/source/29', None))
+
+    def test_resum(self):
+        # databases written without recursive triggers counted replaced rows
+        self.backend.put('https://api.example.com/source/project', 'project', b'x' * 100)
+        self.backend.db.execute('UPDATE total SET size = 1000')
+        self.backend.put('https://api.example.com/source/other', 'other', b'y' * 100)
+        self.assertEqual(self.size(), 200)
+        self.assertIsNotNone(self.backend.get('https://api.example.com/source/project', 'project'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import io
+import unittest
+
+from osclib.cpio import CpioReader
+from osclib.cpio import SyntheticCpio
+
+
+def archive(members):
+    data = b''
+    for name, content in members:
+        data += SyntheticCpio._entry(name, len(content))
+        data += content + b'\0' * ((4 - len(content) % 4) % 4)
+    return data + SyntheticCpio._entry('TRAILER!!!', 0)
+
+
+class TestCpio(unittest.TestCase):
+    def test_members(self):
+        data = archive([('a', b'first'), ('dir/b', b''), ('c', b'123')])
+        members = [(name, size, reader.read()) for name, size, reader in CpioReader(io.BytesIO(data))]
+        self.assertEqual(members, [('a', 5, b'first'), ('dir/b', 0, b''), ('c', 3, b'123')])
+
+    def test_skip_unread(self):
+        data = archive([('a', b'x' * 10000), ('b', b'second')])
+        reader = CpioReader(io.BytesIO(data), bufsize=16)
+        contents = {}
+        for name, size, member in reader:
+            if name == 'a':
+                self.assertEqual(member.read(3), b'xxx')
+                continue
+            contents[name] = member.read()
+        self.assertEqual(contents, {'b': b'second'})
+        self.assertEqual(reader.offset, len(data))
+
+    def test_read_only(self):
+        class ReadOnly:
+            def __init__(self, data):
+                self.fh = io.BytesIO(data)
+
+            def read(self, size):
+                return self.fh.read(min(size, 7))
+
+        data = archive([('a', b'first'), ('b', b'second')])
+        members = [(name, reader.read()) for name, size, reader in CpioReader(ReadOnly(data))]
+        self.assertEqual(members, [('a', b'first'), ('b', b'second')])
+
+    def test_synthetic(self):
+        names = [name for name, size, reader in CpioReader(SyntheticCpio(3, 5))]
+        self.assertEqual(names, ['member-0', 'member-1', 'member-2'])
+
+    def test_truncated(self):
+        data = archive([('a', b'first')])
+        with self.assertRaises(EOFError):
+            for name, size, reader in CpioReader(io.BytesIO(data[:120])):
+                reader.read()
+
+    def test_format(self):
+        with self.assertRaises(NotImplementedError):
+            list(CpioReader(io.BytesIO(b'070707' + b'0' * 104)))
@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from osclib.memoize import SqliteMemoizeBackend
+
+
+class TestSqliteMemoizeBackend(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.backend = SqliteMemoizeBackend(os.path.join(self.directory, 'memoize'), 10, 3)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def count(self):
+        total = self.backend.db.execute('SELECT count FROM total').fetchone()[0]
+        self.assertEqual(total, self.backend.db.execute('SELECT COUNT(*) FROM entry').fetchone()[0])
+        return total
+
+    def test_replace(self):
+        for i in range(30):
+            self.backend.put(b'key', datetime.now(), i)
+        self.assertEqual(self.count(), 1)
+        self.assertEqual(self.backend.get(b'key')[1], 29)
+
+        self.backend.put(b'other', datetime.now(), 'value')
+        self.assertEqual(self.backend.get(b'other')[1], 'value')
+        self.assertEqual(self.count(), 2)
+
+    def test_evict(self):
+        for i in range(25):
+            self.backend.put(str(i).encode(), datetime.now(), i)
+        self.assertLess(self.count(), 10)
+        self.assertEqual(self.backend.get(b'24')[1], 24)
+
+    def test_recount(self):
+        # databases written without recursive triggers counted replaced rows
+        self.backend.put(b'key', datetime.now(), 'value')
+        self.backend.db.execute('UPDATE total SET count = 9')
+        self.backend.put(b'other', datetime.now(), 'value')
+        self.assertEqual(self.count(), 2)
+        self.assertEqual(self.backend.get(b'key')[1], 'value')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,15 @@
+import json
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from lxml import etree as ET
+
+# metrics_release imports from metrics so it has to be imported first.
+import metrics_release  # noqa: F401
+import metrics
+
 from . import OBSLocal
 
 
@@ -9,3 +21,111 @@ class TestMetrics(OBSLocal.TestCase):
         self.osc_user('staging-bot')
         self.execute_script(['--help'])  # Avoids the need to influxdb instance.
         self.assertOutput('metrics.py')
+
+
+class RecordingClient(object):
+    """Stands in for the InfluxDB client and keeps the points like InfluxDB would."""
+
+    def __init__(self):
+        self.data = {}
+
+    def delete_api(self):
+        return self
+
+    def write_api(self, write_options=None):
+        return self
+
+    def delete(self, start, stop, bucket, predicate):
+        start = datetime.fromisoformat(start[:-1]).timestamp()
+        stop = datetime.fromisoformat(stop[:-1]).timestamp()
+        measurement = predicate.split('"')[1]
+        for key in [key for key in self.data if key[0] == measurement and start <= key[2] <= stop]:
+            del self.data[key]
+
+    def write(self, bucket, record, write_precision):
+        for point in record:
+            # Points of a series at the same time are merged.
+            key = (point['measurement'], json.dumps(point['tags'], sort_keys=True), point['time'])
+            self.data.setdefault(key, {}).update(point['fields'])
+
+
+class StagingAPI(object):
+    apiurl = 'https://api.example.com'
+
+    def is_adi_project(self, project):
+        return ':adi:' in project
+
+    def extract_staging_short(self, project):
+        return project.split(':Staging:')[-1]
+
+
+def request(request_id, created, final, staging=None, reviewer=None):
+    root = ET.Element('request', id=str(request_id))
+    ET.SubElement(root, 'action', type='submit')
+    ET.SubElement(root, 'state', name='accepted', when=final)
+    if staging:
+        review = ET.SubElement(root, 'review', state='accepted', by_group='factory-staging', when=created)
+        ET.SubElement(review, 'history', who='staging-bot', when=created)
+        ET.SubElement(root, 'review', state='accepted', by_project=f'openSUSE:Factory:Staging:{staging}',
+                      when=created)
+    if reviewer:
+        review = ET.SubElement(root, 'review', state='accepted', by_user=reviewer, when=created)
+        ET.SubElement(review, 'history', who=reviewer, when=final)
+    ET.SubElement(root, 'history', who='user', when=created)
+    ET.SubElement(root, 'history', who='user', when=final)
+    return root
+
+
+class TestIngestRequests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.requests = []
+        patches = [
+            mock.patch.object(metrics.CacheManager, 'directory', lambda *args: self.directory.name),
+            mock.patch.object(metrics, 'request_search', self.request_search),
+            mock.patch.object(metrics, 'who_workaround_swap', 0, create=True),
+            mock.patch.object(metrics, 'who_workaround_miss', 0, create=True),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def request_search(self, apiurl, project, states, when=None):
+        for request in sorted(self.requests, key=lambda request: int(request.get('id'))):
+            if when is None or request.find('state').get('when') >= when:
+                yield request
+
+    def ingest(self, client, full):
+        metrics.points.clear()
+        metrics.ingest_requests(client, StagingAPI(), 'openSUSE:Factory', full)
+
+    def test_incremental(self):
+        self.requests = [
+            # accepted together by the same staging so their points are merged
+            request(1, '2020-01-01T10:00:00', '2020-01-05T10:00:00', 'A'),
+            request(2, '2020-01-02T10:00:00', '2020-01-05T10:00:00', 'A', 'reviewer'),
+            request(3, '2020-01-03T10:00:00', '2020-01-06T10:00:00', reviewer='reviewer'),
+            request(4, '2020-01-04T10:00:00', '2020-01-08T10:00:00', 'B'),
+        ]
+        incremental = RecordingClient()
+        self.ingest(incremental, True)
+
+        # Request 2 is reopened and accepted again later, request 5 accepted
+        # together with request 4 and request 6 staged before request 4 closed.
+        self.requests[1] = request(2, '2020-01-02T10:00:00', '2020-01-09T10:00:00', 'C', 'other')
+        self.requests.append(request(5, '2020-01-05T12:00:00', '2020-01-08T10:00:00', 'B', 'reviewer'))
+        self.requests.append(request(6, '2020-01-07T10:00:00', '2020-01-10T10:00:00', 'B'))
+        self.ingest(incremental, False)
+
+        full = RecordingClient()
+        self.ingest(full, True)
+        self.assertEqual(incremental.data, full.data)
+
+        # Nothing changed so nothing is written again.
+        self.ingest(incremental, False)
+        self.assertEqual(incremental.data, full.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+import solv
+
+from pkglistgen import tool
+from pkglistgen.tool import PkgListGen
+
+# rpm header tags and types used by synthetic headers
+STRING, STRING_ARRAY, INT32 = 6, 8, 4
+TAGS = {
+    'name': (1000, STRING), 'version': (1001, STRING), 'release': (1002, STRING),
+    'sourcerpm': (1044, STRING), 'arch': (1022, STRING),
+    'providename': (1047, STRING_ARRAY), 'provideflags': (1112, INT32), 'provideversion': (1113, STRING_ARRAY),
+    'requirename': (1049, STRING_ARRAY), 'requireflags': (1048, INT32), 'requireversion': (1050, STRING_ARRAY),
+    'dirindexes': (1116, INT32), 'basenames': (1117, STRING_ARRAY), 'dirnames': (1118, STRING_ARRAY),
+}
+
+
+def header(entries):
+    index = b''
+    data = b''
+    for tag, value in sorted(entries.items(), key=lambda item: TAGS[item[0]][0]):
+        number, kind = TAGS[tag]
+        if kind == INT32:
+            data += b'\0' * (-len(data) % 4)
+            content, count = struct.pack(f'>{len(value)}I', *value), len(value)
+        elif kind == STRING:
+            content, count = value.encode('utf-8') + b'\0', 1
+        else:
+            content, count = b''.join(v.encode('utf-8') + b'\0' for v in value), len(value)
+        index += struct.pack('>IIII', number, kind, len(data), count)
+        data += content
+    return b'\x8e\xad\xe8\x01\0\0\0\0' + struct.pack('>II', len(index) // 16, len(data)) + index + data
+
+
+def rpm(name, requires=()):
+    """Return a minimal binary rpm of name providing itself and owning a file."""
+    lead = b'\xed\xab\xee\xdb\x03\x00' + struct.pack('>HH', 0, 1) + name.encode('utf-8')[:65].ljust(66, b'\0')
+    lead += struct.pack('>HH', 1, 5) + b'\0' * 16
+    return lead + header({}) + header({
+        'name': name, 'version': '1.0', 'release': '1', 'arch': 'x86_64', 'sourcerpm': f'{name}-1.0-1.src.rpm',
+        'providename': [name], 'provideflags': [8], 'provideversion': ['1.0-1'],
+        'requirename': list(requires), 'requireflags': [0] * len(requires), 'requireversion': [''] * len(requires),
+        'dirindexes': [0], 'basenames': [name], 'dirnames': ['/usr/bin/'],
+    })
+
+
+def solvables(path):
+    pool = solv.Pool()
+    repo = pool.add_repo('repo')
+    repo.add_solv(path)
+    result = []
+    for s in repo.solvables:
+        files = [d.str for d in s.Dataiterator(solv.SOLVABLE_FILELIST, None, solv.Dataiterator.SEARCH_FILES)]
+        result.append((s.str(),
+                       sorted(str(dep) for dep in s.lookup_deparray(solv.SOLVABLE_PROVIDES)),
+                       sorted(str(dep) for dep in s.lookup_deparray(solv.SOLVABLE_REQUIRES)),
+                       sorted(files)))
+    return sorted(result)
+
+
+@unittest.skipUnless(shutil.which('rpms2solv'), 'rpms2solv not available')
+class TestWriteRepoSolv(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.headers = os.path.join(self.directory.name, 'headers')
+        os.mkdir(self.headers)
+        self.tool = PkgListGen.__new__(PkgListGen)
+        self.tool.logger = mock.MagicMock()
+        patches = [
+            mock.patch.object(tool, 'SOLV_FRAGMENT_DIR', os.path.join(self.directory.name, 'fragments')),
+            mock.patch.object(tool, 'SOLV_CHUNK_SIZE', 2),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def add(self, number, name, requires=()):
+        path = os.path.join(self.headers, f'{number:032x}-{name}.rpm')
+        with open(path, 'wb') as fh:
+            fh.write(rpm(name, requires))
+        return path
+
+    def assertMerged(self, files):
+        solv_file = os.path.join(self.directory.name, 'repo.solv')
+        single = os.path.join(self.directory.name, 'single.solv')
+        with mock.patch.object(tool.subprocess, 'run', wraps=subprocess.run) as run:
+            self.tool.write_repo_solv(files, solv_file)
+        with open(single, 'wb') as fh:
+            subprocess.run(['rpms2solv'] + files, stdout=fh, check=True)
+        self.assertEqual(solvables(solv_file), solvables(single))
+        return run.call_count
+
+    def test_merged(self):
+        files = [self.add(i, name, ['a'] if name != 'a' else []) for i, name in enumerate('abcde')]
+        # chunks of a and b, c and d, e
+        self.assertEqual(self.assertMerged(files), 3)
+        self.assertEqual(self.assertMerged(files), 0)
+
+        # the chunk of c and d is converted again together with the new f
+        os.unlink(files[2])
+        files = files[:2] + files[3:] + [self.add(5, 'f', ['b'])]
+        self.assertEqual(self.assertMerged(files), 1)
+        self.assertEqual(self.assertMerged(files), 0)
+
+        # a repository sharing a and b reuses their chunk and keeps the other
+        # repository's chunks intact
+        self.assertEqual(self.assertMerged(files[:2] + [self.add(6, 'g')]), 1)
+        self.assertEqual(self.assertMerged(files), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
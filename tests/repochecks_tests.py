@@ -0,0 +1,290 @@
+import os
+import random
+import shutil
+import solv
+import subprocess
+import tempfile
+import time
+import unittest
+import yaml
+
+from osclib import repochecks
+from osclib.repochecks import _fileconflict_candidates
+from osclib.repochecks import _fileconflicts
+from osclib.repochecks import _followup_collapse_quadratic
+from osclib.repochecks import followup_collapse
+from osclib.repochecks import solv_installcheck
+from osclib.repochecks import SCRIPT_PATH
+
+
+def synthetic_outputs(count, seed=0):
+    """Problem outputs shaped like those of installcheck, sharing their tails."""
+    rnd = random.Random(seed)
+    outputs = {}
+    for i in range(count):
+        package = f'package-{i}'
+        lines = [f'can\'t install {package}-1.0-1.1.x86_64:']
+        if i and rnd.random() < 0.6:
+            # depend on an earlier problem, repeating its output
+            other = outputs[f'package-{rnd.randrange(i)}']
+            lines.append(f'  {package}-1.0-1.1.x86_64 requires {other.splitlines()[0][14:-1]}')
+            lines.append(other)
+        else:
+            lines.append(f'  nothing provides lib{rnd.randrange(count // 4 + 1)}.so needed by {package}')
+        outputs[package] = '\n'.join(lines)
+    return outputs
+
+
+class TestFollowupCollapse(unittest.TestCase):
+    def assertParity(self, outputs):
+        self.assertEqual(followup_collapse(outputs), _followup_collapse_quadratic(outputs))
+
+    def test_chain(self):
+        outputs = {
+            'a': 'can\'t install a:\n  nothing provides x',
+            'b': 'can\'t install b:\n  b requires a\ncan\'t install a:\n  nothing provides x',
+            'c': 'can\'t install c:\n  c requires b\ncan\'t install b:\n  b requires a\ncan\'t install a:\n  nothing provides x',
+        }
+        collapsed = followup_collapse(outputs)
+        self.assertEqual(collapsed['a'], outputs['a'])
+        self.assertEqual(collapsed['b'], 'can\'t install b:\n  b requires a\nFOLLOWUP(a)')
+        self.assertEqual(collapsed['c'], 'can\'t install c:\n  c requires b\nFOLLOWUP(b)')
+        self.assertParity(outputs)
+
+    def test_substrings(self):
+        # replacements are not restricted to whole lines or problems
+        self.assertParity({
+            'a': 'nothing provides libfoo.so.1 needed by a',
+            'b': 'libfoo.so.1',
+            'c': 'x',
+            'd': 'a\nnothing provides libfoo.so.1 needed by a\nb',
+            'e': 'provides x\nb',
+            'f': '',
+        })
+
+    def test_synthetic(self):
+        for seed in range(5):
+            self.assertParity(synthetic_outputs(1500, seed))
+
+    def test_scale(self):
+        outputs = synthetic_outputs(10000)
+        start = time.time()
+        followup_collapse(outputs)
+        self.assertLess(time.time() - start, 30)
+
+
+def write_repo(filename, packages):
+    """Write a solv file of packages given as (name, version, arch, {deptype: [dep]})."""
+    pool = solv.Pool()
+    repo = pool.add_repo(filename)
+    flags = {'<': solv.REL_LT, '=': solv.REL_EQ, '>': solv.REL_GT, '>=': solv.REL_GT | solv.REL_EQ}
+    for name, version, arch, deps in packages:
+        solvable = repo.add_solvable()
+        solvable.name = name
+        solvable.evr = version
+        solvable.arch = arch
+        solvable.add_provides(pool.Dep(name).Rel(solv.REL_EQ, pool.Dep(version)))
+        for deptype, names in deps.items():
+            for dep in names:
+                dep = dep.split()
+                dep = pool.Dep(dep[0]) if len(dep) == 1 else pool.Dep(dep[0]).Rel(flags[dep[1]], pool.Dep(dep[2]))
+                getattr(solvable, 'add_' + deptype)(dep)
+    repo.internalize()
+    fh = solv.xfopen(filename, 'w')
+    repo.write(fh)
+    fh.close()
+
+
+def synthetic_repos(directory, count, seed=0):
+    """Write a staging and a base repository with random dependencies."""
+    rnd = random.Random(seed)
+
+    def deps(names):
+        result = {}
+        for deptype in ('requires', 'requires', 'conflicts', 'obsoletes'):
+            if rnd.random() < 0.3:
+                dep = rnd.choice(names)
+                if rnd.random() < 0.3:
+                    dep += rnd.choice([' >= 2-1', ' < 2-1', ' = 1-1'])
+                result.setdefault(deptype, []).append(dep)
+        return result
+
+    names = [f'p{i}' for i in range(count)] + ['missing']
+    base = [(name, rnd.choice(['1-1', '2-1']), rnd.choice(['x86_64', 'noarch']), deps(names))
+            for name in names[:count]]
+    staging = [(name, '3-1', 'x86_64', deps(names)) for name in rnd.sample(names[:count], count // 10)]
+    repos = [os.path.join(directory, 'staging.solv'), os.path.join(directory, 'base.solv')]
+    write_repo(repos[0], staging)
+    write_repo(repos[1], base)
+    return repos, {name: name for name, _, _, _ in staging}
+
+
+class TestSolvInstallcheck(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_problems(self):
+        repos = [os.path.join(self.directory, 'a.solv'), os.path.join(self.directory, 'b.solv')]
+        write_repo(repos[0], [
+            ('ok', '1-1', 'x86_64', {}),
+            ('missing', '1-1', 'x86_64', {'requires': ['libnothere.so']}),
+            ('versioned', '1-1', 'x86_64', {'requires': ['ok >= 2']}),
+            ('chain', '1-1', 'x86_64', {'requires': ['missing']}),
+            ('conflict', '1-1', 'noarch', {'requires': ['ok'], 'conflicts': ['ok']}),
+            ('ignored', '1-1', 'x86_64', {'requires': ['libnothere.so']}),
+        ])
+        write_repo(repos[1], [('ok', '0.9-1', 'x86_64', {})])
+        targets = {name: f'{name}-source' for name in ('ok', 'missing', 'versioned', 'chain', 'conflict', 'ignored')}
+
+        problems = solv_installcheck(repos, 'x86_64', targets, ['ignored'])
+        self.assertEqual(list(problems), ['missing', 'versioned', 'chain', 'conflict'])
+        self.assertEqual(problems['missing'], {
+            'problem': 'missing-1-1.x86_64',
+            'output': ['nothing provides libnothere.so needed by missing-1.x86_64'],
+            'source': 'missing-source'})
+        self.assertEqual(problems['versioned']['output'], [
+            'nothing provides ok >= 2 needed by versioned-1.x86_64',
+            '  (we have ok-1-1.x86_64)',
+            '  (we have ok-0.9-1.x86_64)'])
+        self.assertEqual(problems['chain']['output'], [
+            'package chain-1.x86_64 requires missing, but none of the providers can be installed',
+            'nothing provides libnothere.so needed by missing-1.x86_64'])
+        self.assertEqual(problems['conflict']['output'], [
+            'package conflict-1.noarch requires ok, but none of the providers can be installed',
+            'package conflict-1.noarch conflicts with ok provided by ok-1.x86_64',
+            'package conflict-1.noarch conflicts with ok provided by ok-0.9.x86_64'])
+
+    @unittest.skipUnless(shutil.which('installcheck'), 'installcheck is not installed')
+    def test_parity(self):
+        installcheck = repochecks.INSTALLCHECK
+        repochecks.INSTALLCHECK = shutil.which('installcheck')
+        try:
+            for seed in range(3):
+                repos, targets = synthetic_repos(self.directory, 2000, seed)
+                self.assertEqual(solv_installcheck(repos, 'x86_64', targets, []),
+                                 repochecks.external_installcheck(repos, 'x86_64', targets, []))
+        finally:
+            repochecks.INSTALLCHECK = installcheck
+
+
+def write_headers(directory, packages):
+    """
+    Write a mirrored header directory of packages given as (name, version,
+    [file list lines]), with the susetags snippets as CreatePackageDescr.pm
+    caches them instead of real headers.
+    """
+    os.makedirs(os.path.join(directory, '.cache'))
+    for name, version, files in packages:
+        header = f'{random.getrandbits(128):032x}-{name}.rpm'
+        open(os.path.join(directory, header), 'w').close()
+        with open(os.path.join(directory, '.cache', '2-' + header), 'w') as fh:
+            fh.write(f'=Pkg: {name} {version} 1.1 x86_64\n+Flx:\n')
+            fh.write(''.join(line + '\n' for line in files))
+            fh.write(f'-Flx:\n+Prv:\n{name} = {version}-1.1\n-Prv:\n')
+
+
+def write_susetags(filename, directories):
+    """Write the packages of directories like write_repo_susetags_file.pl."""
+    names = set()
+    with open(filename, 'w') as out:
+        out.write('=Ver: 2.0\n')
+        for directory in directories:
+            for header in sorted(f for f in os.listdir(directory) if f.endswith('.rpm')):
+                name = repochecks._header_name(header)
+                if name not in names:
+                    names.add(name)
+                    with open(os.path.join(directory, '.cache', '2-' + header)) as fh:
+                        out.write(fh.read())
+
+
+def findfileconflicts(filename, targets):
+    p = subprocess.run(['perl', os.path.join(SCRIPT_PATH, '..', 'findfileconflicts'), filename],
+                       stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    return [conflict for conflict in yaml.safe_load(p.stdout) or []
+            if conflict['between'][0][0] in targets or conflict['between'][1][0] in targets]
+
+
+def synthetic_files(rnd, paths, parents):
+    files = []
+    selected = rnd.sample(paths, rnd.randrange(1, 12))
+    if rnd.random() < 0.05:
+        # also a directory of other paths, either as file or as directory
+        selected.append(rnd.choice(parents))
+    for path in selected:
+        kind = rnd.random()
+        if kind < 0.2:
+            files.append(f'40755 0 root:root {path}')
+        elif kind < 0.25:
+            files.append(f'120777 0 root:root {path} -> /elsewhere')
+        elif kind < 0.3:
+            files.append(f'100644 100 root:root {path}')
+        else:
+            files.append(f'{rnd.choice(["100644", "100755"])} 0 root:root {path}')
+    return files
+
+
+class TestFileConflictCandidates(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, repositories):
+        directories = []
+        for i, packages in enumerate(repositories):
+            directories.append(os.path.join(self.directory, str(i)))
+            write_headers(directories[-1], packages)
+        targets = set(name for name, _, _ in repositories[0])
+
+        full = os.path.join(self.directory, 'packages')
+        write_susetags(full, directories)
+        candidates = _fileconflict_candidates(directories, os.path.join(self.directory, 'candidates'))
+        return targets, full, candidates
+
+    def assertSameConflicts(self, repositories):
+        targets, full, candidates = self.write(repositories)
+        self.assertEqual(findfileconflicts(candidates, targets), findfileconflicts(full, targets))
+        return findfileconflicts(full, targets)
+
+    def test_conflicts(self):
+        conflicts = self.assertSameConflicts([
+            [('staged', '2', ['100644 0 root:root /usr/bin/tool', '100644 0 root:root /usr/lib/staged/file',
+                              '40755 0 root:root /usr/share/staged']),
+             ('shadowing', '2', ['100644 0 root:root /usr/share/other'])],
+            [('filesystem', '1', ['120777 0 root:root /bin -> usr/bin', '40755 0 root:root /usr/bin']),
+             ('base', '1', ['100644 0 root:root /bin/tool', '100644 0 root:root /usr/lib/staged']),
+             ('shadowing', '1', ['100644 0 root:root /usr/share/shadowed']),
+             ('unrelated', '1', ['100644 0 root:root /usr/share/shadowed', '100644 0 root:root /usr/share/staged']),
+             ('dir', '1', ['40700 0 root:root /usr/share/staged'])],
+        ])
+        self.assertEqual([(c['between'][0][0], c['between'][1][0]) for c in conflicts],
+                         [('base', 'staged'), ('dir', 'staged'), ('staged', 'unrelated')])
+
+    def test_synthetic(self):
+        rnd = random.Random(0)
+        paths = [f'/usr/{a}/{b}/{c}' for a in 'abcdefgh' for b in range(100) for c in range(10)]
+        parents = [f'/usr/{a}/{b}' for a in 'abcdefgh' for b in range(100)]
+        base = [(f'base{i}', '1', synthetic_files(rnd, paths, parents)) for i in range(1000)]
+        other = [(f'other{i}', '1', synthetic_files(rnd, paths, parents)) for i in range(200)]
+        staging = [(f'base{i}', '2', synthetic_files(rnd, paths, parents)) for i in rnd.sample(range(1000), 10)]
+        staging += [(f'new{i}', '1', synthetic_files(rnd, paths, parents)) for i in range(5)]
+        self.assertTrue(self.assertSameConflicts([staging, base, other]))
+
+    @unittest.skipUnless(hasattr(solv.Repo, 'add_susetags'), 'solv without susetags support')
+    def test_output(self):
+        # The directory of /usr/bin/tool is numbered after the ten of the
+        # unrelated package when searching all packages, which puts it first
+        # in the conflicting files reported by findfileconflicts.
+        targets, full, candidates = self.write([
+            [('staged', '2', ['100644 0 root:root /bin/tool', '100644 0 root:root /y/b', '100644 0 root:root /zzz/a'])],
+            [('unrelated', '1', [f'100644 0 root:root /d{i}/f' for i in range(10)] + ['100644 0 root:root /usr/bin/other'])],
+            [('filesystem', '1', ['120777 0 root:root /bin -> usr/bin', '40755 0 root:root /usr/bin']),
+             ('base', '1', ['100644 0 root:root /usr/bin/tool', '100644 0 root:root /zzz/a'])],
+        ])
+        output = _fileconflicts(full, 'x86_64', targets, [])
+        self.assertEqual(_fileconflicts(full, 'x86_64', targets, [], candidates), output)
+        self.assertIn('  /usr/bin/tool\n  /zzz/a\n', output)
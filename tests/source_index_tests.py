@@ -0,0 +1,207 @@
+import hashlib
+import tempfile
+import unittest
+from unittest import mock
+from io import BytesIO
+from urllib.error import HTTPError
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+from osclib.core import package_source_hash_history
+from osclib.memoize import memoize_session_reset
+from osclib.source_index import project_source_contain
+from osclib.source_index import project_source_hash_history
+from osclib.source_index import project_source_index
+from osclib.source_index import RecordedOBS
+
+APIURL = 'https://api.example.com'
+
+
+def md5(value):
+    return hashlib.md5(value.encode('utf-8')).hexdigest()
+
+
+class SyntheticOBS(object):
+    """Serves the source routes used by the source hash history functions."""
+
+    def __init__(self):
+        # project -> (linked project, {package: [revision contents, link target]})
+        self.projects = {}
+
+    def revisions(self, project, package):
+        return self.projects[project][1][package][0]
+
+    def files(self, project, package, content, expand):
+        files = {'spec': content}
+        target = self.projects[project][1][package][1]
+        if expand and target:
+            files['target'] = self.revisions(*target)[-1]
+        return files
+
+    def srcmd5(self, files):
+        return md5(' '.join(f'{name}={content}' for name, content in sorted(files.items())))
+
+    def http_request(self, method, url, headers=None, data=None, file=None):
+        parts = urlsplit(url)
+        path = parts.path.split('/')[2:]
+        query = parse_qs(parts.query)
+        project = self.projects.get(path[0])
+        if project is None:
+            raise HTTPError(url, 404, 'not found', {}, None)
+
+        if len(path) == 1:
+            out = '<sourceinfolist>'
+            for package in sorted(project[1]):
+                files = self.files(path[0], package, project[1][package][0][-1], True)
+                lsrcmd5 = ''
+                if project[1][package][1]:
+                    lsrcmd5 = ' lsrcmd5="{}"'.format(self.srcmd5(self.files(
+                        path[0], package, project[1][package][0][-1], False)))
+                out += f'<sourceinfo package="{package}" srcmd5="{self.srcmd5(files)}"{lsrcmd5}/>'
+            return BytesIO((out + '</sourceinfolist>').encode('utf-8'))
+
+        if path[1] == '_meta':
+            link = f'<link project="{project[0]}"/>' if project[0] else ''
+            return BytesIO(f'<project name="{path[0]}">{link}</project>'.encode('utf-8'))
+
+        if path[1] not in project[1]:
+            raise HTTPError(url, 404, 'not found', {}, None)
+        contents, target = project[1][path[1]]
+
+        if path[-1] == '_link':
+            if not target:
+                raise HTTPError(url, 404, 'not found', {}, None)
+            return BytesIO(f'<link project="{target[0]}" package="{target[1]}" cicount="copy"/>'.encode('utf-8'))
+
+        if path[-1] == '_history':
+            out = '<revisionlist>'
+            for rev, content in enumerate(contents, 1):
+                srcmd5 = self.srcmd5(self.files(path[0], path[1], content, False))
+                out += (f'<revision rev="{rev}" vrev="{rev}"><srcmd5>{srcmd5}</srcmd5><version>1</version>'
+                        f'<time>{rev}</time><user>user</user></revision>')
+            return BytesIO((out + '</revisionlist>').encode('utf-8'))
+
+        expand = 'expand' in query
+        for content in contents:
+            files = self.files(path[0], path[1], content, False)
+            if self.srcmd5(files) == query['rev'][0]:
+                files = self.files(path[0], path[1], content, expand)
+                out = '<directory>'
+                for name, content in sorted(files.items()):
+                    out += f'<entry name="{name}" md5="{md5(content)}"/>'
+                return BytesIO((out + '</directory>').encode('utf-8'))
+        raise HTTPError(url, 400, 'no such revision', {}, None)
+
+
+class TestSourceIndex(unittest.TestCase):
+    def setUp(self):
+        self.obs = SyntheticOBS()
+        self.obs.projects = {
+            'base': (None, {
+                'a': (['a1', 'a2', 'a3'], None),
+                'b': ([f'b{i}' for i in range(1, 9)], None),
+                'c': (['c1'], None),
+            }),
+            'update': ('base', {
+                'a': (['a3', 'a4'], None),
+                'b': (['b9'], None),
+                'd': (['d1'], ('base', 'c')),
+            }),
+        }
+        self.directory = tempfile.TemporaryDirectory()
+        self.fixture = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+        self.fixture.cleanup()
+        memoize_session_reset()
+
+    def http_request(self, method, url, headers=None, data=None, file=None):
+        self.requests.append(url)
+        return self.obs.http_request(method, url, headers, data, file)
+
+    def histories(self, history, limit):
+        memoize_session_reset()
+        self.requests = []
+        with mock.patch('osc.connection.http_request', self.http_request):
+            return {(package, include_project_link): list(history(APIURL, 'update', package, limit, include_project_link))
+                    for package in ('a', 'b', 'c', 'd', 'e') for include_project_link in (False, True)}
+
+    def index_history(self, *args):
+        return project_source_hash_history(*args, directory=self.directory.name)
+
+    def test_history(self):
+        for limit in (1, 5, None):
+            expected = self.histories(package_source_hash_history, limit)
+            requests = self.requests
+            self.assertEqual(self.histories(self.index_history, limit), expected)
+            self.assertLess(len(self.requests), len(requests))
+
+            # Unchanged projects only cost the listing and project meta plus
+            # the history of packages which may be provided by the link.
+            self.assertEqual(self.histories(self.index_history, limit), expected)
+            self.assertTrue(all(url.endswith(('nofilename=1', '/_meta', '/c/_history', '/e/_history'))
+                                for url in self.requests))
+
+    def test_cold(self):
+        # A cold index hashes no more revisions than the history it replaces,
+        # including those of the linked project.
+        for limit in (1, 2):
+            expected = self.histories(package_source_hash_history, limit)
+            requests = self.requests
+            self.directory.cleanup()
+            self.assertEqual(self.histories(self.index_history, limit), expected)
+            hashed = [url for url in self.requests if 'rev=' in url]
+            self.assertLessEqual(len(hashed), len([url for url in requests if 'rev=' in url]))
+
+    def test_contain(self):
+        expected = self.histories(package_source_hash_history, None)
+        memoize_session_reset()
+        with mock.patch('osc.connection.http_request', self.obs.http_request):
+            for package in ('a', 'b', 'c', 'd', 'e'):
+                for source_hash in set(expected[('a', True)] + expected[('b', True)] + expected[('d', True)]):
+                    self.assertEqual(project_source_contain(APIURL, 'update', package, source_hash, self.directory.name),
+                                     source_hash in expected[(package, True)], (package, source_hash))
+
+        # Once indexed matches are found without hashing any revision.
+        memoize_session_reset()
+        self.requests = []
+        with mock.patch('osc.connection.http_request', self.http_request):
+            source_hash = expected[('b', True)][-1]
+            self.assertTrue(project_source_contain(APIURL, 'update', 'b', source_hash, self.directory.name))
+        self.assertFalse([url for url in self.requests if 'rev=' in url])
+
+    def test_update(self):
+        self.histories(self.index_history, None)
+
+        self.obs.projects['update'][1]['a'][0].append('a5')
+        self.obs.projects['base'][1]['c'][0].append('c2')
+        expected = self.histories(package_source_hash_history, None)
+        self.assertEqual(self.histories(self.index_history, None), expected)
+        # listing and meta of both projects, history of the missing c and e,
+        # history and link of a and the link copy d plus their new hashes
+        self.assertEqual(len(self.requests), 2 + 2 + 2 + 2 * 3)
+
+        index = project_source_index(APIURL, 'update', self.directory.name)
+        source_hash = expected[('a', False)][0]
+        self.assertEqual([package for package, srcmd5 in index.find(source_hash)], ['a'])
+
+    def test_recorded(self):
+        recorded = RecordedOBS(self.fixture.name, record=True)
+        with mock.patch('osc.connection.http_request', self.obs.http_request), recorded.patch():
+            expected = [list(package_source_hash_history(APIURL, 'update', 'b', 5, True))]
+        # history, link and revision in update, project meta and then history,
+        # link and revisions in base
+        self.assertEqual(recorded.requests, 3 + 1 + 2 + 4)
+
+        memoize_session_reset()
+        replay = RecordedOBS(self.fixture.name)
+        with replay.patch():
+            self.assertEqual([list(package_source_hash_history(APIURL, 'update', 'b', 5, True))], expected)
+            with self.assertRaises(LookupError):
+                list(self.index_history(APIURL, 'update', 'b', 5, True))
+        self.assertEqual(replay.requests, recorded.requests + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()